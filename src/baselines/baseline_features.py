@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Field parsing, sender histories and the shared loader live with the preprocessing stage.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "data_preprocessing"))
+from dataset_io import is_parquet, iter_records, load_frame
+from trajectory_features import TRAJECTORY_FIELDS
+from utils_data import TEXT_FIELDS, fields_from_text
+
+# Numeric DEFAULT_COLMAP fields used as model inputs. Vehicle ids and the receive time
+# identify a scenario rather than a behaviour, so they are left out.
+RAW_FEATURES = [
+    "hv_pos_x", "hv_pos_y", "hv_speed", "hv_heading",
+    "rv_pos_x", "rv_pos_y", "rv_speed", "rv_heading",
+    "target_id", "eebl_warn", "ima_warn",
+]
+DERIVED_FEATURES = ["hv_rv_distance", "speed_diff", "heading_diff"]
+META_COLUMNS = ["id", "attack_type", "label", "msg_rcv_time", "source_file"]
+
+def feature_names(trajectory: bool) -> List[str]:
+    return RAW_FEATURES + DERIVED_FEATURES + (TRAJECTORY_FIELDS if trajectory else [])
+
+def numeric_fields(df: pd.DataFrame) -> pd.DataFrame:
+    """TEXT_FIELDS as floats: stored columns where present (Parquet), else parsed from `text`."""
+    names = [name for name, _ in TEXT_FIELDS]
+    stored = [c for c in names if c in df.columns and df[c].notna().any()]
+    if len(stored) == len(names) or "text" not in df.columns:
+        return df.reindex(columns=names).apply(pd.to_numeric, errors="coerce")
+    return fields_from_text(df["text"].tolist()).set_axis(df.index)
+
+def feature_matrix(df: pd.DataFrame, names: Sequence[str]) -> np.ndarray:
+    """float32 matrix with columns `names` (NaN where a field is missing, e.g. a pair's first message)."""
+    f = numeric_fields(df)
+    f["hv_rv_distance"] = np.hypot(f["hv_pos_x"] - f["rv_pos_x"], f["hv_pos_y"] - f["rv_pos_y"])
+    f["speed_diff"] = f["hv_speed"] - f["rv_speed"]
+    f["heading_diff"] = ((f["hv_heading"] - f["rv_heading"] + 180.0) % 360.0 - 180.0).abs()
+    for c in TRAJECTORY_FIELDS:
+        f[c] = pd.to_numeric(df[c], errors="coerce") if c in df.columns else np.nan
+    return f[list(names)].to_numpy(dtype=np.float32)
+
+def has_trajectory(df: pd.DataFrame) -> bool:
+    return "traj_seq" in df.columns and df["traj_seq"].notna().any()
+
+def input_columns(path: Path) -> List[str]:
+    """Columns to load: Parquet stores the numeric fields, JSONL carries them in `text`."""
+    names = [name for name, _ in TEXT_FIELDS if name not in META_COLUMNS]
+    return META_COLUMNS + (names if is_parquet(path) else ["text"]) + TRAJECTORY_FIELDS
+
+def load_features_frame(path: Path, limit: Optional[int] = None, extra_columns: Sequence[str] = ()) -> pd.DataFrame:
+    columns = input_columns(Path(path))
+    return load_frame(Path(path), columns=columns + [c for c in extra_columns if c not in columns], limit=limit)
+
+def iter_frames(path: Path, chunksize: int = 200_000, limit: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """The input in DataFrame chunks of `chunksize` records, so scoring runs in bounded memory."""
+    columns = input_columns(Path(path))
+    buf: List[Dict[str, Any]] = []
+    n = 0
+    for rec in iter_records(Path(path), columns=columns):
+        buf.append(rec)
+        n += 1
+        if len(buf) >= chunksize or (limit is not None and n >= limit):
+            yield pd.DataFrame.from_records(buf, columns=columns)
+            buf = []
+            if limit is not None and n >= limit:
+                return
+    if buf:
+        yield pd.DataFrame.from_records(buf, columns=columns)
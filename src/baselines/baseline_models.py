@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+try:
+    import joblib
+except Exception:
+    joblib = None
+
+from baseline_features import RAW_FEATURES, feature_matrix
+
+BUNDLE_VERSION = 1
+POOLED = "ALL"  # attacker-vs-genuine model over every attack type; used for keys without their own model
+MODEL_KINDS = ["hgb", "logreg"]
+
+def build_estimator(kind: str, seed: int = 42):
+    if kind == "hgb":
+        # handles NaN natively (first message of a sender, unparsable fields)
+        return HistGradientBoostingClassifier(max_iter=200, learning_rate=0.1, random_state=seed)
+    if kind == "logreg":
+        return make_pipeline(SimpleImputer(strategy="median"), StandardScaler(), LogisticRegression(max_iter=1000))
+    raise ValueError(f"Unknown model kind: {kind}. Available: {MODEL_KINDS}")
+
+def _require_joblib() -> None:
+    if joblib is None:
+        raise ImportError("joblib package not installed. Run: pip install scikit-learn")
+
+class BaselineBundle:
+    """One binary classifier per attack key (that attack vs Genuine) plus a pooled fallback.
+
+    Attack keys are chosen per record exactly as in run_prompting.py: a fixed `--attack`,
+    or the record's attack_type; keys without a model of their own use the pooled model.
+    """
+
+    def __init__(self, kind: str, features: List[str], threshold: float = 0.5):
+        self.kind = kind
+        self.features = list(features)
+        self.threshold = float(threshold)
+        self.models: Dict[str, Any] = {}
+        self.train_counts: Dict[str, Dict[str, int]] = {}
+
+    def fit(self, df: pd.DataFrame, attacks: Optional[Sequence[str]] = None, min_rows: int = 20,
+            seed: int = 42) -> "BaselineBundle":
+        keep = df["label"].isin(["attacker", "genuine"]).to_numpy()
+        df = df[keep]
+        X = feature_matrix(df, self.features)
+        y = (df["label"] == "attacker").to_numpy()
+        at = df["attack_type"].astype(str).to_numpy()
+        genuine = ~y
+        if attacks is None:
+            attacks = sorted(set(at[y]))
+        jobs = [(POOLED, np.ones(len(df), dtype=bool))] + [(a, (at == a) | genuine) for a in attacks]
+        for key, rows in jobs:
+            n_pos, n_neg = int(y[rows].sum()), int((~y[rows]).sum())
+            if min(n_pos, n_neg) < min_rows:
+                print(f"Skipping {key}: {n_pos} attacker / {n_neg} genuine rows (< --min_rows {min_rows})")
+                continue
+            self.models[key] = build_estimator(self.kind, seed).fit(X[rows], y[rows])
+            self.train_counts[key] = {"attacker": n_pos, "genuine": n_neg}
+        if POOLED not in self.models:
+            raise ValueError("Not enough labelled rows of both classes to train the pooled model.")
+        return self
+
+    def predict_proba(self, df: pd.DataFrame, attack_keys: Sequence[Any]) -> np.ndarray:
+        """P(attacker) per row; NaN where none of the raw fields could be read."""
+        X = feature_matrix(df, self.features)
+        keys = np.asarray([str(k) for k in attack_keys], dtype=object)
+        p = np.full(len(df), np.nan)
+        for key in np.unique(keys):
+            rows = keys == key
+            p[rows] = self.models.get(key, self.models[POOLED]).predict_proba(X[rows])[:, 1]
+        p[np.isnan(X[:, :len(RAW_FEATURES)]).all(axis=1)] = np.nan
+        return p
+
+    def labels(self, p: np.ndarray) -> np.ndarray:
+        return np.where(np.isnan(p), "unknown", np.where(p >= self.threshold, "attacker", "genuine"))
+
+    def save(self, path: Path) -> None:
+        _require_joblib()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        joblib.dump({"version": BUNDLE_VERSION, **self.__dict__}, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "BaselineBundle":
+        _require_joblib()
+        d = joblib.load(path)
+        if d.pop("version", None) != BUNDLE_VERSION:
+            raise ValueError(f"Unsupported baseline bundle: {path}")
+        bundle = cls(d["kind"], d["features"], d["threshold"])
+        bundle.__dict__.update(d)
+        return bundle
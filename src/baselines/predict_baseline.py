@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from tqdm import tqdm
+
+from baseline_features import iter_frames
+from baseline_models import BaselineBundle
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Score records with a trained baseline bundle (run_prompting.py output schema).")
+    ap.add_argument("--model", required=True, help="Bundle written by train_baseline.py.")
+    ap.add_argument("--input_jsonl", required=True, help="Input JSONL file or Parquet dataset directory.")
+    ap.add_argument("--output_jsonl", required=True)
+    ap.add_argument("--attack", default=None, help="Optional fixed attack key (else use item['attack_type']).")
+    ap.add_argument("--max_rows", type=int, default=None)
+    ap.add_argument("--chunksize", type=int, default=200_000, help="Records scored per vectorized chunk.")
+    return ap.parse_args()
+
+def main() -> None:
+    args = parse_args()
+    bundle = BaselineBundle.load(Path(args.model))
+    if args.attack and args.attack not in bundle.models:
+        print(f"No model for '{args.attack}' in the bundle; using the pooled model. Trained: {list(bundle.models)}")
+
+    out = Path(args.output_jsonl)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    n = 0
+    t0 = time.perf_counter()
+    pbar = tqdm(desc=f"Scoring ({bundle.kind})", unit="rec")
+    with out.open("w", encoding="utf-8") as w:
+        for df in iter_frames(Path(args.input_jsonl), chunksize=args.chunksize, limit=args.max_rows):
+            keys = [args.attack] * len(df) if args.attack else df["attack_type"].tolist()
+            p = bundle.predict_proba(df, keys)
+            preds = bundle.labels(p)
+            # same keys and json.dumps lines as run_prompting.py; raw_text carries P(attacker)
+            columns = zip(df["id"].tolist(), df["attack_type"].tolist(), df["label"].tolist(), preds.tolist(),
+                          p.tolist(), df["msg_rcv_time"].tolist(), df["source_file"].tolist())
+            for rec_id, attack_type, label, pred, prob, t, src in columns:
+                rec = {
+                    "id": rec_id,
+                    "attack_type": attack_type,
+                    "label": label,
+                    "pred": pred,
+                    "mode": "baseline",
+                    "provider": "sklearn",
+                    "model": bundle.kind,
+                    "raw_text": None if prob != prob else f"{prob:.4f}",
+                    "msg_rcv_time": None if t != t else t,
+                    "source_file": src,
+                }
+                w.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            n += len(df)
+            pbar.update(len(df))
+    pbar.close()
+    dt = time.perf_counter() - t0
+    print(f"Wrote predictions: {out}  (n={n}, {n / max(dt, 1e-9) * 60:,.0f} records/min)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from baseline_features import feature_names, has_trajectory, load_features_frame
+from baseline_models import MODEL_KINDS, BaselineBundle
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Train per-attack scikit-learn baselines on the numeric log fields.")
+    ap.add_argument("--train_jsonl", required=True, help="Training split (e.g. data/splits/dev.jsonl) or Parquet dataset.")
+    ap.add_argument("--model_out", required=True, help="Output bundle (joblib), e.g. results/baseline_hgb.joblib")
+    ap.add_argument("--model", default="hgb", choices=MODEL_KINDS,
+                    help="hgb = histogram gradient boosting, logreg = logistic regression.")
+    ap.add_argument("--attacks", nargs="*", default=None, help="Attack keys to train (default: every attack in the data).")
+    ap.add_argument("--trajectory", default="auto", choices=["auto", "on", "off"],
+                    help="Use traj_* fields (auto = when the training data has them).")
+    ap.add_argument("--min_rows", type=int, default=20, help="Skip attack keys with fewer rows of either class.")
+    ap.add_argument("--threshold", type=float, default=0.5, help="P(attacker) at or above this predicts attacker.")
+    ap.add_argument("--max_rows", type=int, default=None)
+    ap.add_argument("--seed", type=int, default=42)
+    return ap.parse_args()
+
+def main() -> None:
+    args = parse_args()
+    df = load_features_frame(Path(args.train_jsonl), limit=args.max_rows)
+    trajectory = has_trajectory(df) if args.trajectory == "auto" else args.trajectory == "on"
+    print(f"Training rows: {len(df)}  (trajectory features: {'on' if trajectory else 'off'})")
+
+    t0 = time.perf_counter()
+    bundle = BaselineBundle(args.model, feature_names(trajectory), threshold=args.threshold)
+    bundle.fit(df, attacks=args.attacks, min_rows=args.min_rows, seed=args.seed)
+    print(f"Trained {len(bundle.models)} {args.model} models in {time.perf_counter() - t0:.1f}s")
+    print(json.dumps(bundle.train_counts, indent=2))
+
+    out = Path(args.model_out)
+    bundle.save(out)
+    print(f"Wrote baseline bundle: {out}")
+
+if __name__ == "__main__":
+    main()
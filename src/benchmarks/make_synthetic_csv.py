@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+ATTACK_TYPES = [
+    "Genuine", "DoS", "FakeEBLJustAttack", "IMAIHighSpeed", "RandomPosition",
+    "RandomSpeedOffset", "SuddenAppearance", "TargetedConstantPosition",
+]
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Write synthetic MisbehaviorX-shaped CSVs (all DEFAULT_COLMAP columns).")
+    ap.add_argument("--out_dir", required=True)
+    ap.add_argument("--rows", type=int, default=10_000)
+    ap.add_argument("--n_files", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=42)
+    return ap.parse_args()
+
+def write_synthetic_csvs(out_dir: Path, rows: int, n_files: int, seed: int, chunk: int = 500_000) -> List[Path]:
+    """MisbehaviorX-shaped CSVs with every DEFAULT_COLMAP column, generated in bounded chunks."""
+    rng = np.random.default_rng(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    per_file = [rows // n_files + (1 if i < rows % n_files else 0) for i in range(n_files)]
+    paths = []
+    for i, n_rows in enumerate(per_file):
+        path = out_dir / f"scenario_{i:03d}.csv"
+        t0 = 0.0
+        for start in range(0, n_rows, chunk):
+            n = min(chunk, n_rows - start)
+            t = t0 + np.cumsum(rng.exponential(0.01, n))
+            t0 = float(t[-1])
+            hv_x = rng.uniform(0, 5000, n)
+            hv_y = rng.uniform(0, 5000, n)
+            df = pd.DataFrame({
+                "rv_id": rng.integers(0, 500, n),
+                "hv_id": rng.integers(0, 500, n),
+                "msg_rcv_time": t.round(3),
+                "hv_pos_x": hv_x.round(2),
+                "hv_pos_y": hv_y.round(2),
+                "hv_speed": rng.uniform(0, 35, n).round(2),
+                "hv_heading": rng.uniform(0, 360, n).round(2),
+                "rv_pos_x": (hv_x + rng.normal(0, 50, n)).round(2),
+                "rv_pos_y": (hv_y + rng.normal(0, 50, n)).round(2),
+                "rv_speed": rng.uniform(0, 35, n).round(2),
+                "rv_heading": rng.uniform(0, 360, n).round(2),
+                "target_id": -1,
+                "eebl_warn": (rng.random(n) < 0.02).astype(int),
+                "ima_warn": (rng.random(n) < 0.02).astype(int),
+                "attack_type": rng.choice(ATTACK_TYPES, n, p=[0.65] + [0.05] * 7),
+            })
+            df.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+        paths.append(path)
+    return paths
+
+def main() -> None:
+    args = parse_args()
+    paths = write_synthetic_csvs(Path(args.out_dir), args.rows, args.n_files, args.seed)
+    print(f"Wrote {args.rows} rows to {len(paths)} CSVs in {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+SRC = Path(__file__).resolve().parents[1]
+REPO = SRC.parent
+
+SCALES = {"small": 10_000, "medium": 1_000_000, "large": 10_000_000}
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="End-to-end pipeline benchmark on synthetic MisbehaviorX-shaped data.")
+    ap.add_argument("--scale", choices=list(SCALES), default="small",
+                    help="small=10k, medium=1M, large=10M CSV rows (overridden by --rows).")
+    ap.add_argument("--rows", type=int, default=None)
+    ap.add_argument("--n_files", type=int, default=4, help="Number of CSV files to spread the rows over.")
+    ap.add_argument("--prompt_rows", type=int, default=20_000,
+                    help="Rows sent through run_prompting.py (synthetic zero-latency client).")
+    ap.add_argument("--workers", type=int, default=1, help="Passed to csv_to_jsonl.py --workers.")
+    ap.add_argument("--work_dir", default=None, help="Keep generated data here (default: a temp dir).")
+    ap.add_argument("--history", default="results/bench_history.jsonl", help="JSONL file each run is appended to.")
+    ap.add_argument("--baseline", default=None, help="Baseline JSON to compare against (regressions exit 1).")
+    ap.add_argument("--save_baseline", default=None, help="Write this run as a baseline JSON.")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown vs baseline (0.2 = 20%%).")
+    ap.add_argument("--repeat", type=int, default=1,
+                    help="Run each stage N times and keep the fastest (small scales are start-up dominated).")
+    ap.add_argument("--seed", type=int, default=42)
+    return ap.parse_args()
+
+def run_once(name: str, cmd: List[str], rows: int) -> Dict[str, Any]:
+    """Run one pipeline script as a subprocess; measure wall time and its own peak RSS."""
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    peak_rss_mb: Optional[float] = None
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak_rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    else:  # Windows: no per-child rusage
+        proc.wait()
+    wall = time.perf_counter() - t0
+    err = proc.stderr.read().decode("utf-8", "replace") if proc.stderr else ""
+    if proc.returncode != 0:
+        raise RuntimeError(f"Stage '{name}' failed ({proc.returncode}):\n{err[-2000:]}")
+    return {
+        "rows": rows,
+        "wall_s": wall,
+        "rows_per_s": rows / wall if wall > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+def run_stage(name: str, cmd: List[str], rows: int, repeat: int = 1) -> Dict[str, Any]:
+    runs = [run_once(name, cmd, rows) for _ in range(max(1, repeat))]
+    return min(runs, key=lambda r: r["wall_s"])
+
+def count_lines(path: Path) -> int:
+    with path.open("rb") as f:
+        return sum(1 for _ in f)
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Stages whose throughput fell by more than `tolerance` relative to the baseline."""
+    out = []
+    for name, cur in current["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base:
+            continue
+        if cur["rows_per_s"] < base["rows_per_s"] / (1.0 + tolerance):
+            out.append(f"{name}: {cur['rows_per_s']:.0f} rows/s vs baseline {base['rows_per_s']:.0f} rows/s")
+    return out
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def main() -> None:
+    args = parse_args()
+    rows = args.rows or SCALES[args.scale]
+    py = sys.executable
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(args.work_dir) if args.work_dir else Path(tmp)
+        work.mkdir(parents=True, exist_ok=True)
+        csv_dir = work / "csv"
+        prompts = work / "prompts.jsonl"
+        splits = work / "splits"
+        preds = work / "preds.jsonl"
+
+        # generate in a child so this process stays small: forked stages inherit its RSS high-water mark
+        t0 = time.perf_counter()
+        subprocess.run([py, str(SRC / "benchmarks" / "make_synthetic_csv.py"), "--out_dir", str(csv_dir),
+                        "--rows", str(rows), "--n_files", str(args.n_files), "--seed", str(args.seed)],
+                       check=True, stdout=subprocess.DEVNULL)
+        print(f"Generated {rows} rows in {args.n_files} CSVs ({time.perf_counter() - t0:.1f}s)")
+
+        stages: Dict[str, Dict[str, Any]] = {}
+        stages["csv_to_jsonl"] = run_stage("csv_to_jsonl", [
+            py, str(SRC / "data_preprocessing" / "csv_to_jsonl.py"),
+            "--input", str(csv_dir), "--output", str(prompts), "--workers", str(args.workers),
+        ], rows, args.repeat)
+        stages["sample_subset"] = run_stage("sample_subset", [
+            py, str(SRC / "data_preprocessing" / "sample_subset.py"),
+            "--input_jsonl", str(prompts), "--out_dir", str(splits), "--seed", str(args.seed),
+        ], rows, args.repeat)
+        n_prompt = min(args.prompt_rows, count_lines(splits / "test.jsonl"))
+        stages["run_prompting"] = run_stage("run_prompting", [
+            py, str(SRC / "prompting" / "run_prompting.py"),
+            "--mode", "zero_shot", "--attack", "DoS", "--provider", "synthetic",
+            "--provider_options", json.dumps({"latency_ms": 0, "latency_sigma": 0}), "--model", "bench",
+            "--input_jsonl", str(splits / "test.jsonl"), "--output_jsonl", str(preds), "--max_rows", str(n_prompt),
+        ], n_prompt, args.repeat)
+        stages["compute_metrics"] = run_stage("compute_metrics", [
+            py, str(SRC / "evaluation" / "compute_metrics.py"),
+            "--predictions_jsonl", str(preds), "--out_json", str(work / "metrics.json"),
+        ], n_prompt, args.repeat)
+        stages["time_slice_metrics"] = run_stage("time_slice_metrics", [
+            py, str(SRC / "evaluation" / "time_slice_metrics.py"),
+            "--predictions_jsonl", str(preds), "--out_csv", str(work / "time_slices.csv"),
+        ], n_prompt, args.repeat)
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "rows": rows,
+        "workers": args.workers,
+        "repeat": args.repeat,
+        "stages": stages,
+    }
+
+    for name, st in stages.items():
+        rss = f"{st['peak_rss_mb']:.0f} MB" if st["peak_rss_mb"] is not None else "n/a"
+        print(f"{name:<20} {st['rows']:>10} rows  {st['wall_s']:8.2f} s  {st['rows_per_s']:12.0f} rows/s  peak RSS {rss}")
+
+    history = Path(args.history)
+    history.parent.mkdir(parents=True, exist_ok=True)
+    with history.open("a", encoding="utf-8") as w:
+        w.write(json.dumps(result) + "\n")
+
+    if args.save_baseline:
+        Path(args.save_baseline).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save_baseline).write_text(json.dumps(result, indent=2), encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("rows") != rows:
+            print(f"Warning: baseline was recorded at {baseline.get('rows')} rows, this run used {rows}.")
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("REGRESSIONS:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions vs baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,22 @@ from __future__ import annotations
 
 import argparse
 import json
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Iterable, Optional
+from typing import TYPE_CHECKING, List, Dict, Any, Iterable, Iterator, Optional, Tuple
 
 import pandas as pd
 from tqdm import tqdm
 
-from utils_data import row_to_text, label_from_attack_type, DEFAULT_COLMAP
+from utils_data import render_text_column, labels_from_attack_types, csv_dtypes, DEFAULT_COLMAP
+from trajectory_features import TRAJECTORY_FIELDS, file_trajectory_features, trajectory_lines
+from dataset_io import chunk_to_table, write_parquet_part, write_parquet_file, read_parquet_file, shift_ids
+
+if TYPE_CHECKING:
+    import pyarrow as pa
 
 def iter_csv_files(inp: Path) -> List[Path]:
     if inp.is_file() and inp.suffix.lower() == ".csv":
@@ -20,14 +29,221 @@ def iter_csv_files(inp: Path) -> List[Path]:
 def parse_args() -> argparse.Namespace:
     ap = argparse.ArgumentParser(description="Convert MisbehaviorX CSV logs into JSONL prompt samples.")
     ap.add_argument("--input", required=True, help="Path to a CSV file or a folder containing CSV files.")
-    ap.add_argument("--output", required=True, help="Output JSONL path (will be overwritten).")
+    ap.add_argument("--output", required=True,
+                    help="Output JSONL path (will be overwritten), or a new directory for --format parquet.")
+    ap.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl",
+                    help="parquet: dataset partitioned by attack_type/source_file, storing numeric fields "
+                         "instead of rendered text (needs pyarrow).")
     ap.add_argument("--attacks", nargs="*", default=None,
                     help="Optional whitelist of attack_type values to keep (e.g., Genuine RandomPosition DoS).")
     ap.add_argument("--max_rows", type=int, default=None, help="Optional max total rows to write (after filtering).")
     ap.add_argument("--shuffle", action="store_true", help="Shuffle rows before writing.")
     ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--chunksize", type=int, default=200_000,
+                    help="Rows read per CSV block; bounds peak memory.")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Convert files in parallel with N processes (one shard per file, merged in order).")
+    ap.add_argument("--shuffle_buckets", type=int, default=256,
+                    help="Number of on-disk spill buckets for --shuffle without --max_rows.")
+    ap.add_argument("--trajectory", choices=["none", "fields", "text"], default="none",
+                    help="Add sender-history features per (rv_id, hv_id): 'fields' writes traj_* numeric fields, "
+                         "'text' also appends a 'Sender history:' line to the prompt text (JSONL only).")
     return ap.parse_args()
 
+def _prepare_chunk(df: pd.DataFrame, f: Path, offset: int, keep: Optional[set]) -> pd.DataFrame:
+    df.index = pd.RangeIndex(offset, offset + len(df))
+    df["_source_file"] = str(f)
+    if keep is not None:
+        if "attack_type" not in df.columns:
+            raise KeyError("Column 'attack_type' not found; cannot filter by --attacks.")
+        df = df[df["attack_type"].astype(str).isin(keep)]
+    return df
+
+def iter_file_chunks(f: Path, chunksize: int, trajectory: str = "none") -> Iterator[pd.DataFrame]:
+    """Raw CSV blocks; with trajectory features, their traj_* columns are attached before any filtering."""
+    feats = file_trajectory_features(f) if trajectory != "none" else None
+    local = 0
+    for df in pd.read_csv(f, chunksize=chunksize, dtype=csv_dtypes()):
+        if feats is not None:
+            block = feats.iloc[local:local + len(df)].to_numpy()
+            for j, name in enumerate(TRAJECTORY_FIELDS):
+                df[name] = block[:, j]
+        local += len(df)
+        yield df
+
+def iter_chunks(files: List[Path], chunksize: int, attacks: Optional[List[str]],
+                trajectory: str = "none") -> Iterator[pd.DataFrame]:
+    """Yield filtered DataFrame blocks of at most `chunksize` rows, one file at a time.
+
+    The index of each block is the global row position across all files (before filtering),
+    which matches the ids the old concat-then-filter implementation produced.
+    """
+    keep = set([str(a) for a in attacks]) if attacks else None
+    offset = 0
+    for f in tqdm(files, desc="Reading CSVs"):
+        for df in iter_file_chunks(f, chunksize, trajectory):
+            n = len(df)
+            df = _prepare_chunk(df, f, offset, keep)
+            offset += n
+            if len(df):
+                yield df
+
+def _column(df: pd.DataFrame, name: str) -> List[Any]:
+    return df[name].tolist() if name in df.columns else [None] * len(df)
+
+def iter_records(chunks: Iterable[pd.DataFrame], trajectory: str = "none") -> Iterator[Dict[str, Any]]:
+    """Build output records column-wise per chunk (no per-row Series construction)."""
+    for df in chunks:
+        attack_types = _column(df, "attack_type")
+        texts = render_text_column(df, DEFAULT_COLMAP)
+        if trajectory == "text":
+            texts = [f"{t}\n{h}" for t, h in zip(texts, trajectory_lines(df[TRAJECTORY_FIELDS]))]
+        columns = zip(
+            df.index.tolist(),
+            attack_types,
+            labels_from_attack_types(attack_types),
+            texts,
+            # include time if present (useful for time-slicing)
+            _column(df, "msg_rcv_time"),
+            _column(df, "_source_file"),
+        )
+        traj = zip(*[[None if v != v else v for v in df[c].tolist()] for c in TRAJECTORY_FIELDS]) \
+            if trajectory != "none" else None
+        for i, attack_type, label, text, t, src in columns:
+            rec = {
+                "id": int(i),
+                "attack_type": None if attack_type is None else str(attack_type),
+                "label": label,
+                "text": text,
+                "msg_rcv_time": t,
+                "source_file": src,
+            }
+            if traj is not None:
+                rec.update(zip(TRAJECTORY_FIELDS, next(traj)))
+            yield rec
+
+def chunk_table(df: pd.DataFrame) -> "pa.Table":
+    attack_types = _column(df, "attack_type")
+    return chunk_to_table(df, df.index.tolist(), attack_types, labels_from_attack_types(attack_types))
+
+def convert_file(job: Tuple[str, str, int, Optional[List[str]], str, str]) -> int:
+    """Process-pool worker: convert one CSV into a shard with file-local ids.
+
+    JSONL shards are one file; Parquet shards are a directory with one file per chunk.
+    Returns the number of rows read (before filtering) so the merge can offset ids.
+    """
+    f, shard, chunksize, attacks, fmt, trajectory = job
+    keep = set([str(a) for a in attacks]) if attacks else None
+    offset = 0
+    if fmt == "parquet":
+        Path(shard).mkdir()
+        for k, df in enumerate(iter_file_chunks(Path(f), chunksize, trajectory)):
+            n = len(df)
+            df = _prepare_chunk(df, Path(f), offset, keep)
+            offset += n
+            if len(df):
+                write_parquet_file(chunk_table(df), Path(shard) / f"chunk_{k:06d}.parquet")
+        return offset
+    with open(shard, "w", encoding="utf-8") as w:
+        for df in iter_file_chunks(Path(f), chunksize, trajectory):
+            n = len(df)
+            df = _prepare_chunk(df, Path(f), offset, keep)
+            offset += n
+            for rec in iter_records([df], trajectory):
+                w.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    return offset
+
+def _shift_id(line: str, offset: int) -> str:
+    # Shard lines always start with '{"id": <int>,' (id is the first key written).
+    head, rest = line.split(",", 1)
+    return f'{{"id": {int(head[7:]) + offset},{rest}'
+
+def iter_converted_shards(files: List[Path], chunksize: int, attacks: Optional[List[str]],
+                          workers: int, shard_dir: Path, fmt: str, trajectory: str = "none") -> Iterator[Tuple[Path, int]]:
+    """Convert files in parallel; yield (shard, id offset) in file order.
+
+    Shard i is yielded as soon as it and every earlier shard are done, so merging
+    overlaps with conversion of the remaining files. Offsets make ids equal the
+    sequential path's.
+    """
+    shards = [shard_dir / f"shard_{i:05d}.{fmt}" for i in range(len(files))]
+    jobs = [(str(f), str(sh), chunksize, attacks, fmt, trajectory) for f, sh in zip(files, shards)]
+    offset = 0
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        try:
+            row_counts = ex.map(convert_file, jobs)
+            for shard, n in tqdm(zip(shards, row_counts), total=len(files), desc=f"Converting CSVs ({workers} workers)"):
+                yield shard, offset
+                offset += n
+        finally:
+            ex.shutdown(wait=True, cancel_futures=True)
+
+def iter_sharded_lines(files: List[Path], chunksize: int, attacks: Optional[List[str]],
+                       workers: int, shard_dir: Path, trajectory: str = "none") -> Iterator[str]:
+    for shard, offset in iter_converted_shards(files, chunksize, attacks, workers, shard_dir, "jsonl", trajectory):
+        with shard.open("r", encoding="utf-8") as r:
+            for line in r:
+                yield _shift_id(line, offset)
+        shard.unlink()
+
+def iter_sharded_tables(files: List[Path], chunksize: int, attacks: Optional[List[str]],
+                        workers: int, shard_dir: Path, trajectory: str = "none") -> Iterator["pa.Table"]:
+    for shard, offset in iter_converted_shards(files, chunksize, attacks, workers, shard_dir, "parquet", trajectory):
+        for part in sorted(shard.glob("chunk_*.parquet")):
+            yield shift_ids(read_parquet_file(part), offset)
+        shutil.rmtree(shard)
+
+def write_parquet_dataset(files: List[Path], out: Path, args: argparse.Namespace, spill: Path) -> int:
+    if out.exists() and (out.is_file() or any(out.iterdir())):
+        raise FileExistsError(f"--format parquet needs a new or empty output directory: {out}")
+    if args.workers > 1:
+        tables = iter_sharded_tables(files, args.chunksize, args.attacks, args.workers, spill, args.trajectory)
+    else:
+        tables = (chunk_table(df) for df in iter_chunks(files, args.chunksize, args.attacks, args.trajectory))
+    n = 0
+    try:
+        for part, table in enumerate(tables):
+            if args.max_rows is not None:
+                if n >= args.max_rows:
+                    break
+                table = table.slice(0, args.max_rows - n)
+            write_parquet_part(table, out, f"{part:06d}")
+            n += table.num_rows
+    finally:
+        tables.close()
+    return n
+
+def reservoir_sample(records: Iterable[Dict[str, Any]], k: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Uniform sample of k records in one pass (Algorithm R), O(k) memory."""
+    sample: List[Dict[str, Any]] = []
+    for n, rec in enumerate(records):
+        if n < k:
+            sample.append(rec)
+        else:
+            j = rng.randint(0, n)
+            if j < k:
+                sample[j] = rec
+    return sample
+
+def external_shuffle(records: Iterable[Dict[str, Any]], rng: random.Random, spill_dir: Path,
+                     n_buckets: int) -> Iterator[Dict[str, Any]]:
+    """Shuffle an arbitrarily large stream by scattering into random on-disk buckets,
+    then shuffling each bucket in memory. Peak memory is one bucket."""
+    paths = [spill_dir / f"bucket_{b:04d}.jsonl" for b in range(n_buckets)]
+    handles = [p.open("w", encoding="utf-8") for p in paths]
+    try:
+        for rec in records:
+            handles[rng.randrange(n_buckets)].write(json.dumps(rec, ensure_ascii=False) + "\n")
+    finally:
+        for h in handles:
+            h.close()
+    for p in paths:
+        with p.open("r", encoding="utf-8") as r:
+            bucket = [json.loads(line) for line in r]
+        p.unlink()
+        rng.shuffle(bucket)
+        yield from bucket
+
 def main() -> None:
     args = parse_args()
     inp = Path(args.input)
@@ -38,43 +254,51 @@ def main() -> None:
     if not files:
         raise RuntimeError(f"No CSV files found under: {inp}")
 
-    dfs = []
-    for f in tqdm(files, desc="Reading CSVs"):
-        df = pd.read_csv(f)
-        df["_source_file"] = str(f)
-        dfs.append(df)
+    if args.format == "parquet":
+        if args.shuffle:
+            raise ValueError("--shuffle is only supported for JSONL output (partitioned Parquet has no row order).")
+        if args.trajectory == "text":
+            raise ValueError("--trajectory text is JSONL only; Parquet stores the traj_* fields with --trajectory fields.")
+        with tempfile.TemporaryDirectory(dir=out.parent) as spill:
+            n = write_parquet_dataset(files, out, args, Path(spill))
+        print(f"Wrote {n} samples to {out} (parquet)")
+        return
 
-    df_all = pd.concat(dfs, ignore_index=True)
-
-    # Filter by attack types if provided
-    if args.attacks is not None and len(args.attacks) > 0:
-        keep = set([str(a) for a in args.attacks])
-        if "attack_type" not in df_all.columns:
-            raise KeyError("Column 'attack_type' not found; cannot filter by --attacks.")
-        df_all = df_all[df_all["attack_type"].astype(str).isin(keep)].copy()
+    n = 0
+    with out.open("w", encoding="utf-8") as w, tempfile.TemporaryDirectory(dir=out.parent) as spill:
+        lines: Optional[Iterable[str]] = None
+        if args.workers > 1:
+            lines = iter_sharded_lines(files, args.chunksize, args.attacks, args.workers, Path(spill), args.trajectory)
+            records: Iterable[Dict[str, Any]] = (json.loads(line) for line in lines)
+        else:
+            records = iter_records(iter_chunks(files, args.chunksize, args.attacks, args.trajectory), args.trajectory)
 
-    if args.shuffle:
-        df_all = df_all.sample(frac=1.0, random_state=args.seed).reset_index(drop=True)
+        if args.shuffle:
+            rng = random.Random(args.seed)
+            if args.max_rows is not None:
+                sample = reservoir_sample(records, args.max_rows, rng)
+                rng.shuffle(sample)
+                shuffled: Iterable[Dict[str, Any]] = sample
+            else:
+                shuffled = external_shuffle(records, rng, Path(spill), args.shuffle_buckets)
+            # Shuffled output is renumbered 0..n-1, as before.
+            records = ({**rec, "id": i} for i, rec in enumerate(shuffled))
+            lines = None
 
-    if args.max_rows is not None:
-        df_all = df_all.head(args.max_rows).copy()
+        if lines is None:
+            lines = (json.dumps(rec, ensure_ascii=False) + "\n" for rec in records)
 
-    # Write JSONL
-    n = 0
-    with out.open("w", encoding="utf-8") as w:
-        for i, row in tqdm(df_all.iterrows(), total=len(df_all), desc="Writing JSONL"):
-            attack_type = row.get("attack_type", None)
-            rec = {
-                "id": int(i),
-                "attack_type": None if attack_type is None else str(attack_type),
-                "label": label_from_attack_type(attack_type),
-                "text": row_to_text(row, DEFAULT_COLMAP),
-                # include time if present (useful for time-slicing)
-                "msg_rcv_time": row.get("msg_rcv_time", None),
-                "source_file": row.get("_source_file", None),
-            }
-            w.write(json.dumps(rec, ensure_ascii=False) + "\n")
-            n += 1
+        try:
+            for line in tqdm(lines, desc="Writing JSONL"):
+                if args.max_rows is not None and n >= args.max_rows:
+                    break
+                w.write(line)
+                n += 1
+        finally:
+            # stop the worker pool / spill readers before the temp dir goes away
+            close = getattr(lines, "close", None)
+            if close is not None:
+                close()
 
     print(f"Wrote {n} samples to {out}")
 
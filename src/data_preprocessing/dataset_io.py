@@ -0,0 +1,408 @@
+from __future__ import annotations
+
+import heapq
+import json
+import mmap
+import os
+import random
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils_data import render_text_column, DEFAULT_COLMAP, INT_FIELDS
+from trajectory_features import TRAJECTORY_FIELDS
+
+# Optional: Parquet/Arrow datasets (pip install pyarrow)
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as pads
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
+
+# (column, op, value), same convention as pyarrow / pandas `filters`
+Filter = Tuple[str, str, Any]
+
+PARTITION_COLS = ["attack_type", "source_file"]
+
+# Numeric source fields stored in Parquet instead of the rendered `text`.
+TEXT_SOURCE_COLS = [k for k in DEFAULT_COLMAP if k != "attack_type"]
+# Vehicle ids and warning flags are stored as int64, every other source field as float64, so all
+# chunks and files of a dataset share one schema whatever values a chunk happens to hold.
+INT_SOURCE_COLS = INT_FIELDS
+
+def sample_rows(n: int, k: int, seed: int) -> List[int]:
+    """k distinct row positions out of n, sorted."""
+    return sorted(random.Random(seed).sample(range(n), min(k, n)))
+
+_ID_PREFIX_RE = re.compile(rb'^\s*\{"id":\s*(-?\d+)\s*,')
+
+class JsonlIndex:
+    """Random access into a large JSONL file through mmap and a byte-offset index.
+
+    The index (start offset of every non-empty line, plus optionally each line's `id`)
+    is built once with a vectorized newline scan and cached in a `<file>.idx.npz`
+    sidecar keyed on file size and mtime. Reading a line only touches its own bytes.
+    """
+
+    BLOCK = 64 << 20
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.sidecar = self.path.with_name(self.path.name + ".idx.npz")
+        self._f = self.path.open("rb")
+        size = os.fstat(self._f.fileno()).st_size
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._stamp = np.array([size, os.fstat(self._f.fileno()).st_mtime_ns], dtype=np.int64)
+        self._starts: Optional[np.ndarray] = None
+        self._ends: Optional[np.ndarray] = None
+        self._ids: Optional[np.ndarray] = None
+        self._id_pos: Optional[Dict[Any, int]] = None
+        self._load_sidecar()
+
+    # -- index -------------------------------------------------------------
+    def _load_sidecar(self) -> None:
+        try:
+            z = np.load(self.sidecar, allow_pickle=False)
+        except (OSError, ValueError):
+            return
+        if not np.array_equal(z["stamp"], self._stamp):
+            return
+        self._starts, self._ends = z["starts"], z["ends"]
+        if "ids" in z.files:
+            self._ids = z["ids"]
+
+    def _save_sidecar(self) -> None:
+        arrays = {"stamp": self._stamp, "starts": self._starts, "ends": self._ends}
+        if self._ids is not None:
+            arrays["ids"] = self._ids
+        try:
+            with self.sidecar.open("wb") as f:
+                np.savez(f, **arrays)
+        except OSError:
+            pass  # read-only location: keep the index in memory only
+
+    def _build(self) -> None:
+        size = int(self._stamp[0])
+        nl = [np.array([-1], dtype=np.int64)]
+        for off in range(0, size, self.BLOCK):
+            buf = np.frombuffer(self._mm, dtype=np.uint8, count=min(self.BLOCK, size - off), offset=off)
+            nl.append(np.flatnonzero(buf == 10).astype(np.int64) + off)
+        bounds = np.concatenate(nl)
+        if bounds[-1] != size - 1:
+            bounds = np.append(bounds, size)  # last line without trailing newline
+        starts, ends = bounds[:-1] + 1, bounds[1:]
+        # drop blank lines; only lines starting with whitespace need a closer look
+        keep = ends > starts
+        first = np.frombuffer(self._mm, dtype=np.uint8)[np.minimum(starts, size - 1)]
+        for j in np.flatnonzero(keep & np.isin(first, [9, 13, 32])).tolist():
+            keep[j] = bool(self._mm[int(starts[j]):int(ends[j])].strip())
+        self._starts, self._ends = starts[keep], ends[keep]
+        self._save_sidecar()
+
+    def _ensure(self) -> None:
+        if self._starts is None:
+            if self._mm is None:
+                self._starts = self._ends = np.zeros(0, dtype=np.int64)
+            else:
+                self._build()
+
+    def build_id_index(self) -> None:
+        """Record each line's integer `id` (fast prefix match, JSON fallback) for `get_by_id`."""
+        self._ensure()
+        if self._ids is None:
+            ids = np.empty(len(self), dtype=np.int64)
+            for i, (a, b) in enumerate(zip(self._starts.tolist(), self._ends.tolist())):
+                raw = self._mm[a:b]
+                m = _ID_PREFIX_RE.match(raw)
+                ids[i] = int(m.group(1)) if m else int(json.loads(raw)["id"])
+            self._ids = ids
+            self._save_sidecar()
+        if self._id_pos is None:
+            self._id_pos = {v: i for i, v in enumerate(self._ids.tolist())}
+
+    # -- access ------------------------------------------------------------
+    def __len__(self) -> int:
+        self._ensure()
+        return len(self._starts)
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        self._ensure()
+        return json.loads(self._mm[int(self._starts[i]):int(self._ends[i])])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Stream every record in order without building the index."""
+        with self.path.open("r", encoding="utf-8") as r:
+            for line in r:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    def sample(self, k: int, seed: int = 42, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """k distinct records chosen uniformly at random (among the first `limit`), returned in file order."""
+        n = len(self) if limit is None else min(len(self), limit)
+        rows = sample_rows(n, k, seed)
+        return [self[i] for i in rows]
+
+    def get_by_id(self, rec_id: Any) -> Optional[Dict[str, Any]]:
+        self.build_id_index()
+        i = self._id_pos.get(rec_id)
+        return None if i is None else self[i]
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+        self._f.close()
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("pyarrow package not installed. Run: pip install pyarrow")
+
+def is_parquet(path: Path) -> bool:
+    return path.is_dir() or path.suffix.lower() == ".parquet"
+
+_OPS = {
+    "=": lambda a, b: a == b,
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "not in": lambda a, b: a not in b,
+}
+
+def _matches(rec: Dict[str, Any], filters: Optional[Sequence[Filter]]) -> bool:
+    if not filters:
+        return True
+    for col, op, val in filters:
+        if op not in _OPS:
+            raise ValueError(f"Unsupported filter op: {op}. Supported: {list(_OPS)}")
+        if not _OPS[op](rec.get(col), val):
+            return False
+    return True
+
+def _jsonl_records(path: Path, columns: Optional[Sequence[str]], filters: Optional[Sequence[Filter]],
+                   limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    if limit is not None and limit <= 0:
+        return out
+    with path.open("r", encoding="utf-8") as r:
+        for line in r:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            if not _matches(rec, filters):
+                continue
+            out.append(rec if columns is None else {c: rec.get(c) for c in columns})
+            if limit is not None and len(out) >= limit:
+                break
+    return out
+
+def _parquet_plan(path: Path, columns: Optional[Sequence[str]], filters: Optional[Sequence[Filter]]) -> Dict[str, Any]:
+    _require_pyarrow()
+    dataset = pads.dataset(str(path), format="parquet", partitioning="hive")
+    stored = set(dataset.schema.names)
+    want = list(columns) if columns is not None else dataset.schema.names + ([] if "text" in stored else ["text"])
+    need_text = "text" in want and "text" not in stored
+    scan_cols = [c for c in want if c in stored]
+    if need_text:
+        scan_cols += [c for c in TEXT_SOURCE_COLS if c in stored and c not in scan_cols]
+    return {
+        "dataset": dataset, "stored": stored, "want": want, "need_text": need_text, "scan_cols": scan_cols,
+        "filter": pq.filters_to_expression(list(filters)) if filters else None,
+    }
+
+def _finish_table(table: "pa.Table", plan: Dict[str, Any]) -> "pa.Table":
+    # hive partition columns come back dictionary-encoded
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    if plan["need_text"]:
+        # ids and flags stay nullable integers, the same dtype csv_to_jsonl reads them with
+        src = table.select([c for c in TEXT_SOURCE_COLS if c in plan["stored"]]).to_pandas(
+            types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+        table = table.append_column("text", pa.array(render_text_column(src, {k: k for k in DEFAULT_COLMAP}), pa.string()))
+    return table.select([c for c in plan["want"] if c in table.schema.names])
+
+def _parquet_table(path: Path, columns: Optional[Sequence[str]], filters: Optional[Sequence[Filter]],
+                   limit: Optional[int] = None) -> "pa.Table":
+    """Scan a (partitioned) Parquet dataset with column projection and predicate pushdown.
+
+    If `text` is requested but not stored, it is rendered from the numeric fields with
+    `render_text_column`, from the same dtypes csv_to_jsonl reads the CSV with, so it is
+    identical to what the JSONL output would contain.
+    """
+    plan = _parquet_plan(path, columns, filters)
+    dataset = plan["dataset"]
+    flt = plan["filter"]
+    has_id = "id" in plan["stored"]
+    if limit is not None and has_id:
+        # the first `limit` rows by id, as in the JSONL file, not the first partitions on disk:
+        # find the limit-th smallest id from the id column alone, then push `id <= it` down
+        ids = dataset.to_table(columns=["id"], filter=flt).column("id").to_numpy()
+        if len(ids) > limit:
+            cutoff = int(np.partition(ids, limit - 1)[limit - 1]) if limit > 0 else int(ids.min()) - 1
+            flt = pads.field("id") <= cutoff if flt is None else flt & (pads.field("id") <= cutoff)
+        table = dataset.to_table(columns=plan["scan_cols"], filter=flt)
+    elif limit is not None:
+        table = dataset.head(limit, columns=plan["scan_cols"], filter=flt)
+    else:
+        table = dataset.to_table(columns=plan["scan_cols"], filter=flt)
+    # partitions are scanned in directory order; restore the id order of the JSONL output
+    if has_id:
+        table = table.sort_by("id")
+    return _finish_table(table, plan)
+
+def iter_records(path: Path, columns: Optional[Sequence[str]] = None,
+                 filters: Optional[Sequence[Filter]] = None) -> Iterator[Dict[str, Any]]:
+    """Stream records one at a time in bounded memory, in id order for both formats.
+
+    Parquet files each hold ascending ids, so their rows are merged on id a small batch
+    at a time per file.
+    """
+    path = Path(path)
+    if is_parquet(path):
+        keep_id = columns is None or "id" in columns
+        plan = _parquet_plan(path, None if columns is None else list(columns) + ([] if keep_id else ["id"]), filters)
+        if "id" not in plan["stored"]:
+            for batch in plan["dataset"].to_batches(columns=plan["scan_cols"], filter=plan["filter"]):
+                yield from _finish_table(pa.Table.from_batches([batch]), plan).to_pylist()
+            return
+        merged = heapq.merge(*(_fragment_records(f, plan) for f in plan["dataset"].get_fragments(plan["filter"])),
+                             key=lambda rec: rec["id"])
+        for rec in merged:
+            if not keep_id:
+                del rec["id"]
+            yield rec
+        return
+    with path.open("r", encoding="utf-8") as r:
+        for line in r:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            if _matches(rec, filters):
+                yield rec if columns is None else {c: rec.get(c) for c in columns}
+
+def _fragment_records(fragment: Any, plan: Dict[str, Any], batch_size: int = 4096) -> Iterator[Dict[str, Any]]:
+    # the dataset schema brings the hive partition columns along
+    for batch in fragment.to_batches(schema=plan["dataset"].schema, columns=plan["scan_cols"],
+                                     filter=plan["filter"], batch_size=batch_size):
+        yield from _finish_table(pa.Table.from_batches([batch]), plan).to_pylist()
+
+def load_records(path: Path, columns: Optional[Sequence[str]] = None,
+                 filters: Optional[Sequence[Filter]] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Load a JSONL file or Parquet dataset as a list of dicts (the shape every script uses).
+
+    `columns` projects (missing columns come back as None for JSONL); `filters` is a list of
+    (column, op, value) predicates, pushed down into the scan for Parquet. `limit` stops
+    reading after that many matching rows instead of loading the whole file.
+    """
+    path = Path(path)
+    if is_parquet(path):
+        return _parquet_table(path, columns, filters, limit).to_pylist()
+    return _jsonl_records(path, columns, filters, limit)
+
+def sample_records(path: Path, k: int, seed: int = 42, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """k random records among the first `limit` (default: all), in file order.
+
+    JSONL goes through its offset index and touches only the sampled lines; Parquet scans
+    just the id column, then fetches the sampled ids. Both pick the same rows (by id order)
+    for the same data and seed.
+    """
+    path = Path(path)
+    if is_parquet(path):
+        ids = _parquet_table(path, ["id"], None, limit).column("id").to_numpy()
+        return records_by_id(path, ids[sample_rows(len(ids), k, seed)].tolist())
+    ix = JsonlIndex(path)
+    try:
+        return ix.sample(k, seed=seed, limit=limit)
+    finally:
+        ix.close()
+
+def records_by_id(path: Path, ids: Sequence[Any], columns: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """The records with these ids, in the order given; ids not in the dataset are skipped.
+
+    JSONL seeks each line through the offset index (`JsonlIndex.get_by_id`); Parquet pushes
+    an `id in ids` filter into the scan.
+    """
+    path = Path(path)
+    ids = list(dict.fromkeys(ids))
+    if is_parquet(path):
+        scan = None if columns is None else list(dict.fromkeys([*columns, "id"]))
+        found = {rec["id"]: rec for rec in load_records(path, scan, filters=[("id", "in", ids)])}
+    else:
+        ix = JsonlIndex(path)
+        try:
+            found = {i: ix.get_by_id(i) for i in ids}
+        finally:
+            ix.close()
+    recs = [found[i] for i in ids if found.get(i) is not None]
+    return recs if columns is None else [{c: rec.get(c) for c in columns} for rec in recs]
+
+def load_frame(path: Path, columns: Optional[Sequence[str]] = None,
+               filters: Optional[Sequence[Filter]] = None, limit: Optional[int] = None) -> pd.DataFrame:
+    """Like `load_records`, but columnar; use for vectorized metrics over large splits."""
+    path = Path(path)
+    if is_parquet(path):
+        return _parquet_table(path, columns, filters, limit).to_pandas()
+    recs = _jsonl_records(path, columns, filters, limit)
+    return pd.DataFrame.from_records(recs, columns=list(columns) if columns is not None else None)
+
+def chunk_to_table(df: pd.DataFrame, ids: Sequence[int], attack_types: Sequence[Any], labels: Sequence[str]) -> "pa.Table":
+    """Arrow table for one converted CSV chunk: ids, labels, partition keys and the numeric
+    source fields (no rendered text)."""
+    _require_pyarrow()
+    cols: Dict[str, Any] = {
+        "id": pa.array(ids, pa.int64()),
+        "attack_type": pa.array([None if a is None else str(a) for a in attack_types], pa.string()),
+        "label": pa.array(labels, pa.string()),
+        "source_file": pa.array(df["_source_file"].astype(str).tolist(), pa.string()),
+    }
+    for name in TEXT_SOURCE_COLS:
+        src = DEFAULT_COLMAP.get(name, name)
+        if src in df.columns:
+            cols[name] = source_array(df[src], name)
+    for name in TRAJECTORY_FIELDS:
+        if name in df.columns:
+            cols[name] = pa.array(df[name].to_numpy(), pa.float64(), from_pandas=True)
+    return pa.table(cols)
+
+def source_array(s: pd.Series, name: str) -> "pa.Array":
+    """One source field with its fixed type (INT_SOURCE_COLS: int64, else float64); missing or
+    unparsable values become nulls."""
+    v = pd.to_numeric(s, errors="coerce")
+    if name in INT_SOURCE_COLS:
+        if (v.dropna() % 1 != 0).any():
+            raise ValueError(f"Column '{name}' has non-integer values; it is stored as int64 in Parquet datasets.")
+        return pa.array(v.astype("Int64"), pa.int64())
+    return pa.array(v.to_numpy(dtype=np.float64), pa.float64(), from_pandas=True)
+
+def write_parquet_part(table: "pa.Table", out_dir: Path, part: str) -> None:
+    """Append one table to a dataset partitioned by attack_type / source_file."""
+    _require_pyarrow()
+    pads.write_dataset(
+        table, str(out_dir), format="parquet",
+        partitioning=PARTITION_COLS, partitioning_flavor="hive",
+        basename_template=f"part-{part}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+def write_parquet_file(table: "pa.Table", path: Path) -> None:
+    _require_pyarrow()
+    pq.write_table(table, str(path))
+
+def read_parquet_file(path: Path) -> "pa.Table":
+    _require_pyarrow()
+    return pq.read_table(str(path))
+
+def shift_ids(table: "pa.Table", offset: int) -> "pa.Table":
+    i = table.schema.get_field_index("id")
+    return table.set_column(i, "id", pc.add(table.column(i), pa.scalar(offset, pa.int64())))
@@ -1,58 +1,156 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import random
+from collections import Counter
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Any
-
-from sklearn.model_selection import train_test_split
-
-def read_jsonl(path: Path) -> List[Dict[str, Any]]:
-    items = []
-    with path.open("r", encoding="utf-8") as r:
-        for line in r:
-            line = line.strip()
-            if not line:
-                continue
-            items.append(json.loads(line))
-    return items
-
-def write_jsonl(items: List[Dict[str, Any]], path: Path) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as w:
-        for obj in items:
-            w.write(json.dumps(obj, ensure_ascii=False) + "\n")
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from dataset_io import iter_records, sample_records
+from utils_data import vehicle_ids_from_text
+
+# Vehicle id fields and their position in `vehicle_ids_from_text`; ids repeat across CSVs.
+VEHICLE_FIELDS = {"rv_id": 0, "hv_id": 1}
 
 def parse_args() -> argparse.Namespace:
     ap = argparse.ArgumentParser(description="Split a JSONL dataset into dev/test (stratified by label).")
-    ap.add_argument("--input_jsonl", required=True)
+    ap.add_argument("--input_jsonl", required=True, help="JSONL file or Parquet dataset directory.")
     ap.add_argument("--out_dir", required=True)
     ap.add_argument("--test_size", type=float, default=0.2)
     ap.add_argument("--seed", type=int, default=42)
-    ap.add_argument("--max_total", type=int, default=None, help="Optional cap on total items before splitting.")
+    ap.add_argument("--max_total", type=int, default=None,
+                    help="Optional cap: keep only the first N items (applied before --sample_total).")
+    ap.add_argument("--sample_total", type=int, default=None,
+                    help="Optional random sample of N items, drawn from the first --max_total items if given "
+                         "(JSONL: read via a byte-offset index), before splitting.")
+    ap.add_argument("--stratify_attack", action="store_true",
+                    help="Stratify on (label, attack_type) instead of label only.")
+    ap.add_argument("--folds", type=int, default=None,
+                    help="Write K stratified folds (fold_0.jsonl .. fold_{K-1}.jsonl) instead of dev/test.")
+    ap.add_argument("--group_by", default=None,
+                    help="Keep all records sharing this field (e.g. source_file, hv_id) in the same split; "
+                         "rv_id/hv_id group per source file (read from the text for JSONL). "
+                         "Groups are stratified by their majority label (or label/attack_type); proportions "
+                         "are exact only up to group size.")
     return ap.parse_args()
 
+def stratum_of(rec: Dict[str, Any], stratify_attack: bool) -> Tuple[Any, ...]:
+    label = rec.get("label", "unknown")
+    return (label, rec.get("attack_type")) if stratify_attack else (label,)
+
+def fold_sizes(n: int, fractions: Sequence[float], rng: random.Random) -> List[int]:
+    """Split n into len(fractions) integer sizes; rounding remainders go to random folds."""
+    sizes = [int(n * f) for f in fractions]
+    rest = n - sum(sizes)
+    for i in rng.sample(range(len(sizes)), len(sizes))[:rest]:
+        sizes[i] += 1
+    return sizes
+
+def assign_stratified(source: Callable[[], Iterable[Dict[str, Any]]], fractions: Sequence[float], seed: int,
+                      stratify_attack: bool) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Two-pass exact stratified assignment in O(#strata) memory.
+
+    Pass 1 counts each stratum. Pass 2 streams the records again and sends each one to
+    fold f with probability remaining_f / remaining_in_stratum (selection sampling),
+    which hits every fold's quota exactly and is deterministic for a given seed and input order.
+    """
+    counts = Counter(stratum_of(rec, stratify_attack) for rec in source())
+    rng = random.Random(seed)
+    remaining = {s: fold_sizes(n, fractions, rng) for s, n in sorted(counts.items(), key=lambda kv: repr(kv[0]))}
+    for rec in source():
+        left = remaining[stratum_of(rec, stratify_attack)]
+        r = rng.random() * sum(left)
+        f = 0
+        while r >= left[f]:
+            r -= left[f]
+            f += 1
+        left[f] -= 1
+        yield f, rec
+
+def group_unit(value: Any, seed: int) -> float:
+    h = hashlib.blake2b(f"{seed}:{value}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(h, "big") / 2.0 ** 64
+
+def group_key(rec: Dict[str, Any], group_by: str) -> Any:
+    """Group of one record. Vehicle ids are keyed per source file and read from the text
+    when the record has no such field (JSONL)."""
+    value = rec.get(group_by)
+    if group_by in VEHICLE_FIELDS:
+        if value is None:
+            value = vehicle_ids_from_text(rec.get("text"))[VEHICLE_FIELDS[group_by]]
+        if value is not None:
+            return rec.get("source_file"), str(value)
+    if value is None:
+        raise ValueError(f"Record {rec.get('id')} has no '{group_by}' to group by.")
+    return value
+
+def assign_grouped(source: Callable[[], Iterable[Dict[str, Any]]], fractions: Sequence[float], seed: int,
+                   group_by: str, stratify_attack: bool) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Two-pass grouped assignment, stratified by each group's majority stratum, in O(#groups) memory.
+
+    Pass 1 counts each group's records per stratum and files the group under its majority
+    stratum. Within a stratum, groups are visited in hash(seed, group value) order and each
+    goes to the fold furthest below its share of that stratum's records. Pass 2 streams the
+    records to their group's fold.
+    """
+    counts: Dict[Any, Counter] = {}
+    for rec in source():
+        counts.setdefault(group_key(rec, group_by), Counter())[stratum_of(rec, stratify_attack)] += 1
+    by_stratum: Dict[Tuple[Any, ...], List[Tuple[Any, int]]] = {}
+    for g, c in counts.items():
+        majority = max(sorted(c, key=repr), key=c.get)
+        by_stratum.setdefault(majority, []).append((g, sum(c.values())))
+    fold_of: Dict[Any, int] = {}
+    for groups in by_stratum.values():
+        total = sum(n for _, n in groups)
+        filled = [0] * len(fractions)
+        for g, n in sorted(groups, key=lambda gn: group_unit(gn[0], seed)):
+            f = max(range(len(fractions)), key=lambda i: fractions[i] * total - filled[i])
+            fold_of[g] = f
+            filled[f] += n
+    for rec in source():
+        yield fold_of[group_key(rec, group_by)], rec
+
 def main() -> None:
     args = parse_args()
     inp = Path(args.input_jsonl)
     out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.sample_total is not None:
+        # cap first, then sample, for JSONL and Parquet alike
+        pool = sample_records(inp, args.sample_total, seed=args.seed, limit=args.max_total)
+        source: Callable[[], Iterable[Dict[str, Any]]] = lambda: pool
+    else:
+        # re-read the input for each pass instead of holding it in memory
+        source = lambda: islice(iter_records(inp), args.max_total)
 
-    items = read_jsonl(inp)
-    if args.max_total is not None:
-        items = items[:args.max_total]
+    if args.folds is not None:
+        names = [f"fold_{i}.jsonl" for i in range(args.folds)]
+        fractions = [1.0 / args.folds] * args.folds
+    else:
+        names = ["dev.jsonl", "test.jsonl"]
+        fractions = [1.0 - args.test_size, args.test_size]
 
-    labels = [x.get("label", "unknown") for x in items]
-    dev, test = train_test_split(
-        items,
-        test_size=args.test_size,
-        random_state=args.seed,
-        stratify=labels if len(set(labels)) > 1 else None,
-    )
+    if args.group_by:
+        assigned = assign_grouped(source, fractions, args.seed, args.group_by, args.stratify_attack)
+    else:
+        assigned = assign_stratified(source, fractions, args.seed, args.stratify_attack)
 
-    write_jsonl(dev, out_dir / "dev.jsonl")
-    write_jsonl(test, out_dir / "test.jsonl")
+    counts = [0] * len(names)
+    handles = [(out_dir / name).open("w", encoding="utf-8") for name in names]
+    try:
+        for f, rec in assigned:
+            handles[f].write(json.dumps(rec, ensure_ascii=False) + "\n")
+            counts[f] += 1
+    finally:
+        for h in handles:
+            h.close()
 
-    print(f"Dev: {len(dev)}  Test: {len(test)}  -> {out_dir}")
+    print("  ".join(f"{Path(n).stem.capitalize()}: {c}" for n, c in zip(names, counts)) + f"  -> {out_dir}")
 
 if __name__ == "__main__":
     main()
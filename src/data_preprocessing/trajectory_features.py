@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils_data import DEFAULT_COLMAP
+
+# Numeric per-message fields describing the sender's history as seen by this receiver.
+TRAJECTORY_FIELDS = [
+    "traj_dt",              # s since the previous message of the same (rv_id, hv_id)
+    "traj_pos_jump",        # m between the previous and current sender position
+    "traj_implied_speed",   # m/s, pos_jump / dt
+    "traj_speed_residual",  # m/s, implied speed minus the reported hv_speed
+    "traj_heading_change",  # deg in [0, 180]
+    "traj_msg_rate",        # msg/s over up to RATE_WINDOW previous messages
+    "traj_seq",             # 0 for the first message of the pair, 1, 2, ...
+]
+RATE_WINDOW = 5
+SOURCE_FIELDS = ["rv_id", "hv_id", "msg_rcv_time", "hv_pos_x", "hv_pos_y", "hv_speed", "hv_heading"]
+
+def _num(df: pd.DataFrame, col: Optional[str]) -> np.ndarray:
+    if col is None or col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+
+def pair_order(df: pd.DataFrame, colmap: Dict[str, str] = DEFAULT_COLMAP) -> Tuple[np.ndarray, np.ndarray]:
+    """(order, seq): row order sorted by (rv_id, hv_id, msg_rcv_time), and each sorted row's
+    position within its pair (0 = first message). NaN times sort last within their pair."""
+    n = len(df)
+    rv = pd.factorize(df[colmap["rv_id"]])[0] if colmap["rv_id"] in df.columns else np.zeros(n, dtype=np.int64)
+    hv = pd.factorize(df[colmap["hv_id"]])[0] if colmap["hv_id"] in df.columns else np.zeros(n, dtype=np.int64)
+    order = np.lexsort((_num(df, colmap.get("msg_rcv_time")), hv, rv))
+    rv_s, hv_s = rv[order], hv[order]
+    new_pair = np.ones(n, dtype=bool)
+    new_pair[1:] = (rv_s[1:] != rv_s[:-1]) | (hv_s[1:] != hv_s[:-1])
+    starts = np.flatnonzero(new_pair)
+    return order, np.arange(n) - np.repeat(starts, np.diff(np.r_[starts, n]))
+
+def trajectory_features(df: pd.DataFrame, colmap: Dict[str, str] = DEFAULT_COLMAP) -> pd.DataFrame:
+    """Per-message deltas against the previous message of the same (rv_id, hv_id), ordered by time.
+
+    One stable lexsort plus shifted array differences masked at pair boundaries (the
+    vectorized form of groupby().shift()), so cost is O(n log n) with no Python loop.
+    The result is aligned with `df`'s index. Fields are NaN for a pair's first message
+    and for rows without a usable time.
+    """
+    n = len(df)
+    t = _num(df, colmap.get("msg_rcv_time"))
+    x = _num(df, colmap.get("hv_pos_x"))
+    y = _num(df, colmap.get("hv_pos_y"))
+    speed = _num(df, colmap.get("hv_speed"))
+    heading = _num(df, colmap.get("hv_heading"))
+
+    order, seq = pair_order(df, colmap)
+    t_s = t[order]
+
+    def prev(a: np.ndarray, k: np.ndarray) -> np.ndarray:
+        return a[np.arange(n) - k]
+
+    has_prev = (seq > 0) & np.isfinite(t_s)
+    one = np.minimum(seq, 1)
+    dt = np.where(has_prev, t_s - prev(t_s, one), np.nan)
+    x_s, y_s = x[order], y[order]
+    jump = np.where(has_prev, np.hypot(x_s - prev(x_s, one), y_s - prev(y_s, one)), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        implied = np.where(dt > 0, jump / dt, np.nan)
+        dh = heading[order] - prev(heading[order], one)
+        turn = np.where(has_prev, np.abs((dh + 180.0) % 360.0 - 180.0), np.nan)
+        lag = np.minimum(seq, RATE_WINDOW)
+        span = t_s - prev(t_s, lag)
+        rate = np.where(has_prev & (span > 0), lag / span, np.nan)
+
+    out = np.empty((n, len(TRAJECTORY_FIELDS)))
+    for j, col in enumerate([dt, jump, implied, implied - speed[order], turn, rate, seq.astype(float)]):
+        out[order, j] = col
+    out[~np.isfinite(t), TRAJECTORY_FIELDS.index("traj_seq")] = np.nan
+    return pd.DataFrame(out, index=df.index, columns=TRAJECTORY_FIELDS)
+
+def file_trajectory_features(path: Path, colmap: Dict[str, str] = DEFAULT_COLMAP) -> pd.DataFrame:
+    """Features for a whole CSV, reading only the columns they need (row i = file row i).
+
+    Sender histories span chunk boundaries, so this reads the file once up front;
+    peak memory is the seven source columns, not the full rows.
+    """
+    wanted = {colmap[k] for k in SOURCE_FIELDS if k in colmap}
+    df = pd.read_csv(path, usecols=lambda c: c in wanted)
+    return trajectory_features(df, colmap)
+
+def _fmt(v: float, spec: str) -> str:
+    return format(v, spec) if np.isfinite(v) else "n/a"
+
+def trajectory_lines(feats: pd.DataFrame) -> List[str]:
+    """One prompt line per row summarising the sender's history."""
+    lines = []
+    cols = [feats[c].tolist() for c in TRAJECTORY_FIELDS]
+    for dt, jump, implied, resid, turn, rate, seq in zip(*cols):
+        if not np.isfinite(dt):
+            lines.append("Sender history: first message from this sender.")
+            continue
+        lines.append(
+            f"Sender history: previous message {_fmt(dt, '.3f')} s earlier, position jump {_fmt(jump, '.1f')} m "
+            f"(implied speed {_fmt(implied, '.1f')} m/s, {_fmt(resid, '+.1f')} vs reported), "
+            f"heading change {_fmt(turn, '.1f')} deg, rate {_fmt(rate, '.2f')} msg/s."
+        )
+    return lines
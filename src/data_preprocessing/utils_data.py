@@ -1,8 +1,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import math
+import re
+
+import numpy as np
+import pandas as pd
 
 DEFAULT_COLMAP = {
     "rv_id": "rv_id",
@@ -26,16 +30,27 @@ def _safe_get(row: Any, key: str, default: Any = None) -> Any:
     try:
         v = row[key]
         # Convert numpy scalars to python
-        try:
-            import numpy as np
-            if isinstance(v, (np.generic,)):
-                return v.item()
-        except Exception:
-            pass
+        if isinstance(v, np.generic):
+            return v.item()
         return v
     except Exception:
         return default
 
+# numeric formatting with fallbacks
+def _fnum(x: Any, fmt: str) -> str:
+    try:
+        if x is None:
+            return "?"
+        if isinstance(x, str) and x.strip() == "":
+            return "?"
+        return format(float(x), fmt)
+    except Exception:
+        return "?"
+
+def _fid(x: Any) -> str:
+    # ids and flags: a missing value renders like the NaN of a float column
+    return "nan" if x is pd.NA else str(x)
+
 def row_to_text(row: Any, colmap: Dict[str, str] = DEFAULT_COLMAP) -> str:
     """Convert one MisbehaviorX row into a natural-language prompt input.
 
@@ -45,27 +60,103 @@ def row_to_text(row: Any, colmap: Dict[str, str] = DEFAULT_COLMAP) -> str:
     def g(name: str, default: Any = "?") -> Any:
         return _safe_get(row, colmap.get(name, name), default)
 
-    # numeric formatting with fallbacks
-    def fnum(x: Any, fmt: str) -> str:
-        try:
-            if x is None:
-                return "?"
-            if isinstance(x, str) and x.strip() == "":
-                return "?"
-            return format(float(x), fmt)
-        except Exception:
-            return "?"
+    fnum = _fnum
 
     return (
-        f"Receiver vehicle {g('rv_id')} received a message from vehicle {g('hv_id')} "
+        f"Receiver vehicle {_fid(g('rv_id'))} received a message from vehicle {_fid(g('hv_id'))} "
         f"at time {fnum(g('msg_rcv_time'), '.3f')} s.\n"
         f"Sender (hv) position: ({fnum(g('hv_pos_x'), '.1f')}, {fnum(g('hv_pos_y'), '.1f')}), "
         f"speed: {fnum(g('hv_speed'), '.1f')} m/s, heading: {fnum(g('hv_heading'), '.1f')} deg.\n"
         f"Receiver (rv) position: ({fnum(g('rv_pos_x'), '.1f')}, {fnum(g('rv_pos_y'), '.1f')}), "
         f"speed: {fnum(g('rv_speed'), '.1f')} m/s, heading: {fnum(g('rv_heading'), '.1f')} deg.\n"
-        f"Target id: {g('target_id')}, EEBL warning: {g('eebl_warn')}, IMA warning: {g('ima_warn')}."
+        f"Target id: {_fid(g('target_id'))}, EEBL warning: {_fid(g('eebl_warn'))}, IMA warning: {_fid(g('ima_warn'))}."
     )
 
+TEXT_TEMPLATE = (
+    "Receiver vehicle %s received a message from vehicle %s "
+    "at time %s s.\n"
+    "Sender (hv) position: (%s, %s), "
+    "speed: %s m/s, heading: %s deg.\n"
+    "Receiver (rv) position: (%s, %s), "
+    "speed: %s m/s, heading: %s deg.\n"
+    "Target id: %s, EEBL warning: %s, IMA warning: %s."
+)
+
+# (field, numeric format or None for plain str()) in TEXT_TEMPLATE slot order
+TEXT_FIELDS = [
+    ("rv_id", None), ("hv_id", None), ("msg_rcv_time", ".3f"),
+    ("hv_pos_x", ".1f"), ("hv_pos_y", ".1f"), ("hv_speed", ".1f"), ("hv_heading", ".1f"),
+    ("rv_pos_x", ".1f"), ("rv_pos_y", ".1f"), ("rv_speed", ".1f"), ("rv_heading", ".1f"),
+    ("target_id", None), ("eebl_warn", None), ("ima_warn", None),
+]
+
+# Ids and warning flags (the str()-formatted fields), read from CSVs as nullable integers:
+# pandas would otherwise infer int64 or float64 per chunk, so "12" vs "12.0" would depend on
+# whether a block happens to contain a missing value.
+INT_FIELDS = [name for name, fmt in TEXT_FIELDS if fmt is None]
+
+def csv_dtypes(colmap: Dict[str, str] = DEFAULT_COLMAP) -> Dict[str, str]:
+    """`read_csv(dtype=...)` for the INT_FIELDS source columns."""
+    return {colmap.get(name, name): "Int64" for name in INT_FIELDS}
+
+def _text_column(df: Any, col: str, fmt: Optional[str]) -> List[str]:
+    if col not in df.columns:
+        return ["?"] * len(df)
+    s = df[col]
+    if fmt is None:
+        if isinstance(s.dtype, pd.Int64Dtype) or (isinstance(s.dtype, np.dtype) and s.dtype.kind in "biu"):
+            # integer ids and warning flags have few distinct values: format each once
+            codes, uniques = pd.factorize(s, use_na_sentinel=False)
+            return np.array([_fid(v) for v in uniques.tolist()], dtype=object)[codes].tolist()
+        return [str(v) for v in s.tolist()]
+    # Plain numpy numeric columns format directly; anything else (object, nullable,
+    # string) goes through the per-value fallback rules.
+    if isinstance(s.dtype, np.dtype) and s.dtype.kind in "biuf":
+        return [format(v, fmt) for v in s.to_numpy(dtype=np.float64).tolist()]
+    return [_fnum(v, fmt) for v in s.tolist()]
+
+def render_text_column(df: Any, colmap: Dict[str, str] = DEFAULT_COLMAP) -> List[str]:
+    """Column-wise equivalent of `row_to_text` for a whole DataFrame.
+
+    Each field is formatted once per column instead of once per row, then the
+    columns are zipped into the template. Output is byte-identical to calling
+    `row_to_text` on every row.
+    """
+    cols = [_text_column(df, colmap.get(name, name), fmt) for name, fmt in TEXT_FIELDS]
+    return [TEXT_TEMPLATE % vals for vals in zip(*cols)]
+
+# Inverse of TEXT_TEMPLATE: one capture group per TEXT_FIELDS entry.
+TEXT_FIELDS_RE = re.compile("^" + re.escape(TEXT_TEMPLATE).replace("%s", r"([^,\s()]+)"))
+
+def fields_from_text(texts: List[Any]) -> pd.DataFrame:
+    """Numeric TEXT_FIELDS recovered from rendered prompt text (NaN where absent or "?")."""
+    parsed = pd.Series(texts, dtype=object).str.extract(TEXT_FIELDS_RE)
+    parsed.columns = [name for name, _ in TEXT_FIELDS]
+    return parsed.apply(pd.to_numeric, errors="coerce")
+
+_TIME_RE = re.compile(r" at time [^ ]+ s\.")
+
+def strip_volatile_fields(text: str) -> str:
+    """Drop fields that differ between otherwise identical repeats (currently msg_rcv_time)."""
+    return _TIME_RE.sub(" at time ? s.", text)
+
+_VEHICLES_RE = re.compile(r"^Receiver vehicle (\S+) received a message from vehicle (\S+) at time ")
+
+def vehicle_ids_from_text(text: Any) -> Tuple[Optional[str], Optional[str]]:
+    """(rv_id, hv_id) as rendered by `row_to_text`, for records that only carry the text."""
+    m = _VEHICLES_RE.match(text) if isinstance(text, str) else None
+    return (m.group(1), m.group(2)) if m else (None, None)
+
+def labels_from_attack_types(values: List[Any]) -> List[str]:
+    """`label_from_attack_type` over a column, computed once per distinct value."""
+    cache: Dict[Any, str] = {}
+    out = []
+    for v in values:
+        if v not in cache:
+            cache[v] = label_from_attack_type(v)
+        out.append(cache[v])
+    return out
+
 def label_from_attack_type(attack_type: Optional[str]) -> str:
     """Binary label used in this project: attacker vs genuine."""
     if attack_type is None:
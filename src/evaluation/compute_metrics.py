@@ -2,71 +2,37 @@ from __future__ import annotations
 
 import argparse
 import json
+import sys
 from pathlib import Path
-from typing import Dict, Any, List
 
-def read_jsonl(path: Path) -> List[Dict[str, Any]]:
-    items = []
-    with path.open("r", encoding="utf-8") as r:
-        for line in r:
-            line = line.strip()
-            if not line:
-                continue
-            items.append(json.loads(line))
-    return items
+# Shared JSONL / Parquet loader lives with the preprocessing stage.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "data_preprocessing"))
+from dataset_io import load_frame
+from metrics_core import evaluate, with_legacy_keys
+
+GROUP_COLS = ["attack_type", "source_file"]
 
 def parse_args() -> argparse.Namespace:
-    ap = argparse.ArgumentParser(description="Compute basic metrics for attacker vs genuine predictions.")
-    ap.add_argument("--predictions_jsonl", required=True)
+    ap = argparse.ArgumentParser(description="Compute metrics for attacker vs genuine predictions (overall, per attack_type and per source_file).")
+    ap.add_argument("--predictions_jsonl", required=True, help="Predictions JSONL file or Parquet dataset directory.")
     ap.add_argument("--out_json", required=True)
+    ap.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap resamples for confidence intervals (0 = off).")
+    ap.add_argument("--alpha", type=float, default=0.05, help="CIs cover 1 - alpha.")
+    ap.add_argument("--seed", type=int, default=42)
     return ap.parse_args()
 
-def safe_div(a: float, b: float) -> float:
-    return float(a) / float(b) if b else 0.0
-
 def main() -> None:
     args = parse_args()
-    preds = read_jsonl(Path(args.predictions_jsonl))
-
-    total = 0
-    correct = 0
-    unknown = 0
-
-    per = {
-        "attacker": {"n": 0, "correct": 0},
-        "genuine": {"n": 0, "correct": 0},
-    }
-
-    for r in preds:
-        gold = str(r.get("label", "unknown")).lower()
-        pred = str(r.get("pred", "unknown")).lower()
-
-        if gold not in per:
-            continue  # skip unknown labels
-        total += 1
-        per[gold]["n"] += 1
-
-        if pred not in ["attacker", "genuine"]:
-            unknown += 1
-            continue
-
-        if pred == gold:
-            correct += 1
-            per[gold]["correct"] += 1
-
-    metrics = {
-        "n": total,
-        "overall_accuracy": safe_div(correct, total),
-        "unknown_rate": safe_div(unknown, total),
-        "attacker_accuracy": safe_div(per["attacker"]["correct"], per["attacker"]["n"]),
-        "genuine_accuracy": safe_div(per["genuine"]["correct"], per["genuine"]["n"]),
-    }
+    df = load_frame(Path(args.predictions_jsonl), columns=["label", "pred"] + GROUP_COLS)
+    groups = {c: df[c] for c in GROUP_COLS if c in df.columns and df[c].notna().any()}
+    metrics = with_legacy_keys(evaluate(df["label"], df["pred"], groups=groups,
+                                        n_boot=args.bootstrap, alpha=args.alpha, seed=args.seed))
 
     out = Path(args.out_json)
     out.parent.mkdir(parents=True, exist_ok=True)
     out.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
 
-    print(json.dumps(metrics, indent=2))
+    print(json.dumps({k: v for k, v in metrics.items() if not k.startswith("by_")}, indent=2))
 
 if __name__ == "__main__":
     main()
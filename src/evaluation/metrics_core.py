@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+CLASSES = ["attacker", "genuine"]
+ATTACKER, GENUINE, UNKNOWN = 0, 1, 2
+N_PRED = 3  # attacker, genuine, unknown/invalid
+METRIC_NAMES = ["accuracy", "unknown_rate", "precision", "recall", "f1", "attacker_accuracy", "genuine_accuracy"]
+
+def encode(values: Iterable[Any], missing: int = -1) -> np.ndarray:
+    """Map label strings to 0=attacker, 1=genuine, `missing` for anything else (case-insensitive).
+
+    Factorizes first so only the distinct values are lowercased, which keeps this
+    O(n) in C even for multi-million-row columns.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    index = {c: i for i, c in enumerate(CLASSES)}
+    # trailing entry catches the NA sentinel (-1)
+    lut = np.array([index.get(str(u).lower(), missing) for u in uniques] + [missing], dtype=np.int8)
+    return lut[codes]
+
+def encode_groups(values: Iterable[Any]) -> Tuple[np.ndarray, List[str]]:
+    """Integer group codes plus their names; missing values become the group "None"."""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna("None").astype(str), sort=True)
+    return codes.astype(np.int64), [str(u) for u in uniques]
+
+def confusion(gold: np.ndarray, pred: np.ndarray, groups: Optional[np.ndarray] = None,
+              n_groups: int = 1) -> np.ndarray:
+    """(n_groups, 2, 3) confusion counts: gold attacker/genuine x pred attacker/genuine/unknown.
+
+    Rows with unknown gold (code < 0) are skipped; preds outside the classes count as unknown.
+    """
+    keep = gold >= 0
+    g = gold[keep].astype(np.int64)
+    p = np.where(pred[keep] >= 0, pred[keep], UNKNOWN).astype(np.int64)
+    cell = g * N_PRED + p
+    if groups is not None:
+        cell = groups[keep] * (2 * N_PRED) + cell
+    return np.bincount(cell, minlength=n_groups * 2 * N_PRED).reshape(n_groups, 2, N_PRED)
+
+def _div(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    return np.divide(a, b, out=np.zeros(np.broadcast(a, b).shape), where=b != 0)
+
+def scores(cm: np.ndarray, answered_only: bool = False) -> Dict[str, np.ndarray]:
+    """Metrics for confusion matrices of shape (..., 2, 3), vectorized over the leading axes.
+
+    precision/recall/f1 treat "attacker" as the positive class; unknown preds count as
+    misses. With `answered_only`, per-class accuracies exclude unknown preds from the
+    denominator (the convention of the prompt sweep).
+    """
+    cm = np.asarray(cm)
+    n = cm.sum(axis=(-2, -1))
+    tp = cm[..., ATTACKER, ATTACKER]
+    tn = cm[..., GENUINE, GENUINE]
+    fp = cm[..., GENUINE, ATTACKER]
+    n_att = cm[..., ATTACKER, :].sum(axis=-1)
+    n_gen = cm[..., GENUINE, :].sum(axis=-1)
+    if answered_only:
+        n_att = n_att - cm[..., ATTACKER, UNKNOWN]
+        n_gen = n_gen - cm[..., GENUINE, UNKNOWN]
+    precision = _div(tp, tp + fp)
+    recall = _div(tp, cm[..., ATTACKER, :].sum(axis=-1))
+    return {
+        "n": n,
+        "accuracy": _div(tp + tn, n),
+        "unknown_rate": _div(cm[..., :, UNKNOWN].sum(axis=-1), n),
+        "precision": precision,
+        "recall": recall,
+        "f1": _div(2 * precision * recall, precision + recall),
+        "attacker_accuracy": _div(tp, n_att),
+        "genuine_accuracy": _div(tn, n_gen),
+    }
+
+def bootstrap_ci(cm: np.ndarray, n_boot: int = 1000, alpha: float = 0.05, seed: int = 42,
+                 answered_only: bool = False) -> Dict[str, np.ndarray]:
+    """Percentile bootstrap intervals, shape (..., 2) per metric.
+
+    Resampling n rows with replacement only changes the metrics through the six
+    confusion cell counts, so each resample is drawn directly as Multinomial(n, cell
+    frequencies). That is the same distribution as row resampling, at a cost that does
+    not depend on n. Leading axes (e.g. groups) are resampled independently.
+    """
+    cm = np.asarray(cm)
+    lead = cm.shape[:-2]
+    flat = cm.reshape(-1, 2 * N_PRED)
+    rng = np.random.default_rng(seed)
+    draws = np.zeros((n_boot, flat.shape[0], 2 * N_PRED), dtype=np.int64)
+    for i, counts in enumerate(flat):
+        n = int(counts.sum())
+        if n:
+            draws[:, i] = rng.multinomial(n, counts / n, size=n_boot)
+    sampled = scores(draws.reshape((n_boot,) + lead + (2, N_PRED)), answered_only=answered_only)
+    q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    return {k: np.moveaxis(np.percentile(sampled[k], q, axis=0), 0, -1) for k in METRIC_NAMES}
+
+def summarize(cm: np.ndarray, ci: Optional[Dict[str, np.ndarray]] = None,
+              answered_only: bool = False) -> Dict[str, Any]:
+    """JSON-ready metrics for a single (2, 3) confusion matrix."""
+    s = scores(cm, answered_only=answered_only)
+    out: Dict[str, Any] = {"n": int(s["n"])}
+    out.update({k: float(s[k]) for k in METRIC_NAMES})
+    out["confusion_matrix"] = {
+        "labels": CLASSES,
+        "preds": CLASSES + ["unknown"],
+        "counts": np.asarray(cm).astype(int).tolist(),
+    }
+    if ci is not None:
+        out["ci"] = {k: [float(v[0]), float(v[1])] for k, v in ci.items()}
+    return out
+
+def evaluate(labels: Iterable[Any], preds: Iterable[Any], groups: Optional[Dict[str, Iterable[Any]]] = None,
+             n_boot: int = 0, alpha: float = 0.05, seed: int = 42, answered_only: bool = False) -> Dict[str, Any]:
+    """Encode once, then score overall and per grouping column (e.g. attack_type, source_file)."""
+    gold = encode(labels)
+    pred = encode(preds, missing=UNKNOWN)
+    cm = confusion(gold, pred)[0]
+    ci = bootstrap_ci(cm, n_boot, alpha, seed, answered_only) if n_boot else None
+    out = summarize(cm, ci, answered_only)
+    for col, values in (groups or {}).items():
+        codes, names = encode_groups(values)
+        gcm = confusion(gold, pred, codes, len(names))
+        gci = bootstrap_ci(gcm, n_boot, alpha, seed, answered_only) if n_boot else None
+        out[f"by_{col}"] = {
+            name: summarize(gcm[i], None if gci is None else {k: v[i] for k, v in gci.items()}, answered_only)
+            for i, name in enumerate(names)
+        }
+    return out
+
+def with_legacy_keys(res: Dict[str, Any]) -> Dict[str, Any]:
+    """Reorder an `evaluate` result so the original report keys (n, overall_accuracy, unknown_rate,
+    attacker_accuracy, genuine_accuracy) come first under their original names."""
+    res = dict(res)
+    out: Dict[str, Any] = {"n": res.pop("n"), "overall_accuracy": res.pop("accuracy")}
+    for k in ["unknown_rate", "attacker_accuracy", "genuine_accuracy"]:
+        out[k] = res.pop(k)
+    out.update(res)
+    if "ci" in out:
+        out["ci"] = {("overall_accuracy" if k == "accuracy" else k): v for k, v in out["ci"].items()}
+    return out
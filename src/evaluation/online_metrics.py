@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import math
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from metrics_core import CLASSES, N_PRED, UNKNOWN, scores, with_legacy_keys
+
+SNAPSHOT_VERSION = 1
+_CODE = {c: i for i, c in enumerate(CLASSES)}
+
+def _code(value: Any) -> int:
+    return _CODE.get(str(value).lower(), -1)
+
+def _time(value: Any) -> Optional[float]:
+    try:
+        t = float(value)
+    except (TypeError, ValueError):
+        return None
+    return t if math.isfinite(t) else None
+
+class MetricAccumulator:
+    """Constant-memory running metrics that can be updated per prediction and merged exactly.
+
+    Holds the overall confusion matrix, one per attack_type, and per-time-bin
+    (n, correct, unknown) counts with the same semantics as time_slice_metrics.py.
+    Memory grows only with the number of attack types and occupied time bins, never
+    with the number of predictions, and `merge` of shard accumulators equals the
+    accumulator of the concatenated shards.
+    """
+
+    def __init__(self, bin_seconds: float = 5.0, time_field: str = "msg_rcv_time"):
+        self.bin_seconds = float(bin_seconds)
+        self.time_field = time_field
+        self.n_seen = 0
+        self.cm = np.zeros((2, N_PRED), dtype=np.int64)
+        self.by_attack: Dict[str, np.ndarray] = {}
+        self.bins: Dict[int, List[int]] = {}
+
+    def update(self, label: Any, pred: Any, t: Any = None, attack_type: Any = None) -> None:
+        self.n_seen += 1
+        g = _code(label)
+        p = _code(pred)
+        p = UNKNOWN if p < 0 else p
+        if g >= 0:
+            self.cm[g, p] += 1
+            key = str(attack_type)
+            if key not in self.by_attack:
+                self.by_attack[key] = np.zeros((2, N_PRED), dtype=np.int64)
+            self.by_attack[key][g, p] += 1
+        t = _time(t)
+        if t is not None and g >= 0:
+            cell = self.bins.setdefault(int(math.floor(t / self.bin_seconds)), [0, 0, 0])
+            cell[0] += 1
+            cell[1] += int(p == g)
+            cell[2] += int(p == UNKNOWN)
+
+    def update_record(self, rec: Dict[str, Any]) -> None:
+        self.update(rec.get("label"), rec.get("pred"), rec.get(self.time_field), rec.get("attack_type"))
+
+    def merge(self, other: "MetricAccumulator") -> "MetricAccumulator":
+        if other.bin_seconds != self.bin_seconds or other.time_field != self.time_field:
+            raise ValueError(
+                f"Cannot merge accumulators with different time bins: "
+                f"{self.time_field}/{self.bin_seconds}s vs {other.time_field}/{other.bin_seconds}s"
+            )
+        self.n_seen += other.n_seen
+        self.cm += other.cm
+        for k, m in other.by_attack.items():
+            if k in self.by_attack:
+                self.by_attack[k] += m
+            else:
+                self.by_attack[k] = m.copy()
+        for b, c in other.bins.items():
+            cell = self.bins.setdefault(b, [0, 0, 0])
+            for j in range(3):
+                cell[j] += c[j]
+        return self
+
+    def summary(self) -> Dict[str, Any]:
+        """Headline metrics in compute_metrics.py's key order, plus per-attack_type scores."""
+        def flat(cm: np.ndarray) -> Dict[str, Any]:
+            s = scores(cm)
+            return with_legacy_keys({"n": int(s["n"]), **{k: float(v) for k, v in s.items() if k != "n"}})
+        out = flat(self.cm)
+        out["n_seen"] = self.n_seen
+        out["by_attack_type"] = {k: flat(m) for k, m in sorted(self.by_attack.items())}
+        return out
+
+    def time_slice_rows(self) -> List[List[Any]]:
+        """Rows identical to the time_slice_metrics.py CSV body."""
+        rows = []
+        for b in sorted(self.bins):
+            n, correct, unknown = self.bins[b]
+            rows.append([b, b * self.bin_seconds, (b + 1) * self.bin_seconds, n,
+                         correct / n if n else 0.0, unknown / n if n else 0.0])
+        return rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": SNAPSHOT_VERSION,
+            "bin_seconds": self.bin_seconds,
+            "time_field": self.time_field,
+            "n_seen": self.n_seen,
+            "confusion": self.cm.tolist(),
+            "by_attack_type": {k: m.tolist() for k, m in self.by_attack.items()},
+            "bins": {str(b): c for b, c in self.bins.items()},
+            "summary": self.summary(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "MetricAccumulator":
+        if d.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported metrics snapshot version: {d.get('version')}")
+        acc = cls(bin_seconds=d["bin_seconds"], time_field=d["time_field"])
+        acc.n_seen = int(d["n_seen"])
+        acc.cm = np.asarray(d["confusion"], dtype=np.int64)
+        acc.by_attack = {k: np.asarray(m, dtype=np.int64) for k, m in d["by_attack_type"].items()}
+        acc.bins = {int(b): list(c) for b, c in d["bins"].items()}
+        return acc
+
+    def dump(self, path: Path) -> None:
+        """Write a snapshot atomically (tmp file + rename) so readers never see a partial file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(self.to_dict(), indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "MetricAccumulator":
+        return cls.from_dict(json.loads(Path(path).read_text(encoding="utf-8")))
+
+def accumulate(records: Iterable[Dict[str, Any]], bin_seconds: float = 5.0,
+               time_field: str = "msg_rcv_time") -> MetricAccumulator:
+    acc = MetricAccumulator(bin_seconds, time_field)
+    for rec in records:
+        acc.update_record(rec)
+    return acc
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Merge metric snapshots written by run_prompting.py --metrics_snapshot.")
+    ap.add_argument("snapshots", nargs="+", help="Snapshot JSON files (e.g. one per shard).")
+    ap.add_argument("--out_json", required=True, help="Merged snapshot (includes the summary).")
+    ap.add_argument("--out_csv", default=None, help="Optional time-sliced CSV, same format as time_slice_metrics.py.")
+    return ap.parse_args()
+
+def main() -> None:
+    args = parse_args()
+    acc = MetricAccumulator.load(Path(args.snapshots[0]))
+    for p in args.snapshots[1:]:
+        acc.merge(MetricAccumulator.load(Path(p)))
+    acc.dump(Path(args.out_json))
+    if args.out_csv:
+        out = Path(args.out_csv)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with out.open("w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["bin_index", "time_start", "time_end", "n", "accuracy", "unknown_rate"])
+            w.writerows(acc.time_slice_rows())
+    s = acc.summary()
+    print(json.dumps({k: v for k, v in s.items() if k != "by_attack_type"}, indent=2))
+
+if __name__ == "__main__":
+    main()
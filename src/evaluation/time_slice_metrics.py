@@ -1,78 +1,165 @@
 from __future__ import annotations
 
 import argparse
-import json
-from pathlib import Path
-from typing import Dict, Any, List, Optional
-import math
 import csv
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+import sys
+
+import numpy as np
+import pandas as pd
+
+from metrics_core import UNKNOWN, encode, encode_groups
 
-def read_jsonl(path: Path) -> List[Dict[str, Any]]:
-    items = []
-    with path.open("r", encoding="utf-8") as r:
-        for line in r:
-            line = line.strip()
-            if not line:
-                continue
-            items.append(json.loads(line))
-    return items
+# Shared JSONL / Parquet loader lives with the preprocessing stage.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "data_preprocessing"))
+from dataset_io import is_parquet, load_frame
+from utils_data import vehicle_ids_from_text
+
+SLICE_HEADER = ["bin_index", "time_start", "time_end", "n", "accuracy", "unknown_rate"]
 
 def parse_args() -> argparse.Namespace:
     ap = argparse.ArgumentParser(description="Compute accuracy per time bin (time-sliced evaluation).")
-    ap.add_argument("--predictions_jsonl", required=True)
+    ap.add_argument("--predictions_jsonl", required=True, help="Predictions JSONL file or Parquet dataset directory.")
     ap.add_argument("--time_field", default="msg_rcv_time")
-    ap.add_argument("--bin_seconds", type=float, default=5.0)
+    ap.add_argument("--bin_seconds", type=float, nargs="+", default=[5.0],
+                    help="One or more bin widths; all are answered from a single sorted index.")
     ap.add_argument("--out_csv", required=True)
+    ap.add_argument("--group_by", default=None,
+                    help="Also slice per value of this column (e.g. attack_type, source_file, rv_id).")
+    ap.add_argument("--join_input", default=None,
+                    help="Input dataset the predictions came from; --group_by columns missing from the predictions "
+                         "are looked up here by id (rv_id/hv_id are parsed from the text for JSONL inputs).")
+    ap.add_argument("--window_seconds", type=float, default=None, help="Sliding-window width (enables --windows_csv).")
+    ap.add_argument("--step_seconds", type=float, default=None, help="Sliding-window step (default: window / 2).")
+    ap.add_argument("--windows_csv", default=None, help="Output CSV for sliding-window accuracy.")
     return ap.parse_args()
 
-def extract_time(x: Any) -> Optional[float]:
-    try:
-        if x is None:
-            return None
-        return float(x)
-    except Exception:
-        return None
+class TimeIndex:
+    """Predictions sorted by time once, with prefix sums of n / correct / unknown.
 
-def main() -> None:
-    args = parse_args()
-    items = read_jsonl(Path(args.predictions_jsonl))
+    Any set of time intervals is then answered with two binary searches per interval,
+    and any bin width with one vectorized pass over the sorted times. Records with
+    unknown gold labels or no usable time are left out, so they never open a bin.
+    """
+
+    def __init__(self, t: np.ndarray, correct: np.ndarray, unknown: np.ndarray):
+        order = np.argsort(t, kind="stable")
+        self.t = t[order]
+        self.cum_correct = np.concatenate([[0], np.cumsum(correct[order], dtype=np.int64)])
+        self.cum_unknown = np.concatenate([[0], np.cumsum(unknown[order], dtype=np.int64)])
 
-    # bin -> counters
-    bins: Dict[int, Dict[str, float]] = {}
+    def __len__(self) -> int:
+        return len(self.t)
 
-    for r in items:
-        t = extract_time(r.get(args.time_field))
-        if t is None:
-            continue
-        b = int(math.floor(t / args.bin_seconds))
-        gold = str(r.get("label", "unknown")).lower()
-        pred = str(r.get("pred", "unknown")).lower()
+    def _between(self, lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(n, correct, unknown) for sorted positions [lo, hi)."""
+        return (hi - lo, self.cum_correct[hi] - self.cum_correct[lo], self.cum_unknown[hi] - self.cum_unknown[lo])
 
-        if b not in bins:
-            bins[b] = {"n": 0, "correct": 0, "unknown": 0}
+    def windows(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Counts for arbitrary half-open intervals [start, end)."""
+        return self._between(np.searchsorted(self.t, starts, "left"), np.searchsorted(self.t, ends, "left"))
 
-        if gold not in ["attacker", "genuine"]:
-            continue
+    def bins(self, width: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Occupied bins floor(t / width) with their counts (same binning as before, empty bins omitted)."""
+        b = np.floor(self.t / width).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]]) if len(b) else np.zeros(0, dtype=np.int64)
+        ends = np.r_[starts[1:], len(b)].astype(np.int64)
+        return (b[starts],) + self._between(starts, ends)
 
-        bins[b]["n"] += 1
-        if pred not in ["attacker", "genuine"]:
-            bins[b]["unknown"] += 1
-        elif pred == gold:
-            bins[b]["correct"] += 1
+    def sliding(self, window: float, step: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Windows [s, s + window) for s = t_min, t_min + step, ... covering every record."""
+        if not len(self.t):
+            return (np.zeros(0),) * 4
+        starts = self.t[0] + step * np.arange(int(np.floor((self.t[-1] - self.t[0]) / step)) + 1)
+        return (starts,) + self.windows(starts, starts + window)
 
+def _rates(n: np.ndarray, correct: np.ndarray, unknown: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    nf = n.astype(float)
+    acc = np.divide(correct, nf, out=np.zeros(len(n)), where=n > 0)
+    unk = np.divide(unknown, nf, out=np.zeros(len(n)), where=n > 0)
+    return acc, unk
+
+def build_indexes(t: np.ndarray, gold: np.ndarray, pred: np.ndarray,
+                  groups: Optional[np.ndarray] = None, names: Sequence[str] = ()) -> Dict[Optional[str], TimeIndex]:
+    """One index over all usable records, plus one per group value when `groups` is given."""
+    keep = np.isfinite(t) & (gold >= 0)
+    correct = (pred == gold) & keep
+    unknown = (pred == UNKNOWN) & keep
+    out: Dict[Optional[str], TimeIndex] = {None: TimeIndex(t[keep], correct[keep], unknown[keep])}
+    if groups is not None:
+        g = groups[keep]
+        order = np.argsort(g, kind="stable")
+        cuts = np.searchsorted(g[order], np.arange(len(names) + 1))
+        tk, ck, uk = t[keep][order], correct[keep][order], unknown[keep][order]
+        for j, name in enumerate(names):
+            lo, hi = cuts[j], cuts[j + 1]
+            if hi > lo:
+                out[name] = TimeIndex(tk[lo:hi], ck[lo:hi], uk[lo:hi])
+    return out
+
+def join_columns(df: pd.DataFrame, input_path: Path, columns: List[str]) -> pd.DataFrame:
+    """Attach `columns` from the input dataset by id."""
+    if is_parquet(input_path):
+        src = load_frame(input_path, columns=["id"] + columns)
+    else:
+        src = load_frame(input_path, columns=["id", "text"] + columns)
+        ids = [vehicle_ids_from_text(x) for x in src["text"].tolist()]
+        for j, col in enumerate(["rv_id", "hv_id"]):
+            if col in columns and src[col].isna().all():
+                src[col] = [x[j] for x in ids]
+        src = src.drop(columns=["text"])
+    return df.merge(src, on="id", how="left")
+
+def main() -> None:
+    args = parse_args()
+    cols = ["id", args.time_field, "label", "pred"]
+    if args.group_by:
+        cols.append(args.group_by)
+    df = load_frame(Path(args.predictions_jsonl), columns=cols)
+    if args.group_by and args.join_input and (args.group_by not in df.columns or df[args.group_by].isna().all()):
+        df = join_columns(df.drop(columns=[args.group_by], errors="ignore"), Path(args.join_input), [args.group_by])
+
+    t = pd.to_numeric(df[args.time_field], errors="coerce").to_numpy(dtype=np.float64)
+    gold = encode(df["label"])
+    pred = encode(df["pred"], missing=UNKNOWN)
+    groups, names = (None, [])
+    if args.group_by:
+        if args.group_by not in df.columns:
+            raise KeyError(f"Column '{args.group_by}' not found; pass --join_input to look it up in the input dataset.")
+        groups, names = encode_groups(df[args.group_by])
+    indexes = build_indexes(t, gold, pred, groups, names)
+
+    multi = len(args.bin_seconds) > 1 or args.group_by is not None
     out = Path(args.out_csv)
     out.parent.mkdir(parents=True, exist_ok=True)
 
     with out.open("w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
-        w.writerow(["bin_index", "time_start", "time_end", "n", "accuracy", "unknown_rate"])
-        for b in sorted(bins.keys()):
-            n = bins[b]["n"]
-            acc = (bins[b]["correct"] / n) if n else 0.0
-            unk = (bins[b]["unknown"] / n) if n else 0.0
-            w.writerow([b, b * args.bin_seconds, (b + 1) * args.bin_seconds, int(n), acc, unk])
+        w.writerow((["group", "bin_seconds"] if multi else []) + SLICE_HEADER)
+        for name, idx in indexes.items():
+            for width in args.bin_seconds:
+                b, n, correct, unknown = idx.bins(width)
+                acc, unk = _rates(n, correct, unknown)
+                lead = ["ALL" if name is None else name, width] if multi else []
+                for j in range(len(b)):
+                    w.writerow(lead + [int(b[j]), b[j] * width, (b[j] + 1) * width, int(n[j]), acc[j], unk[j]])
 
     print(f"Wrote time-sliced metrics to {out}")
 
+    if args.window_seconds:
+        step = args.step_seconds or args.window_seconds / 2
+        wout = Path(args.windows_csv or out.with_name(out.stem + "_windows.csv"))
+        with wout.open("w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["group", "window_start", "window_end", "n", "accuracy", "unknown_rate"])
+            for name, idx in indexes.items():
+                starts, n, correct, unknown = idx.sliding(args.window_seconds, step)
+                acc, unk = _rates(n, correct, unknown)
+                for j in range(len(starts)):
+                    w.writerow(["ALL" if name is None else name, starts[j], starts[j] + args.window_seconds,
+                                int(n[j]), acc[j], unk[j]])
+        print(f"Wrote sliding-window metrics to {wout}")
+
 if __name__ == "__main__":
     main()
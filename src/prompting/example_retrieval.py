@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# The numeric feature matrix is shared with the classical baselines.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "baselines"))
+from baseline_features import feature_matrix, feature_names, has_trajectory, load_features_frame
+
+POOLED = "ALL"       # neighbours from every attack type, for keys the pool has no rows of
+LABELS = ["attacker", "genuine"]
+BLOCK_CELLS = 1 << 24  # query x index distances computed per block (~64 MB of float32)
+
+class FeatureVectorizer:
+    """Numeric log fields (plus derived and traj_* features) standardized with pool statistics.
+
+    Missing values map to the pool mean (0 after scaling), so a record without sender
+    history is compared on the fields it has.
+    """
+
+    def __init__(self, names: Sequence[str]):
+        self.names = list(names)
+        self.mean: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def fit_transform(self, df: pd.DataFrame) -> np.ndarray:
+        X = feature_matrix(df, self.names)
+        with np.errstate(invalid="ignore"):
+            self.mean = np.nan_to_num(np.nanmean(X, axis=0)).astype(np.float32)
+            std = np.nan_to_num(np.nanstd(X, axis=0))
+        self.scale = np.where(std > 0, 1.0 / np.where(std > 0, std, 1.0), 0.0).astype(np.float32)
+        return self._scale(X)
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        return self._scale(feature_matrix(df, self.names))
+
+    def _scale(self, X: np.ndarray) -> np.ndarray:
+        X = (X - self.mean) * self.scale
+        return np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0).astype(np.float32)
+
+def top_k(queries: np.ndarray, index: np.ndarray, index_sq: np.ndarray, k: int,
+          exclude: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """(positions, squared distances) of the k nearest index rows per query, nearest first.
+
+    Exact search: ||q - x||^2 = ||q||^2 + ||x||^2 - 2 q.x, one matrix product per block of
+    queries (||q||^2 is added only to the winners). For the small k used for few-shot
+    examples, k argmin passes beat argpartition several times over. `exclude` holds
+    (query, index position) pairs that are never returned; -1 pads when too few rows remain.
+    """
+    m, n = len(queries), len(index)
+    k = min(k, n)
+    pos = np.full((m, k), -1, dtype=np.int64)
+    dist = np.full((m, k), np.inf, dtype=np.float32)
+    if k == 0 or m == 0:
+        return pos, dist
+    step = max(1, BLOCK_CELLS // n)
+    q_sq = np.einsum("ij,ij->i", queries, queries)
+    for lo in range(0, m, step):
+        d = queries[lo:lo + step] @ index.T
+        d *= -2.0
+        d += index_sq
+        if exclude is not None:
+            hit = (exclude[0] >= lo) & (exclude[0] < lo + step)
+            d[exclude[0][hit] - lo, exclude[1][hit]] = np.inf
+        r = np.arange(len(d))
+        if k <= 8:
+            for j in range(k):
+                best = d.argmin(axis=1)
+                pos[lo:lo + step, j] = best
+                dist[lo:lo + step, j] = d[r, best]
+                d[r, best] = np.inf
+        else:
+            part = np.argpartition(d, k - 1, axis=1)[:, :k]
+            dp = np.take_along_axis(d, part, axis=1)
+            order = np.argsort(dp, axis=1, kind="stable")
+            pos[lo:lo + step] = np.take_along_axis(part, order, axis=1)
+            dist[lo:lo + step] = np.take_along_axis(dp, order, axis=1)
+        dist[lo:lo + step] += q_sq[lo:lo + step, None]
+    pos[np.isinf(dist)] = -1
+    return pos, dist
+
+class ExampleIndex:
+    """Labelled pool records (e.g. dev.jsonl) as one float32 matrix with per-(attack key, label) row sets.
+
+    An attack key's neighbours come from that attack's attacker rows and from the Genuine
+    rows, mirroring the binary attack-vs-genuine setup of the prompts. Each row set is
+    capped at `max_per_class` (random sample), which keeps the index compact and a query
+    cost independent of the pool size.
+    """
+
+    def __init__(self, df: pd.DataFrame, max_per_class: int = 2000, seed: int = 42):
+        df = df[df["label"].isin(LABELS)].reset_index(drop=True)
+        self.texts: List[str] = df["text"].fillna("").astype(str).tolist()
+        self.labels = df["label"].to_numpy(dtype=object)
+        self.vectorizer = FeatureVectorizer(feature_names(has_trajectory(df)))
+        self.vectors = self.vectorizer.fit_transform(df)
+        self.sq = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        self.rows_of_text: Dict[str, List[int]] = {}
+        for i, text in enumerate(self.texts):
+            self.rows_of_text.setdefault(text, []).append(i)
+
+        rng = np.random.default_rng(seed)
+        at = df["attack_type"].astype(str).to_numpy()
+        attacker = self.labels == "attacker"
+        genuine_rows = self._cap(np.flatnonzero(~attacker), max_per_class, rng)
+        self.rows: Dict[Tuple[str, str], np.ndarray] = {
+            (POOLED, "attacker"): self._cap(np.flatnonzero(attacker), max_per_class, rng),
+            (POOLED, "genuine"): genuine_rows,
+        }
+        for key in sorted(set(at[attacker])):
+            self.rows[(key, "attacker")] = self._cap(np.flatnonzero(attacker & (at == key)), max_per_class, rng)
+            self.rows[(key, "genuine")] = genuine_rows
+
+    @staticmethod
+    def _cap(rows: np.ndarray, cap: int, rng: np.random.Generator) -> np.ndarray:
+        return np.sort(rng.choice(rows, cap, replace=False)) if cap and len(rows) > cap else rows
+
+    @classmethod
+    def from_path(cls, path: Path, max_per_class: int = 2000, seed: int = 42) -> "ExampleIndex":
+        return cls(load_features_frame(path, extra_columns=["text"]), max_per_class=max_per_class, seed=seed)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def keys(self) -> List[str]:
+        return sorted({key for key, _ in self.rows})
+
+    def same_text(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """(record position, pool row) pairs whose texts are equal."""
+        texts = df["text"].tolist() if "text" in df.columns else []
+        pairs = np.array([(j, i) for j, t in enumerate(texts) for i in self.rows_of_text.get(t, ())],
+                         dtype=np.int64).reshape(-1, 2)
+        return pairs[:, 0], pairs[:, 1]
+
+    def query(self, df: pd.DataFrame, attack_keys: Sequence[Any], k: int = 4, balanced: bool = True) -> np.ndarray:
+        """Pool row ids of the k nearest labelled neighbours per record (n, k), nearest first; -1 pads.
+
+        With `balanced`, half come from each label (attacker first when k is odd), so the
+        examples never show only one class. Pool rows with the same text as the record (the
+        record itself when the pool overlaps the inputs) are never returned, since their
+        label would give the answer away.
+        """
+        Q = self.vectorizer.transform(df)
+        keys = np.asarray([str(x) for x in attack_keys], dtype=object)
+        own_q, own_row = self.same_text(df)
+        out = np.full((len(df), k), -1, dtype=np.int64)
+        for key in np.unique(keys):
+            sel = np.flatnonzero(keys == key)
+            base = key if (key, "attacker") in self.rows else POOLED
+            quota = {"attacker": (k + 1) // 2, "genuine": k // 2} if balanced else {lab: k for lab in LABELS}
+            in_sel = np.isin(own_q, sel)
+            sel_q, sel_row = np.searchsorted(sel, own_q[in_sel]), own_row[in_sel]
+            pos_parts, dist_parts = [], []
+            for lab in LABELS:
+                rows = self.rows[(base, lab)]
+                at = np.minimum(np.searchsorted(rows, sel_row), max(len(rows) - 1, 0))
+                hit = rows[at] == sel_row if len(rows) else np.zeros(len(sel_row), dtype=bool)
+                pos, dist = top_k(Q[sel], self.vectors[rows], self.sq[rows], quota[lab], exclude=(sel_q[hit], at[hit]))
+                pos_parts.append(np.where(pos >= 0, rows[np.maximum(pos, 0)], -1))
+                dist_parts.append(dist)
+            pos, dist = np.concatenate(pos_parts, axis=1), np.concatenate(dist_parts, axis=1)
+            order = np.argsort(dist, axis=1, kind="stable")[:, :k]
+            picked = np.take_along_axis(pos, order, axis=1)
+            out[sel, :picked.shape[1]] = picked
+        return out
+
+    def example_block(self, rows: Sequence[int]) -> str:
+        """Few-shot block in the format of examples/few_shot_examples.txt."""
+        return "\n\n".join(
+            f"Example ({self.labels[i]}):\nLog entry:\n{self.texts[i]}\nAnswer: {self.labels[i]}"
+            for i in rows if i >= 0
+        )
+
+def merge_neighbours(rows: Sequence[np.ndarray], k: int) -> List[int]:
+    """One example list for a batch prompt: members' neighbours by rank, de-duplicated, at most k."""
+    seen: List[int] = []
+    for rank in range(max((len(r) for r in rows), default=0)):
+        for r in rows:
+            if rank < len(r) and r[rank] >= 0 and r[rank] not in seen:
+                seen.append(int(r[rank]))
+                if len(seen) == k:
+                    return seen
+    return seen
@@ -1,9 +1,17 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import math
 import os
+import random
 import re
+import threading
+import time
+import warnings
 from dataclasses import dataclass
-from typing import Optional, Dict, Any, List
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable, Tuple
 
 # Provider: Groq (https://console.groq.com/)
 try:
@@ -11,7 +19,10 @@ try:
 except Exception:
     Groq = None
 
-LABEL_RE = re.compile(r"\b(attacker|genuine)\b", re.IGNORECASE)
+SYSTEM_PROMPT = "You are a precise classifier. Output only the final label."
+
+# The prompt templates ask for "attack or genuine"; both "attack" and "attacker" mean attacker.
+LABEL_RE = re.compile(r"\b(attacker|attack|genuine)\b", re.IGNORECASE)
 
 def extract_label(text: str) -> str:
     if not text:
@@ -19,18 +30,120 @@ def extract_label(text: str) -> str:
     m = LABEL_RE.search(text.strip())
     if not m:
         return "unknown"
-    return m.group(1).lower()
+    return "genuine" if m.group(1).lower() == "genuine" else "attacker"
+
+# What the prompts ask for: the label alone (case and punctuation aside), or "<n>: label" in a batch.
+STRICT_LABEL_RE = re.compile(r"^\W*(?:\[?\d+\]?\s*[:.)\-]?\s*)?(attacker|attack|genuine)\W*$", re.IGNORECASE)
+
+def is_valid_reply(text: Optional[str]) -> bool:
+    """True for a bare-label reply (or batch reply line); hedged or chatty replies fail even when
+    extract_label finds a label."""
+    return bool(text) and STRICT_LABEL_RE.match(text) is not None
+
+BATCH_LINE_RE = re.compile(r"^\s*\[?(\d+)\]?\s*[:.)\-]?\s*(attacker|attack|genuine)\b", re.IGNORECASE)
+
+# Completion tokens to allow per record in a batched request ("12: genuine\n" plus slack).
+BATCH_TOKENS_PER_RECORD = 8
+
+def parse_batch_replies(text: str, k: int) -> Optional[List[Tuple[str, str]]]:
+    """Strictly parse a K-record batch reply ("<n>: attack|genuine" per line).
+
+    Returns (label, reply line) in record order, or None unless every number 1..k appears
+    exactly once with a valid label (non-matching lines are ignored).
+    """
+    found: Dict[int, Tuple[str, str]] = {}
+    for line in (text or "").splitlines():
+        m = BATCH_LINE_RE.match(line)
+        if not m:
+            continue
+        n = int(m.group(1))
+        if n < 1 or n > k or n in found:
+            return None
+        found[n] = ("genuine" if m.group(2).lower() == "genuine" else "attacker", line.strip())
+    if len(found) != k:
+        return None
+    return [found[i] for i in range(1, k + 1)]
+
+def generate_batch(call: Callable[[str], "LLMResponse"], batch_prompt: str, single_prompts: List[str],
+                   single_call: Optional[Callable[[str], "LLMResponse"]] = None) -> Tuple[List[Tuple[str, str]], bool]:
+    """Classify K records with one batched request.
+
+    Returns ((pred, raw_text) per record, batched_ok); a record's raw_text is its own line of
+    the reply. If the reply is malformed, every record is re-sent on its own through
+    `single_call` (default `call`) and batched_ok is False.
+    """
+    resp = call(batch_prompt)
+    replies = parse_batch_replies(resp.text, len(single_prompts))
+    if replies is not None:
+        return replies, True
+    out = []
+    for p in single_prompts:
+        r = (single_call or call)(p)
+        out.append((extract_label(r.text), r.text))
+    return out, False
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+def status_code_of(exc: BaseException) -> Optional[int]:
+    """Best-effort HTTP status of a provider exception (None for transport errors)."""
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(exc: BaseException) -> bool:
+    """True for rate limits (429), server errors (5xx), timeouts and connection errors."""
+    code = status_code_of(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS or code >= 500
+    name = type(exc).__name__
+    return name in ("APIConnectionError", "APITimeoutError", "RateLimitError") or isinstance(exc, (ConnectionError, TimeoutError))
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Parse a Retry-After header from the provider response, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        v = headers.get("retry-after")
+        return float(v) if v is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars/token) used for TPM budgeting before dispatch."""
+    return max(1, len(text) // 4)
 
 @dataclass
 class LLMResponse:
     text: str
     raw: Any
+    usage: Optional[Dict[str, int]] = None  # prompt_tokens / completion_tokens as reported (or simulated)
+    cached: bool = False
 
 class LLMClient:
+    provider: str = ""
+    model: str = ""
+    temperature: float = 0.0
+    max_tokens: int = 16
+    system_prompt: str = SYSTEM_PROMPT
+
     def generate(self, prompt: str) -> LLMResponse:
         raise NotImplementedError
 
+def usage_of(resp: Any) -> Optional[Dict[str, int]]:
+    """Token counts from an OpenAI-style `usage` field (None if the provider sent none)."""
+    u = getattr(resp, "usage", None)
+    if u is None:
+        return None
+    return {k: int(getattr(u, k, 0) or 0) for k in ("prompt_tokens", "completion_tokens")}
+
 class GroqClient(LLMClient):
+    provider = "groq"
+
     def __init__(self, model: str, temperature: float = 0.0, max_tokens: int = 16):
         if Groq is None:
             raise ImportError("groq package not installed. Run: pip install groq")
@@ -47,17 +160,410 @@ class GroqClient(LLMClient):
         resp = self.client.chat.completions.create(
             model=self.model,
             messages=[
-                {"role": "system", "content": "You are a precise classifier. Output only the final label."},
+                {"role": "system", "content": self.system_prompt},
                 {"role": "user", "content": prompt},
             ],
             temperature=self.temperature,
             max_tokens=self.max_tokens,
         )
         text = resp.choices[0].message.content if resp and resp.choices else ""
-        return LLMResponse(text=text or "", raw=resp)
+        return LLMResponse(text=text or "", raw=resp, usage=usage_of(resp))
+
+# -- offline providers -----------------------------------------------------------
+
+# One rendered log record (see utils_data.row_to_text), with the "Sender history:" line that
+# csv_to_jsonl.py --trajectory text appends.
+LOG_BLOCK_RE = re.compile(r"Receiver vehicle .*?IMA warning: [^\n]*?\.(?:\nSender history: [^\n]*)?(?=\n|$)", re.DOTALL)
+
+def target_log_blocks(prompt: str) -> List[str]:
+    """Log records a prompt asks about (few-shot example records are skipped)."""
+    marker = "Now classify the following log record:"
+    section = prompt.rsplit(marker, 1)[-1] if marker in prompt else prompt
+    return LOG_BLOCK_RE.findall(section)
+
+def answer_for_blocks(labels: List[str]) -> str:
+    """Reply text in the single-record or numbered batch format."""
+    if len(labels) == 1:
+        return labels[0]
+    return "\n".join(f"{i}: {label}" for i, label in enumerate(labels, 1))
+
+class ReplayClient(LLMClient):
+    """Serves recorded answers without any network access.
+
+    `source` is either a SQLite response cache written by `--cache` (looked up by the
+    cache key of the recorded provider/model/settings), or a JSONL file shaped like
+    `examples/example_output.jsonl` (records with `text` and `raw_text` or `pred`),
+    looked up by the log text found in the prompt. Misses are counted and, with
+    on_miss="warn" (default), answered "" after a warning; on_miss="raise" raises KeyError.
+    """
+
+    provider = "replay"
+
+    def __init__(self, model: str, temperature: float = 0.0, max_tokens: int = 16,
+                 source: Optional[str] = None, recorded_provider: str = "groq", on_miss: str = "warn"):
+        if not source:
+            raise ValueError("replay provider needs a 'source' option (cache .sqlite or predictions .jsonl).")
+        self.model = model
+        self.temperature = float(temperature)
+        self.max_tokens = int(max_tokens)
+        self.recorded_provider = recorded_provider
+        if on_miss not in ("warn", "raise"):
+            raise ValueError(f"on_miss must be 'warn' or 'raise', got {on_miss!r}")
+        self.on_miss = on_miss
+        self.hits = 0
+        self.misses = 0
+        self.by_text: Dict[str, str] = {}
+        self.cache = None
+        path = Path(source)
+        if path.suffix.lower() in (".sqlite", ".db", ".sqlite3"):
+            from response_cache import ResponseCache
+            self.cache = ResponseCache(path, max_entries=None)
+        else:
+            with path.open("r", encoding="utf-8") as r:
+                for line in r:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    rec = json.loads(line)
+                    if rec.get("text") is not None:
+                        self.by_text[rec["text"]] = rec.get("raw_text") or rec.get("pred") or ""
+
+    def generate(self, prompt: str) -> LLMResponse:
+        if self.cache is not None:
+            from response_cache import cache_key
+            key = cache_key(self.recorded_provider, self.model, self.temperature, self.max_tokens,
+                            self.system_prompt, prompt)
+            text = self.cache.get(key)
+            if text is not None:
+                self.hits += 1
+                return LLMResponse(text=text, raw=None)
+        blocks = target_log_blocks(prompt)
+        answers = [self.by_text.get(b) for b in blocks]
+        if blocks and all(a is not None for a in answers):
+            self.hits += 1
+            if len(answers) == 1:
+                return LLMResponse(text=answers[0], raw=None)
+            return LLMResponse(text=answer_for_blocks([extract_label(a) for a in answers]), raw=None)
+        self.misses += 1
+        msg = "replay: no recorded answer for a record in the prompt"
+        if self.on_miss == "raise":
+            raise KeyError(msg)
+        warnings.warn(msg + "; answering '' (further misses are only counted)", RuntimeWarning)
+        return LLMResponse(text="", raw=None)
+
+class SyntheticAPIError(Exception):
+    """Stand-in for a provider HTTP error (carries `status_code` like the Groq SDK errors)."""
+
+    def __init__(self, status_code: int, message: str = ""):
+        super().__init__(message or f"synthetic HTTP {status_code}")
+        self.status_code = status_code
+        self.response = None
+
+class SyntheticClient(LLMClient):
+    """Load-testing provider: fake latency, errors and 429 bursts, deterministic labels.
+
+    Options:
+      latency_ms       median latency (lognormal), default 300
+      latency_sigma    lognormal sigma, default 0.5 (0 = fixed latency)
+      error_rate       probability of an HTTP 500, default 0.0
+      burst_rate       probability that a call starts a 429 burst, default 0.0
+      burst_seconds    burst length; every call during a burst gets 429, default 5.0
+      attacker_rate    share of records answered "attacker", default 0.5
+      flip_rate        probability that a label is flipped when temperature > 0 (sampling noise), default 0.0
+      seed             RNG seed, default 0
+
+    Labels depend only on the log text (hash), so repeated runs answer identically
+    unless flip_rate is set.
+    """
+
+    provider = "synthetic"
+
+    def __init__(self, model: str, temperature: float = 0.0, max_tokens: int = 16,
+                 latency_ms: float = 300.0, latency_sigma: float = 0.5, error_rate: float = 0.0,
+                 burst_rate: float = 0.0, burst_seconds: float = 5.0, attacker_rate: float = 0.5, flip_rate: float = 0.0,
+                 seed: int = 0):
+        self.model = model
+        self.temperature = float(temperature)
+        self.max_tokens = int(max_tokens)
+        self.latency_ms = float(latency_ms)
+        self.latency_sigma = float(latency_sigma)
+        self.error_rate = float(error_rate)
+        self.burst_rate = float(burst_rate)
+        self.burst_seconds = float(burst_seconds)
+        self.attacker_rate = float(attacker_rate)
+        self.flip_rate = float(flip_rate) if self.temperature > 0 else 0.0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.burst_until = 0.0
+        self.calls = 0
+
+    def _label(self, block: str) -> str:
+        h = int.from_bytes(hashlib.blake2b(block.encode("utf-8"), digest_size=8).digest(), "big")
+        return "attacker" if h / 2.0 ** 64 < self.attacker_rate else "genuine"
+
+    def generate(self, prompt: str) -> LLMResponse:
+        with self.lock:
+            self.calls += 1
+            now = time.monotonic()
+            if now >= self.burst_until and self.rng.random() < self.burst_rate:
+                self.burst_until = now + self.burst_seconds
+            in_burst = now < self.burst_until
+            fail = self.rng.random() < self.error_rate
+            latency = self.latency_ms / 1000.0
+            if self.latency_sigma > 0:
+                latency *= math.exp(self.rng.gauss(0.0, self.latency_sigma))
+            flip = self.flip_rate > 0 and self.rng.random() < self.flip_rate
+        if in_burst:
+            raise SyntheticAPIError(429, "synthetic rate limit")
+        time.sleep(latency)
+        if fail:
+            raise SyntheticAPIError(500, "synthetic server error")
+        blocks = target_log_blocks(prompt) or [prompt]
+        labels = [self._label(b) for b in blocks]
+        if flip:
+            labels = ["genuine" if x == "attacker" else "attacker" for x in labels]
+        text = answer_for_blocks(labels)
+        usage = {"prompt_tokens": estimate_tokens(self.system_prompt) + estimate_tokens(prompt),
+                 "completion_tokens": estimate_tokens(text)}
+        return LLMResponse(text=text, raw=None, usage=usage)
+
+PROVIDERS = ["groq", "replay", "synthetic"]
+
+# -- instrumentation -------------------------------------------------------------
+
+@dataclass
+class CallRecord:
+    """One attempt of one request (retries are separate records with attempt > 0)."""
+    ts: float                 # wall-clock send time (epoch seconds)
+    provider: str
+    model: str
+    attempt: int
+    queue_wait_s: float       # blocked on the RPM/TPM limiter before sending
+    backoff_s: float          # retry sleep that preceded this attempt
+    latency_s: float          # client.generate wall time
+    status: str               # "ok", "cached", an HTTP status ("429") or the exception type
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+def call_status(exc: BaseException) -> str:
+    code = status_code_of(exc)
+    return str(code) if code is not None else type(exc).__name__
+
+def percentiles(values: List[float], qs: Tuple[float, ...] = (50, 95, 99)) -> Dict[str, Optional[float]]:
+    """Nearest-rank percentiles, e.g. {"p50": ..., "p95": ..., "p99": ...}."""
+    v = sorted(values)
+    return {f"p{q:g}": (v[min(len(v) - 1, max(0, math.ceil(q / 100 * len(v)) - 1))] if v else None) for q in qs}
+
+class CallSink:
+    """Receives every CallRecord; `Instrumentation` serializes calls, so sinks need no locking."""
+
+    def emit(self, rec: CallRecord) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+class JsonlTraceSink(CallSink):
+    """One JSON line per attempt."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = path.open("a", encoding="utf-8")
+
+    def emit(self, rec: CallRecord) -> None:
+        self.f.write(json.dumps(rec.__dict__) + "\n")
+
+    def close(self) -> None:
+        self.f.close()
 
-def build_client(provider: str, model: str, temperature: float = 0.0, max_tokens: int = 16) -> LLMClient:
+class PercentileSummarySink(CallSink):
+    """Every `every_seconds`, reports latency and queue-wait p50/p95/p99 over the calls since the last report."""
+
+    def __init__(self, every_seconds: float = 30.0, printer: Callable[[str], None] = print):
+        self.every = float(every_seconds)
+        self.printer = printer
+        self.last = time.monotonic()
+        self.latency: List[float] = []
+        self.wait: List[float] = []
+        self.status: Dict[str, int] = {}
+
+    def emit(self, rec: CallRecord) -> None:
+        self.latency.append(rec.latency_s)
+        self.wait.append(rec.queue_wait_s)
+        self.status[rec.status] = self.status.get(rec.status, 0) + 1
+        if time.monotonic() - self.last >= self.every:
+            self.report()
+
+    def report(self) -> None:
+        if self.latency:
+            fmt = lambda d: " ".join(f"{k}={v * 1000:.0f}ms" for k, v in d.items())
+            rate = len(self.latency) / max(1e-9, time.monotonic() - self.last)
+            self.printer(f"[calls] n={len(self.latency)} ({rate:.1f}/s) latency {fmt(percentiles(self.latency))} | "
+                         f"queue {fmt(percentiles(self.wait))} | status {json.dumps(self.status, sort_keys=True)}")
+        self.last = time.monotonic()
+        self.latency, self.wait, self.status = [], [], {}
+
+    def close(self) -> None:
+        self.report()
+
+class PrometheusSink(CallSink):
+    """Prometheus text exposition (node_exporter textfile style), rewritten atomically every `every_seconds`.
+
+    Counters by provider/model/status, token counters, and latency / queue-wait summaries
+    whose quantiles cover the last `window` calls.
+    """
+
+    def __init__(self, path: Path, every_seconds: float = 15.0, window: int = 10_000):
+        self.path = path
+        self.every = float(every_seconds)
+        self.window = window
+        self.last = 0.0
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        self.tokens: Dict[Tuple[str, str, str], int] = {}
+        self.retries = 0
+        self.sums = {"latency": 0.0, "queue_wait": 0.0}
+        self.recent: Dict[str, List[float]] = {"latency": [], "queue_wait": []}
+        self.count = 0
+
+    def emit(self, rec: CallRecord) -> None:
+        key = (rec.provider, rec.model, rec.status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        for kind, n in (("prompt", rec.prompt_tokens), ("completion", rec.completion_tokens)):
+            if n:
+                k = (rec.provider, rec.model, kind)
+                self.tokens[k] = self.tokens.get(k, 0) + n
+        self.retries += int(rec.attempt > 0)
+        self.count += 1
+        for name, v in (("latency", rec.latency_s), ("queue_wait", rec.queue_wait_s)):
+            self.sums[name] += v
+            self.recent[name].append(v)
+            if len(self.recent[name]) > 2 * self.window:
+                self.recent[name] = self.recent[name][-self.window:]
+        if time.monotonic() - self.last >= self.every:
+            self.write()
+
+    def write(self) -> None:
+        lines = ["# TYPE llm_requests_total counter"]
+        lines += [f'llm_requests_total{{provider="{p}",model="{m}",status="{s}"}} {n}'
+                  for (p, m, s), n in sorted(self.requests.items())]
+        lines.append("# TYPE llm_tokens_total counter")
+        lines += [f'llm_tokens_total{{provider="{p}",model="{m}",kind="{k}"}} {n}'
+                  for (p, m, k), n in sorted(self.tokens.items())]
+        lines += ["# TYPE llm_retries_total counter", f"llm_retries_total {self.retries}"]
+        for name in ("latency", "queue_wait"):
+            metric = f"llm_request_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for q, v in percentiles(self.recent[name][-self.window:]).items():
+                if v is not None:
+                    lines.append(f'{metric}{{quantile="{int(q[1:]) / 100:g}"}} {v:.6f}')
+            lines += [f"{metric}_sum {self.sums[name]:.6f}", f"{metric}_count {self.count}"]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(tmp, self.path)
+        self.last = time.monotonic()
+
+    def close(self) -> None:
+        self.write()
+
+class Instrumentation:
+    """Collects CallRecords from `generate_with_retries`, fans them out to sinks, and keeps run totals."""
+
+    def __init__(self, sinks: Optional[List[CallSink]] = None):
+        self.sinks = list(sinks or [])
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.attempts = 0
+        self.retries = 0
+        self.status: Dict[str, int] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency: List[float] = []
+        self.queue_wait = 0.0
+        self.backoff = 0.0
+
+    def record(self, rec: CallRecord) -> None:
+        with self.lock:
+            self.attempts += 1
+            self.retries += int(rec.attempt > 0)
+            self.status[rec.status] = self.status.get(rec.status, 0) + 1
+            self.prompt_tokens += rec.prompt_tokens or 0
+            self.completion_tokens += rec.completion_tokens or 0
+            self.latency.append(rec.latency_s)
+            self.queue_wait += rec.queue_wait_s
+            self.backoff += rec.backoff_s
+            for sink in self.sinks:
+                sink.emit(rec)
+
+    def close(self) -> None:
+        with self.lock:
+            for sink in self.sinks:
+                sink.close()
+
+    def summary(self, n_records: int, price_prompt: Optional[float] = None,
+                price_completion: Optional[float] = None) -> Dict[str, Any]:
+        """Run totals; prices are USD per million prompt / completion tokens."""
+        wall = max(1e-9, time.monotonic() - self.started)
+        tokens = self.prompt_tokens + self.completion_tokens
+        ok = self.status.get("ok", 0) + self.status.get("cached", 0)
+        out: Dict[str, Any] = {
+            "records": n_records,
+            "wall_seconds": round(wall, 3),
+            "records_per_second": n_records / wall,
+            "requests": ok,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "status": dict(sorted(self.status.items())),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tokens_per_second": tokens / wall,
+            "latency_seconds": percentiles(self.latency),
+            "queue_wait_seconds_total": round(self.queue_wait, 3),
+            "backoff_seconds_total": round(self.backoff, 3),
+        }
+        if price_prompt is not None or price_completion is not None:
+            cost = (self.prompt_tokens * (price_prompt or 0.0) + self.completion_tokens * (price_completion or 0.0)) / 1e6
+            out["cost_usd"] = cost
+            out["cost_per_record_usd"] = cost / n_records if n_records else None
+        return out
+
+def build_client(provider: str, model: str, temperature: float = 0.0, max_tokens: int = 16,
+                 options: Optional[Dict[str, Any]] = None) -> LLMClient:
+    """`options` are provider-specific keyword arguments (e.g. replay `source`, synthetic latency)."""
     provider = provider.lower().strip()
+    options = options or {}
     if provider == "groq":
         return GroqClient(model=model, temperature=temperature, max_tokens=max_tokens)
-    raise ValueError(f"Unsupported provider: {provider}. Supported: groq")
+    if provider == "replay":
+        return ReplayClient(model=model, temperature=temperature, max_tokens=max_tokens, **options)
+    if provider == "synthetic":
+        return SyntheticClient(model=model, temperature=temperature, max_tokens=max_tokens, **options)
+    raise ValueError(f"Unsupported provider: {provider}. Supported: {', '.join(PROVIDERS)}")
+
+# -- config files ----------------------------------------------------------------
+
+def load_spec(path: Path) -> Dict[str, Any]:
+    """Config, cascade or grid spec JSON. `extends` names a base config (e.g. configs/config_groq_llama31_8b.json)
+    whose keys act as defaults; relative paths are tried as given, then next to the spec."""
+    spec = json.loads(path.read_text(encoding="utf-8"))
+    base = spec.pop("extends", None)
+    if base:
+        p = Path(base)
+        if not p.is_file():
+            p = path.parent / base
+        spec = {**load_spec(p), **spec}
+    return spec
+
+def model_entries(spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """"models": model names (base provider) and/or {"provider", "model", "temperature", "max_tokens", ...}."""
+    out = []
+    for m in spec.get("models") or [spec["model"]]:
+        m = {"model": m} if isinstance(m, str) else dict(m)
+        m.setdefault("provider", spec.get("provider", "groq"))
+        m.setdefault("temperature", spec.get("temperature", 0.0))
+        m.setdefault("max_tokens", spec.get("max_tokens", 16))
+        m.setdefault("provider_options", spec.get("provider_options"))
+        if m["provider"] not in PROVIDERS:
+            raise ValueError(f"Unknown provider '{m['provider']}'. Available: {list(PROVIDERS)}")
+        out.append(m)
+    return out
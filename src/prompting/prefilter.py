@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import json
+import sys
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Field parsing and sender histories live with the preprocessing stage.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "data_preprocessing"))
+from utils_data import TEXT_FIELDS, fields_from_text
+from trajectory_features import TRAJECTORY_FIELDS, pair_order, trajectory_features
+
+# Deliberately loose: a rule should only fire when no genuine vehicle could produce the message.
+DEFAULT_THRESHOLDS: Dict[str, float] = {
+    "max_abs_coord": 50_000.0,      # m; the dataset's out-of-map sentinel is 99999.0
+    "max_speed": 90.0,              # m/s reported by the sender (~324 km/h)
+    "max_implied_speed": 200.0,     # m/s between consecutive messages of one sender
+    "min_jump_dt": 0.05,            # s; ignore implied speeds over shorter gaps (position noise)
+    "still_min_speed": 2.0,         # m/s reported while the position does not change ...
+    "still_min_streak": 3,          # ... for at least this many consecutive messages
+}
+
+@dataclass(frozen=True)
+class Rule:
+    """A vectorized plausibility check; rows where `check` is True are labelled attacker."""
+    name: str
+    check: Callable[[pd.DataFrame, Dict[str, float]], np.ndarray]
+    attacks: Optional[FrozenSet[str]] = None  # attack keys the rule applies to (None = all)
+
+def _out_of_map(f: pd.DataFrame, th: Dict[str, float]) -> np.ndarray:
+    return ((f["hv_pos_x"].abs() > th["max_abs_coord"]) | (f["hv_pos_y"].abs() > th["max_abs_coord"])).to_numpy()
+
+def _impossible_speed(f: pd.DataFrame, th: Dict[str, float]) -> np.ndarray:
+    return ((f["hv_speed"] > th["max_speed"]) | (f["hv_speed"] < 0)).to_numpy()
+
+def _position_jump(f: pd.DataFrame, th: Dict[str, float]) -> np.ndarray:
+    return ((f["traj_dt"] >= th["min_jump_dt"]) & (f["traj_implied_speed"] > th["max_implied_speed"])).to_numpy()
+
+def _still_streak(f: pd.DataFrame, th: Dict[str, float]) -> np.ndarray:
+    return ((f["still_streak"] >= th["still_min_streak"]) & (f["hv_speed"] > th["still_min_speed"])).to_numpy()
+
+RULES: List[Rule] = [
+    Rule("out_of_map", _out_of_map),
+    Rule("impossible_speed", _impossible_speed),
+    Rule("position_jump", _position_jump, frozenset({"RandomPosition", "TargetedConstantPosition", "SuddenAppearance"})),
+    Rule("still_streak", _still_streak, frozenset({"TargetedConstantPosition"})),
+]
+
+def still_streak(f: pd.DataFrame) -> np.ndarray:
+    """Consecutive messages (per rv_id, hv_id, in time order) ending at each row with zero position change."""
+    order, seq = pair_order(f)
+    n = len(f)
+    still = (f["traj_pos_jump"].to_numpy() == 0)[order]
+    reset = ~still | (seq == 0)
+    pos = np.arange(n)
+    last_reset = np.maximum.accumulate(np.where(reset, pos, 0))
+    out = np.empty(n, dtype=np.int64)
+    out[order] = np.where(still, pos - last_reset, 0)
+    return out
+
+def record_features(items: Sequence[Dict[str, Any]]) -> pd.DataFrame:
+    """Numeric fields per record, parsed from `text` (or taken from stored columns without text).
+
+    traj_* fields written by csv_to_jsonl are used when present; otherwise they are computed
+    over the records at hand, so histories only span the messages being classified.
+    """
+    names = [name for name, _ in TEXT_FIELDS]
+    if any(x.get("text") for x in items):
+        f = fields_from_text([x.get("text") for x in items])
+    else:
+        f = pd.DataFrame.from_records([{k: x.get(k) for k in names} for x in items]).apply(pd.to_numeric, errors="coerce")
+    if any(x.get("traj_seq") is not None for x in items):
+        traj = pd.DataFrame.from_records([{k: x.get(k) for k in TRAJECTORY_FIELDS} for x in items])
+        f = f.join(traj.apply(pd.to_numeric, errors="coerce"))
+    else:
+        f = f.join(trajectory_features(f))
+    f["still_streak"] = still_streak(f)
+    return f
+
+class PreFilter:
+    """Labels physically implausible records as attacker before any LLM call.
+
+    `options` may override DEFAULT_THRESHOLDS and select rules with {"rules": [...]}.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None, rules: Sequence[Rule] = RULES):
+        options = dict(options or {})
+        enabled = options.pop("rules", None)
+        unknown = set(options) - set(DEFAULT_THRESHOLDS)
+        if unknown:
+            raise ValueError(f"Unknown pre-filter options: {sorted(unknown)}. Available: {sorted(DEFAULT_THRESHOLDS)}")
+        self.thresholds = {**DEFAULT_THRESHOLDS, **options}
+        self.rules = [r for r in rules if enabled is None or r.name in enabled]
+        self.counts: Counter = Counter()
+
+    def classify(self, items: Sequence[Dict[str, Any]], attack_keys: Sequence[str]) -> List[Optional[str]]:
+        """Name of the first rule that fires for each record, or None (send to the model)."""
+        if not items:
+            return []
+        f = record_features(items)
+        keys = np.asarray(attack_keys, dtype=object)
+        hit = np.full(len(items), None, dtype=object)
+        for rule in self.rules:
+            mask = rule.check(f, self.thresholds) & pd.isna(hit)
+            if rule.attacks is not None:
+                mask &= np.isin(keys, list(rule.attacks))
+            hit[mask] = rule.name
+            self.counts[rule.name] += int(mask.sum())
+        return hit.tolist()
+
+def load_options(value: Optional[str]) -> Optional[Dict[str, Any]]:
+    """--prefilter_options accepts inline JSON or a path to a JSON file."""
+    if not value:
+        return None
+    p = Path(value)
+    return json.loads(p.read_text(encoding="utf-8") if p.is_file() else value)
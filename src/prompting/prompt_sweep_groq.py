@@ -2,105 +2,95 @@ from __future__ import annotations
 
 import argparse
 import json
+import sys
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import Any, Callable, Dict, List, Sequence, Tuple
 
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from tqdm import tqdm
 
-from model_clients import build_client, extract_label
+from model_clients import PROVIDERS, build_client, extract_label, generate_batch, BATCH_TOKENS_PER_RECORD
 from prompt_templates import PROMPTS
+from template_registry import CompiledTemplate, compile_template
+from response_cache import CachedClient, ResponseCache
 
-def row_to_text(row: pd.Series) -> str:
-    # Keep consistent with the report style; adjust column names if your CSV differs.
-    return (
-        f"Receiver vehicle {row['rv_id']} received a message from vehicle {row['hv_id']} "
-        f"at time {row['msg_rcv_time']:.3f} s.\n"
-        f"Sender (hv) position: ({row['hv_pos_x']:.1f}, {row['hv_pos_y']:.1f}), "
-        f"speed: {row['hv_speed']:.1f} m/s, heading: {row['hv_heading']:.1f} deg.\n"
-        f"Receiver (rv) position: ({row['rv_pos_x']:.1f}, {row['rv_pos_y']:.1f}), "
-        f"speed: {row['rv_speed']:.1f} m/s, heading: {row['rv_heading']:.1f} deg.\n"
-        f"Target id: {row['target_id']}, EEBL warning: {row['eebl_warn']}, IMA warning: {row['ima_warn']}."
-    )
+# Share the CSV -> text rendering with the preprocessing stage.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "data_preprocessing"))
+from utils_data import csv_dtypes, render_text_column
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "evaluation"))
+from metrics_core import evaluate, with_legacy_keys
 
-def load_dev_test(csv_path: Path, attack_pos: str, attack_neg: str = "Genuine", seed: int = 42) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    df = pd.read_csv(csv_path)
+def load_log_csv(csv_path: Path) -> pd.DataFrame:
+    """The log CSV as attack_type + rendered text, read once and shared by every attack's split."""
+    df = pd.read_csv(csv_path, dtype=csv_dtypes())
 
     if "attack_type" not in df.columns:
         raise KeyError("CSV must contain an 'attack_type' column.")
 
+    df["text"] = render_text_column(df)
+    return df[["text", "attack_type"]]
+
+def split_dev_test(logs: pd.DataFrame, attack_pos: str, attack_neg: str = "Genuine",
+                   seed: int = 42) -> Tuple[pd.DataFrame, pd.DataFrame]:
     # Keep only the two classes for binary testing
-    df = df[df["attack_type"].isin([attack_neg, attack_pos])].copy()
+    df = logs[logs["attack_type"].isin([attack_neg, attack_pos])].copy()
 
     # Map to binary label
     df["label"] = df["attack_type"].map({
         attack_neg: "genuine",
         attack_pos: "attacker"
     })
-
-    df["text"] = df.apply(row_to_text, axis=1)
     df = df[["text", "label", "attack_type"]]
 
     dev_df, test_df = train_test_split(df, test_size=0.2, random_state=seed, stratify=df["label"])
     return dev_df.reset_index(drop=True), test_df.reset_index(drop=True)
 
-def eval_template(client, template: str, df: pd.DataFrame, max_rows: int) -> Dict[str, float]:
+def load_dev_test(csv_path: Path, attack_pos: str, attack_neg: str = "Genuine", seed: int = 42) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return split_dev_test(load_log_csv(csv_path), attack_pos, attack_neg, seed)
+
+def classify_chunk(generate: Callable[[str], Any], compiled: CompiledTemplate, chunk: List[str]) -> List[str]:
+    """Labels for one request's worth of texts (a single prompt, or one batch prompt)."""
+    singles = [compiled.render(t) for t in chunk]
+    if len(chunk) == 1:
+        return [extract_label(generate(singles[0]).text)]
+    results, _ok = generate_batch(generate, compiled.render_batch(chunk), singles)
+    return [pred for pred, _raw in results]
+
+def classify_texts(client, template: str, texts: List[str], batch_size: int = 1) -> List[str]:
+    """Predicted labels for `texts`, K per request when batch_size > 1."""
+    compiled = compile_template(template)
+    preds = []
+    for start in tqdm(range(0, len(texts), batch_size), leave=False):
+        preds.extend(classify_chunk(client.generate, compiled, texts[start:start + batch_size]))
+    return preds
+
+def score_preds(labels: Sequence[str], preds: Sequence[str], n_boot: int = 0) -> Dict[str, Any]:
+    # per-class accuracies are over answered rows only, as this sweep has always reported them
+    return with_legacy_keys(evaluate(labels, preds, n_boot=n_boot, answered_only=True))
+
+def eval_template(client, template: str, df: pd.DataFrame, max_rows: int, batch_size: int = 1,
+                  n_boot: int = 0) -> Dict[str, Any]:
     n = min(len(df), max_rows)
     sub = df.iloc[:n]
-
-    total = 0
-    correct = 0
-    unknown = 0
-    n_att = 0
-    n_gen = 0
-    c_att = 0
-    c_gen = 0
-
-    for _, row in tqdm(sub.iterrows(), total=len(sub), leave=False):
-        prompt = template.format(LOG_TEXT=row["text"], FEW_SHOT_EXAMPLES="")
-        resp = client.generate(prompt)
-        pred = extract_label(resp.text)
-
-        gold = row["label"]
-        total += 1
-
-        if pred not in ["attacker", "genuine"]:
-            unknown += 1
-            continue
-
-        if pred == gold:
-            correct += 1
-            if gold == "attacker":
-                c_att += 1
-            else:
-                c_gen += 1
-
-        if gold == "attacker":
-            n_att += 1
-        else:
-            n_gen += 1
-
-    def safe_div(a, b): return a / b if b else 0.0
-
-    return {
-        "overall_accuracy": safe_div(correct, total),
-        "unknown_rate": safe_div(unknown, total),
-        "attacker_accuracy": safe_div(c_att, n_att),
-        "genuine_accuracy": safe_div(c_gen, n_gen),
-        "n": total
-    }
+    preds = classify_texts(client, template, sub["text"].tolist(), batch_size=batch_size)
+    return score_preds(sub["label"], preds, n_boot=n_boot)
 
 def parse_args():
     ap = argparse.ArgumentParser(description="Prompt sweep (dev select best prompt, then test) using Groq models.")
     ap.add_argument("--csv_path", required=True)
     ap.add_argument("--attack", required=True, help="Attack key (must exist in PROMPTS), e.g., RandomPosition")
-    ap.add_argument("--provider", default="groq", choices=["groq"])
+    ap.add_argument("--provider", default="groq", choices=PROVIDERS)
+    ap.add_argument("--provider_options", type=json.loads, default=None, help="JSON provider options (replay/synthetic).")
     ap.add_argument("--model", required=True)
     ap.add_argument("--mode", default="zero_shot", choices=["zero_shot", "few_shot"])
     ap.add_argument("--dev_max", type=int, default=200)
     ap.add_argument("--test_max", type=int, default=500)
     ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--batch_size", type=int, default=1, help="Records per request (shared preamble).")
+    ap.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap resamples for confidence intervals (0 = off).")
+    ap.add_argument("--cache", default=None, help="Optional SQLite response cache path (re-runs skip the network).")
+    ap.add_argument("--cache_max_entries", type=int, default=1_000_000)
     return ap.parse_args()
 
 def main():
@@ -113,7 +103,13 @@ def main():
     dev_df, test_df = load_dev_test(csv_path, attack_pos=args.attack, seed=args.seed)
     print(f"Dev size: {len(dev_df)}  Test size: {len(test_df)}")
 
-    client = build_client(args.provider, args.model, temperature=0.0, max_tokens=16)
+    max_tokens = max(16, BATCH_TOKENS_PER_RECORD * args.batch_size) if args.batch_size > 1 else 16
+    client = build_client(args.provider, args.model, temperature=0.0, max_tokens=max_tokens,
+                          options=args.provider_options)
+    cache = None
+    if args.cache:
+        cache = ResponseCache(Path(args.cache), max_entries=args.cache_max_entries)
+        client = CachedClient(client, cache)
 
     # For compatibility with your old script, we evaluate a small set of prompt variants.
     # Here: we just evaluate the project templates (mode-specific) for the chosen attack.
@@ -121,7 +117,8 @@ def main():
 
     dev_results = []
     for i, tmpl in enumerate(templates):
-        m = eval_template(client, tmpl, dev_df, max_rows=args.dev_max)
+        m = eval_template(client, tmpl, dev_df, max_rows=args.dev_max, batch_size=args.batch_size,
+                          n_boot=args.bootstrap)
         print(f"\n--- Template {i} on DEV ({args.mode}) ---")
         print(json.dumps(m, indent=2))
         dev_results.append((i, m["overall_accuracy"], m))
@@ -133,10 +130,14 @@ def main():
     test_n = min(len(test_df), args.test_max)
     test_sample = test_df.sample(n=test_n, random_state=args.seed) if test_n < len(test_df) else test_df
 
-    mtest = eval_template(client, best_tmpl, test_sample, max_rows=test_n)
+    mtest = eval_template(client, best_tmpl, test_sample, max_rows=test_n, batch_size=args.batch_size,
+                          n_boot=args.bootstrap)
     print("\n--- Best template on TEST ---")
     print(json.dumps(mtest, indent=2))
     print(f"(Evaluated on {test_n} test rows)")
+    if cache is not None:
+        print(f"Cache: {json.dumps(cache.stats())}")
+        cache.close()
 
 if __name__ == "__main__":
     main()
@@ -9,6 +9,18 @@
 #   few_block = "...your few-shot examples text..."
 #   tmpl = PROMPTS["RandomPosition"]["few_shot"]
 #   prompt = tmpl.format(FEW_SHOT_EXAMPLES=few_block, LOG_TEXT=log_text)
+#
+# Usage (batched, K records under one shared preamble):
+#   compiled = compile_template(tmpl, few_block)   # from template_registry
+#   prompt = compiled.render_batch([log_text_1, ..., log_text_K])
+#   replies = parse_batch_replies(reply_text, K)   # from model_clients: [(label, line)] or None
+
+SINGLE_ANSWER = "Return exactly one word: attack or genuine."
+BATCH_ANSWER = (
+    "You were given {K} log records, numbered [1] to [{K}]. Classify each one independently.\n"
+    "Return exactly {K} lines, one per record, in the form \"<number>: attack\" or \"<number>: genuine\", "
+    "and nothing else."
+)
 
 PROMPTS = {
     # 1) DoS
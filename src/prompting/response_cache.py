@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from model_clients import LLMClient, LLMResponse
+
+def cache_key(provider: str, model: str, temperature: float, max_tokens: int, system_prompt: str, prompt: str,
+              variant: str = "") -> str:
+    """Content address of one request: sha256 over every input that affects the completion.
+
+    A non-empty `variant` (e.g. the sample number of a self-consistency vote) keeps
+    repeated samples of the same prompt apart.
+    """
+    fields = [provider, model, float(temperature), int(max_tokens), system_prompt, prompt]
+    payload = json.dumps(fields + [variant] if variant else fields, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """On-disk SQLite store of completions with LRU eviction beyond `max_entries`."""
+
+    def __init__(self, path: Path, max_entries: Optional[int] = 1_000_000):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, text TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self.conn.commit()
+        self.n_entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, text, last_access) VALUES (?, ?, ?)",
+                (key, text, time.time()),
+            )
+            # INSERT OR REPLACE reports 1 row either way; recount only when near the bound.
+            self.n_entries += cur.rowcount
+            if self.max_entries is not None and self.n_entries > self.max_entries:
+                self.n_entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                excess = self.n_entries - self.max_entries
+                if excess > 0:
+                    self.conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                        (excess,),
+                    )
+                    self.n_entries -= excess
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self.n_entries,
+        }
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+class CachedClient(LLMClient):
+    """Wraps any LLMClient; identical requests are answered from the cache without a network call."""
+
+    def __init__(self, inner: LLMClient, cache: ResponseCache, variant: str = ""):
+        self.inner = inner
+        self.cache = cache
+        self.variant = variant
+        self.provider = inner.provider
+        self.model = inner.model
+        self.temperature = inner.temperature
+        self.max_tokens = inner.max_tokens
+        self.system_prompt = inner.system_prompt
+
+    def key_for(self, prompt: str) -> str:
+        return cache_key(self.provider, self.model, self.temperature, self.max_tokens, self.system_prompt, prompt,
+                         self.variant)
+
+    def lookup(self, prompt: str) -> Optional[LLMResponse]:
+        """The cached answer, or None; never calls the wrapped client."""
+        text = self.cache.get(self.key_for(prompt))
+        return None if text is None else LLMResponse(text=text, raw=None, cached=True)
+
+    def fill(self, prompt: str) -> LLMResponse:
+        """Ask the wrapped client and store its answer (after a `lookup` miss)."""
+        resp = self.inner.generate(prompt)
+        self.cache.put(self.key_for(prompt), resp.text)
+        return resp
+
+    def generate(self, prompt: str) -> LLMResponse:
+        return self.lookup(prompt) or self.fill(prompt)
@@ -1,45 +1,224 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Set, TextIO, Tuple
 
+import pandas as pd
 from tqdm import tqdm
 
-from prompt_templates import PROMPTS
-from model_clients import build_client, extract_label
-
-def read_jsonl(path: Path) -> List[Dict[str, Any]]:
-    items = []
-    with path.open("r", encoding="utf-8") as r:
-        for line in r:
-            line = line.strip()
-            if not line:
-                continue
-            items.append(json.loads(line))
-    return items
-
-def write_jsonl(items: List[Dict[str, Any]], path: Path) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as w:
-        for obj in items:
-            w.write(json.dumps(obj, ensure_ascii=False) + "\n")
+from template_registry import TemplateRegistry, plan_budget
+from response_cache import CachedClient, ResponseCache
+from model_clients import (PROVIDERS, build_client, extract_label, generate_batch, is_valid_reply, load_spec,
+                           model_entries, BATCH_TOKENS_PER_RECORD,
+                           Instrumentation, JsonlTraceSink, PercentileSummarySink, PrometheusSink)
+from scheduler import RateLimiter, generate_with_retries, iter_ordered, iter_keyed_batches
+from prefilter import PreFilter, load_options, TRAJECTORY_FIELDS
+from example_retrieval import ExampleIndex, merge_neighbours
+from voting import Tally, run_votes
+
+# Shared JSONL / Parquet loader lives with the preprocessing stage.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "data_preprocessing"))
+from dataset_io import load_records, records_by_id
+from utils_data import strip_volatile_fields
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "evaluation"))
+from online_metrics import MetricAccumulator
+
+INPUT_COLUMNS = ["id", "attack_type", "label", "text", "msg_rcv_time", "source_file"]
+ESCALATE_ON = ["unknown", "invalid", "low_confidence", "low_margin"]
+TIER_KEYS = ["provider", "model", "temperature", "max_tokens", "provider_options", "votes"]
+
+def read_ids(spec: str) -> List[int]:
+    """Record ids from a file (one per line) or a comma-separated list."""
+    text = Path(spec).read_text(encoding="utf-8") if Path(spec).is_file() else spec
+    return [int(tok) for tok in text.replace(",", "\n").split()]
+
+def load_done_ids(path: Path) -> Set[Any]:
+    """Collect the ids already present in a partial predictions file.
+
+    A torn last line (crash mid-write) is truncated away so appending can continue cleanly.
+    """
+    done: Set[Any] = set()
+    if not path.exists():
+        return done
+    good_end = 0
+    with path.open("rb") as r:
+        for raw in r:
+            if not raw.endswith(b"\n"):
+                break
+            line = raw.strip()
+            if line:
+                try:
+                    done.add(json.loads(line).get("id"))
+                except json.JSONDecodeError:
+                    break
+            good_end += len(raw)
+    if good_end < path.stat().st_size:
+        with path.open("r+b") as f:
+            f.truncate(good_end)
+    return done
+
+class PredictionWriter:
+    """Appends one JSON line per prediction, flushing and fsyncing every `fsync_every` records."""
+
+    def __init__(self, path: Path, append: bool = False, fsync_every: int = 100):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.f: TextIO = path.open("a" if append else "w", encoding="utf-8")
+        self.fsync_every = max(1, int(fsync_every))
+        self.n = 0
+
+    def write(self, obj: Dict[str, Any]) -> None:
+        self.f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        self.n += 1
+        if self.n % self.fsync_every == 0:
+            self.sync()
+
+    def sync(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self) -> None:
+        self.sync()
+        self.f.close()
+
+def dedup_groups(keys: List[str]) -> Tuple[List[int], List[int], List[int]]:
+    """Collapse equal keys.
+
+    Returns (rep_of, reps, last_use): rep_of[i] is the first position with the same key as i,
+    reps lists those representatives in order, last_use[r] is the last position using rep r.
+    """
+    first: Dict[str, int] = {}
+    rep_of = []
+    for i, k in enumerate(keys):
+        rep_of.append(first.setdefault(k, i))
+    reps = sorted(first.values())
+    last_use = list(range(len(keys)))
+    for i, r in enumerate(rep_of):
+        last_use[r] = i
+    return rep_of, reps, last_use
+
+def model_tiers(args: argparse.Namespace) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Ordered models that may answer a record, and the rule for moving a record to the next one.
+
+    --cascade lists every tier; otherwise tier 1 is --model and tier 2 an optional --escalate_config.
+    """
+    if args.cascade:
+        if args.escalate_config:
+            raise ValueError("--cascade already lists the escalation models; drop --escalate_config.")
+        spec = load_spec(Path(args.cascade))
+        tiers = model_entries(spec)
+        rule = {"escalate_on": spec.get("escalate_on", ESCALATE_ON[:3]),
+                "min_confidence": spec.get("min_confidence", 0.75)}
+    else:
+        if not args.model:
+            raise ValueError("Provide --model (or a --cascade config).")
+        tiers = [{k: getattr(args, k) for k in TIER_KEYS}]
+        if args.escalate_config:
+            spec = load_spec(Path(args.escalate_config))
+            spec.setdefault("provider", args.provider)
+            tiers.append({**model_entries(spec)[0], "votes": spec.get("votes", 1)})
+        rule = {"escalate_on": ["unknown", "low_margin"], "min_confidence": 0.0}
+    bad = set(rule["escalate_on"]) - set(ESCALATE_ON)
+    if bad:
+        raise ValueError(f"Unknown escalate_on {sorted(bad)}. Available: {ESCALATE_ON}")
+    for m in tiers:
+        m["votes"] = int(m.get("votes", 1))
+    return tiers, rule
 
 def parse_args() -> argparse.Namespace:
     ap = argparse.ArgumentParser(description="Run zero-shot or few-shot prompting on a JSONL dataset.")
     ap.add_argument("--mode", choices=["zero_shot", "few_shot"], required=True)
-    ap.add_argument("--provider", choices=["groq"], default="groq")
-    ap.add_argument("--model", required=True, help="Model name for the provider (e.g., llama-3.1-8b-instant).")
-    ap.add_argument("--input_jsonl", required=True)
+    ap.add_argument("--provider", choices=PROVIDERS, default="groq")
+    ap.add_argument("--provider_options", type=json.loads, default=None,
+                    help='JSON provider options, e.g. \'{"source": "examples/example_output.jsonl"}\' for replay '
+                         'or \'{"latency_ms": 300, "burst_rate": 0.01}\' for synthetic.')
+    ap.add_argument("--model", default=None, help="Model name for the provider (e.g., llama-3.1-8b-instant).")
+    ap.add_argument("--input_jsonl", required=True, help="JSONL file or Parquet dataset directory.")
     ap.add_argument("--output_jsonl", required=True)
 
     ap.add_argument("--attack", default=None, help="Optional fixed attack key in PROMPTS (else use item['attack_type']).")
     ap.add_argument("--few_shot_examples", default=None, help="Path to text file of few-shot examples (inserted into template).")
 
     ap.add_argument("--max_rows", type=int, default=None)
+    ap.add_argument("--ids", default=None,
+                    help="Classify only these record ids: comma-separated, or a file with one id per line "
+                         "(JSONL input seeks them through the byte-offset index instead of scanning).")
     ap.add_argument("--temperature", type=float, default=0.0)
     ap.add_argument("--max_tokens", type=int, default=16)
+    ap.add_argument("--plan", action="store_true",
+                    help="Print the predicted requests/tokens (and minutes under --rpm/--tpm) and exit without calling the model.")
+
+    ap.add_argument("--concurrency", type=int, default=1, help="Number of requests in flight at once.")
+    ap.add_argument("--rpm", type=float, default=None, help="Optional requests-per-minute budget.")
+    ap.add_argument("--tpm", type=float, default=None, help="Optional tokens-per-minute budget (estimated from prompt length).")
+    ap.add_argument("--max_retries", type=int, default=5, help="Retries per request on 429/5xx/timeouts.")
+
+    ap.add_argument("--batch_size", type=int, default=1,
+                    help="Classify K records per request under one shared preamble (falls back to "
+                         "single-record calls when a batch reply cannot be parsed).")
+
+    ap.add_argument("--votes", type=int, default=1,
+                    help="Self-consistency: up to N sampled answers per request, majority label wins (stops as soon "
+                         "as the majority is settled); adds votes/confidence fields.")
+    ap.add_argument("--vote_temperature", type=float, default=0.7,
+                    help="Sampling temperature used instead of --temperature when more than one sample is drawn.")
+    ap.add_argument("--escalate_margin", type=float, default=0.5,
+                    help="Escalate records whose vote margin ((top - runner-up) / samples) is below this, or that tie.")
+    ap.add_argument("--escalate_votes", type=int, default=None,
+                    help="First escalation: draw more samples of the same model, up to this many in total.")
+    ap.add_argument("--escalate_config", default=None,
+                    help="Then escalate still-undecided records to a larger model (config JSON with provider/model, "
+                         "optional votes), e.g. configs/config_groq_llama33_70b.json.")
+    ap.add_argument("--cascade", default=None,
+                    help="Model cascade config with an ordered \"models\" list (e.g. configs/cascade_groq_llama.json) "
+                         "instead of --provider/--model: every record goes to the first model, records answered "
+                         "unknown, with low confidence or in the wrong format move on; adds tier/tier_model fields.")
+
+    ap.add_argument("--dedup", choices=["none", "exact", "ignore_time"], default="none",
+                    help="Send one request per group of identical prompts and copy the prediction to every member "
+                         "(ignore_time also treats records differing only in msg_rcv_time as identical).")
+
+    ap.add_argument("--resume", action="store_true",
+                    help="Append to an existing --output_jsonl and skip ids already in it.")
+    ap.add_argument("--fsync_every", type=int, default=100, help="Flush + fsync the output every N predictions.")
+
+    ap.add_argument("--cache", default=None, help="Optional SQLite response cache path (re-runs skip the network).")
+    ap.add_argument("--cache_max_entries", type=int, default=1_000_000)
+
+    ap.add_argument("--prefilter", action="store_true",
+                    help="Label physically implausible records (out-of-map position, impossible speed, position "
+                         "jumps, zero-movement streaks) as attacker without an LLM call; adds an 'engine' field.")
+    ap.add_argument("--prefilter_options", default=None,
+                    help='JSON (inline or file) overriding rule thresholds, e.g. \'{"max_speed": 70, "rules": ["out_of_map"]}\'.')
+
+    ap.add_argument("--retrieval_pool", default=None,
+                    help="Labelled split (e.g. data/splits/dev.jsonl) to draw per-record few-shot examples from "
+                         "(nearest neighbours on the numeric fields; --mode few_shot).")
+    ap.add_argument("--retrieval_k", type=int, default=4, help="Examples per prompt.")
+    ap.add_argument("--retrieval_max_per_class", type=int, default=2000,
+                    help="Pool records kept per (attack type, label) in the index (random sample).")
+    ap.add_argument("--retrieval_select", default="balanced", choices=["balanced", "nearest"],
+                    help="balanced = half attacker, half genuine examples; nearest = k nearest regardless of label.")
+
+    ap.add_argument("--trace_jsonl", default=None, help="Append one JSON line per request attempt (latency, tokens, status).")
+    ap.add_argument("--stats_every", type=float, default=0.0,
+                    help="Print latency / queue-wait p50/p95/p99 every N seconds (0 = off).")
+    ap.add_argument("--prometheus", default=None, help="Prometheus textfile to keep updated with request metrics.")
+    ap.add_argument("--run_summary", default=None, help="Write the run summary (throughput, tokens/s, cost) as JSON.")
+    ap.add_argument("--price_prompt", type=float, default=None, help="USD per 1M prompt tokens (for cost per record).")
+    ap.add_argument("--price_completion", type=float, default=None, help="USD per 1M completion tokens.")
+
+    ap.add_argument("--metrics_snapshot", default=None,
+                    help="Keep running metrics and write them to this JSON every --snapshot_every predictions "
+                         "(merge shard snapshots with src/evaluation/online_metrics.py).")
+    ap.add_argument("--snapshot_every", type=int, default=1000)
+    ap.add_argument("--bin_seconds", type=float, default=5.0, help="Time-bin width of the running time-slice counts.")
     return ap.parse_args()
 
 def main() -> None:
@@ -47,50 +226,322 @@ def main() -> None:
     inp = Path(args.input_jsonl)
     out = Path(args.output_jsonl)
 
-    items = read_jsonl(inp)
-    if args.max_rows is not None:
-        items = items[:args.max_rows]
+    columns = INPUT_COLUMNS + (TRAJECTORY_FIELDS if args.prefilter or args.retrieval_pool else [])
+    if args.ids:
+        wanted = read_ids(args.ids)
+        items = records_by_id(inp, wanted, columns=columns)[:args.max_rows]
+        print(f"Selected {len(items)} of {len(wanted)} requested ids")
+    else:
+        items = load_records(inp, columns=columns, limit=args.max_rows)
 
-    client = build_client(args.provider, args.model, temperature=args.temperature, max_tokens=args.max_tokens)
+    n_skipped = 0
+    if args.resume:
+        done = load_done_ids(out)
+        before = len(items)
+        items = [x for x in items if x.get("id") not in done]
+        n_skipped = before - len(items)
+        print(f"Resuming: {n_skipped} already done, {len(items)} remaining")
 
-    few_block = ""
-    if args.mode == "few_shot":
-        if args.few_shot_examples:
-            few_block = Path(args.few_shot_examples).read_text(encoding="utf-8")
-        else:
-            # safe default: empty block
-            few_block = ""
+    tiers, rule = model_tiers(args)
+    # from here on the first tier stands in for --provider/--model/--votes (and sets them under --cascade)
+    for key in TIER_KEYS:
+        setattr(args, key, tiers[0][key])
+    # only batched requests need room for K reply lines; single-record calls keep --max_tokens
+    # (it is part of the cache key, so batched and unbatched runs share their single-record answers)
+    batch_max_tokens = max(args.max_tokens, BATCH_TOKENS_PER_RECORD * args.batch_size)
+    voting = len(tiers) > 1 or args.votes > 1 or bool(args.escalate_votes)
+    cache = None
+    if args.cache:
+        cache = ResponseCache(Path(args.cache), max_entries=args.cache_max_entries)
 
-    out_items = []
-    for item in tqdm(items, desc=f"Prompting ({args.mode})"):
-        attack_key = args.attack or item.get("attack_type")
+    def cached(c, j: int = 0):
+        """Client for sample j; each sample number has its own cache entries, so re-runs replay every vote."""
+        return CachedClient(c, cache, variant=f"sample:{j}" if j else "") if cache is not None else c
+
+    # one client per tier and sample number; escalated records are sent one at a time
+    tier_samplers = []
+    for k, m in enumerate(tiers):
+        n = max(m["votes"], args.escalate_votes or 1) if k == 0 else m["votes"]
+        # identical samples at temperature 0 would make voting pointless
+        c = build_client(m["provider"], m["model"], max_tokens=m["max_tokens"],
+                         temperature=args.vote_temperature if n > 1 else m["temperature"], options=m["provider_options"])
+        tier_samplers.append([cached(c, j) for j in range(n)])
+    samplers = tier_samplers[0]
+    client = samplers[0]
+    # the first tier's batched requests go through clients with the larger completion budget
+    batch_samplers = samplers
+    if args.batch_size > 1:
+        m = tiers[0]
+        c = build_client(m["provider"], m["model"], max_tokens=batch_max_tokens,
+                         temperature=args.vote_temperature if len(samplers) > 1 else m["temperature"],
+                         options=m["provider_options"])
+        batch_samplers = [cached(c, j) for j in range(len(samplers))]
+    if len(tiers) > 1:
+        print("Tiers: " + " -> ".join(f"{m['provider']}/{m['model']} ({m['votes']} vote(s))" for m in tiers)
+              + f"; escalate on {', '.join(rule['escalate_on'])}")
+
+    # Each (attack, mode, few-shot file) is compiled once; without a few-shot file the block is empty.
+    registry = TemplateRegistry()
+    few_shot_path = args.few_shot_examples if args.mode == "few_shot" else None
+
+    # Validate attack keys up front so a bad key fails before any request is sent.
+    for attack_key in {args.attack or x.get("attack_type") for x in items}:
         if not attack_key:
             raise KeyError("No attack type found. Provide --attack or ensure JSONL has 'attack_type'.")
-        if attack_key not in PROMPTS:
-            raise KeyError(f"Attack key '{attack_key}' not found in PROMPTS. Available: {list(PROMPTS.keys())}")
-
-        tmpl = PROMPTS[attack_key][args.mode]
-        prompt = tmpl.format(FEW_SHOT_EXAMPLES=few_block, LOG_TEXT=item.get("text", ""))
-
-        resp = client.generate(prompt)
-        pred = extract_label(resp.text)
-
-        out_items.append({
-            "id": item.get("id"),
-            "attack_type": item.get("attack_type"),
-            "label": item.get("label"),
-            "pred": pred,
-            "mode": args.mode,
-            "provider": args.provider,
-            "model": args.model,
-            "raw_text": resp.text,
-            # keep optional fields if present
-            "msg_rcv_time": item.get("msg_rcv_time", None),
-            "source_file": item.get("source_file", None),
-        })
-
-    write_jsonl(out_items, out)
-    print(f"Wrote predictions: {out}  (n={len(out_items)})")
+        registry.get(attack_key, args.mode, few_shot_path)
+
+    def attack_key_of(item: Dict[str, Any]) -> str:
+        return args.attack or item["attack_type"]
+
+    index = neighbours = None
+    if args.retrieval_pool:
+        if args.mode != "few_shot":
+            raise ValueError("--retrieval_pool fills {FEW_SHOT_EXAMPLES}; use it with --mode few_shot.")
+        t0 = time.perf_counter()
+        index = ExampleIndex.from_path(Path(args.retrieval_pool), max_per_class=args.retrieval_max_per_class)
+        # one batched search for every record up front; prompts then only join example texts
+        neighbours = index.query(pd.DataFrame.from_records(items, columns=columns), [attack_key_of(x) for x in items],
+                                 k=args.retrieval_k, balanced=args.retrieval_select == "balanced")
+        print(f"Retrieval: {len(index)} pool records, k={args.retrieval_k} ({args.retrieval_select}), "
+              f"{time.perf_counter() - t0:.1f}s for {len(items)} records")
+
+    def template_of(idx: List[int]):
+        """Compiled template for a request; with retrieval, its examples are the records' neighbours."""
+        ct = registry.get(attack_key_of(items[idx[0]]), args.mode, few_shot_path)
+        if neighbours is None:
+            return ct
+        rows = neighbours[idx[0]] if len(idx) == 1 else merge_neighbours([neighbours[i] for i in idx], args.retrieval_k)
+        return ct.with_examples(index.example_block(rows))
+
+    def build_prompt(i: int) -> str:
+        return template_of([i]).render(items[i].get("text", ""))
+
+    limiter = RateLimiter(rpm=args.rpm, tpm=args.tpm) if (args.rpm or args.tpm) else None
+    sinks = []
+    if args.trace_jsonl:
+        sinks.append(JsonlTraceSink(Path(args.trace_jsonl)))
+    if args.stats_every:
+        sinks.append(PercentileSummarySink(args.stats_every, printer=tqdm.write))
+    if args.prometheus:
+        sinks.append(PrometheusSink(Path(args.prometheus)))
+    instrument = Instrumentation(sinks)
+
+    def gen(prompt: str, c=None):
+        return generate_with_retries(c or client, prompt, limiter=limiter, max_retries=args.max_retries,
+                                     instrument=instrument)
+
+    def ask(idx: List[int], j: int = 0, c=None):
+        """Answer j (of client `c`, else of the first tier): ((pred, raw_text) per position, batch_ok)."""
+        c = c or samplers[j]
+        if len(idx) == 1:
+            resp = gen(build_prompt(idx[0]), c)
+            return [(extract_label(resp.text), resp.text)], True
+        batch_prompt = template_of(idx).render_batch([items[i].get("text", "") for i in idx])
+        return generate_batch(lambda p: gen(p, batch_samplers[j]), batch_prompt, [build_prompt(i) for i in idx],
+                              single_call=lambda p: gen(p, c))
+
+    # vote samples run on their own pool; request threads only wait on them
+    vote_pool = (ThreadPoolExecutor(max_workers=max(1, args.concurrency) * max(map(len, tier_samplers)))
+                 if voting else None)
+
+    def needs_escalation(t: Tally) -> bool:
+        pred, raw = t.result()
+        on = rule["escalate_on"]
+        return (("unknown" in on and pred == "unknown")
+                or ("invalid" in on and not is_valid_reply(raw))
+                or ("low_confidence" in on and t.confidence() < rule["min_confidence"])
+                or ("low_margin" in on and t.margin() < args.escalate_margin))
+
+    def escalate(i: int, t: Tally):
+        """(answering tally, tier index, total samples, escalation stage) for record i."""
+        n, k, stage = t.n, 0, None
+        if args.escalate_votes and args.escalate_votes > t.n and needs_escalation(t):
+            n += run_votes(lambda j: ask([i], j)[0], [t], args.escalate_votes, vote_pool)
+            stage = "votes"
+        while k + 1 < len(tiers) and needs_escalation(t):
+            k += 1
+            t = Tally()
+            n += run_votes(lambda j, s=tier_samplers[k]: ask([i], j, s[j])[0], [t], tiers[k]["votes"], vote_pool)
+            stage = tiers[k]["model"]
+        return t, k, n, stage
+
+    def call(idx: List[int]):
+        """Returns ((pred, raw_text) per position, batch_ok); with voting a vote-info dict is appended."""
+        if not voting:
+            return ask(idx)
+        tallies = [Tally() for _ in idx]
+        oks: List[bool] = []
+
+        def sample(j: int):
+            preds, ok = ask(idx, j)
+            oks.append(ok)
+            return preds
+
+        run_votes(sample, tallies, args.votes, vote_pool)
+        out = []
+        for i, t in zip(idx, tallies):
+            t, k, n, stage = escalate(i, t)
+            info = {**t.info(), "samples": n, "escalated": stage}
+            if len(tiers) > 1:
+                info.update(tier=k + 1, tier_model=tiers[k]["model"])
+            out.append((*t.result(), info))
+        return out, all(oks)
+
+    rule_of: List[Optional[str]] = [None] * len(items)
+    prefilter = None
+    if args.prefilter:
+        prefilter = PreFilter(load_options(args.prefilter_options))
+        rule_of = prefilter.classify(items, [attack_key_of(x) for x in items])
+        n_rules = sum(r is not None for r in rule_of)
+        print(f"Pre-filter: {n_rules} of {len(items)} records labelled by rules "
+              f"({', '.join(f'{k}={v}' for k, v in prefilter.counts.items() if v) or 'none'})")
+
+    if args.dedup != "none":
+        norm = strip_volatile_fields if args.dedup == "ignore_time" else (lambda t: t)
+        # rule-labelled records keep a unique key so they never stand in for a model call
+        keys = [
+            f"rule:{i}" if rule_of[i] else
+            hashlib.sha1(f"{attack_key_of(x)}\0{norm(x.get('text', '') or '')}".encode("utf-8")).hexdigest()
+            for i, x in enumerate(items)
+        ]
+        rep_of, reps, last_use = dedup_groups(keys)
+        del keys
+        print(f"Dedup ({args.dedup}): {len(items)} records -> {len(reps)} unique prompts "
+              f"(collapse ratio {len(items) / max(1, len(reps)):.2f}x)")
+    else:
+        rep_of = last_use = list(range(len(items)))
+        reps = rep_of
+
+    # Batches share an attack key (and so a preamble); positions restore input order on write.
+    llm_reps = [r for r in reps if rule_of[r] is None] if prefilter is not None else reps
+    batches = list(iter_keyed_batches(llm_reps, args.batch_size, key=lambda i: attack_key_of(items[i])))
+    budget = plan_budget([(template_of(b), [items[i].get("text", "") or "" for i in b]) for b in batches],
+                         args.max_tokens, client.system_prompt, batch_max_tokens=batch_max_tokens)
+    print(f"Plan: {budget.describe(args.rpm, args.tpm)}")
+    if voting:
+        print(f"Voting: {Tally().needed(args.votes)}-{args.votes} samples per request (the plan counts one)"
+              + (f"; escalated records get up to {sum(map(len, tier_samplers)) - args.votes} more"
+                 if sum(map(len, tier_samplers)) > args.votes else ""))
+    if args.plan:
+        return
+    results = iter_ordered(call, batches, concurrency=args.concurrency)
+
+    acc = None
+    if args.metrics_snapshot:
+        acc = MetricAccumulator(bin_seconds=args.bin_seconds)
+        if args.resume and out.exists():
+            # seed from what is already on disk so the snapshot covers the whole output file
+            with out.open("r", encoding="utf-8") as r:
+                for line in r:
+                    if line.strip():
+                        acc.update_record(json.loads(line))
+
+    writer = PredictionWriter(out, append=args.resume, fsync_every=args.fsync_every)
+    done: Dict[int, Any] = {i: (("attacker", None), 1) for i, r in enumerate(rule_of) if r is not None}
+    next_pos = 0
+    n_batches = 0
+    n_fallback = 0
+    n_answered = n_samples = 0
+    n_escalated: Dict[str, int] = {}
+    n_tier = [0] * len(tiers)
+    pbar = tqdm(total=len(items), desc=f"Prompting ({args.mode})")
+
+    def flush() -> None:
+        """Write every position whose representative has an answer, in input order."""
+        nonlocal next_pos, n_answered, n_samples
+        while next_pos < len(items) and rep_of[next_pos] in done:
+            rep = rep_of[next_pos]
+            pr, k = done[rep]
+            pred, raw_text = pr[0], pr[1]
+            if last_use[rep] == next_pos:
+                del done[rep]
+            item = items[next_pos]
+            rec = {
+                "id": item.get("id"),
+                "attack_type": item.get("attack_type"),
+                "label": item.get("label"),
+                "pred": pred,
+                "mode": args.mode,
+                "provider": args.provider,
+                "model": args.model,
+                "raw_text": raw_text,
+                # keep optional fields if present
+                "msg_rcv_time": item.get("msg_rcv_time", None),
+                "source_file": item.get("source_file", None),
+            }
+            if args.batch_size > 1:
+                rec["batch_size"] = k
+            if args.dedup != "none":
+                rec["dup_of"] = None if rep == next_pos else items[rep].get("id")
+            if voting:
+                info = pr[2] if len(pr) > 2 else {"votes": None, "confidence": None, "samples": 0, "escalated": None}
+                if len(tiers) > 1 and len(pr) <= 2:
+                    info.update(tier=None, tier_model=None)
+                rec.update(info)
+                if info.get("tier"):
+                    # provider/model name the tier that produced the answer, so per-model metrics stay correct
+                    answered = tiers[info["tier"] - 1]
+                    rec["provider"], rec["model"] = answered["provider"], answered["model"]
+                if rep == next_pos and info["samples"]:
+                    n_answered += 1
+                    n_samples += info["samples"]
+                    if info.get("tier"):
+                        n_tier[info["tier"] - 1] += 1
+                    if info["escalated"]:
+                        n_escalated[info["escalated"]] = n_escalated.get(info["escalated"], 0) + 1
+            if prefilter is not None:
+                rec["engine"] = f"rules:{rule_of[rep]}" if rule_of[rep] else "llm"
+                if rule_of[rep]:
+                    # no model answered, so per-model metrics must not count this record
+                    rec["provider"] = rec["model"] = "rules"
+                    if "tier_model" in rec:
+                        rec["tier_model"] = "rules"
+            writer.write(rec)
+            next_pos += 1
+            pbar.update(1)
+            if acc is not None:
+                acc.update_record(rec)
+                if writer.n % args.snapshot_every == 0:
+                    acc.dump(Path(args.metrics_snapshot))
+                    pbar.set_postfix(acc=f"{acc.summary()['overall_accuracy']:.3f}")
+
+    try:
+        for idx, (preds, batch_ok) in results:
+            if len(idx) > 1:
+                n_batches += 1
+                n_fallback += 0 if batch_ok else 1
+            for i, pr in zip(idx, preds):
+                done[i] = (pr, len(idx))
+            flush()
+        # rule-labelled records after the last model answer
+        flush()
+    finally:
+        pbar.close()
+        writer.close()
+        instrument.close()
+        if vote_pool is not None:
+            vote_pool.shutdown()
+        if acc is not None:
+            acc.dump(Path(args.metrics_snapshot))
+    summary = instrument.summary(writer.n, args.price_prompt, args.price_completion)
+    print(f"Run: {summary['records']} records in {summary['wall_seconds']:.1f}s "
+          f"({summary['records_per_second']:.1f}/s), {summary['requests']} requests ({summary['retries']} retries), "
+          f"{summary['tokens_per_second']:.0f} tokens/s"
+          + (f", ${summary['cost_per_record_usd']:.6f}/record" if summary.get("cost_per_record_usd") is not None else ""))
+    if args.run_summary:
+        Path(args.run_summary).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.run_summary).write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    if voting:
+        print(f"Voting: {n_samples / max(1, n_answered):.2f} samples per record, escalated "
+              f"{sum(n_escalated.values())} of {n_answered} ({json.dumps(n_escalated)})")
+    if len(tiers) > 1:
+        print("Answered by tier: " + ", ".join(f"{k + 1} {m['model']}={c}" for k, (m, c) in enumerate(zip(tiers, n_tier))))
+    if n_batches:
+        print(f"Batched requests: {n_batches} (fell back to single calls: {n_fallback})")
+    print(f"Wrote predictions: {out}  (new={writer.n}, skipped={n_skipped})")
+    if cache is not None:
+        print(f"Cache: {json.dumps(cache.stats())}")
+        cache.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from model_clients import (CallRecord, Instrumentation, LLMClient, LLMResponse, call_status, estimate_tokens,
+                           is_retryable, retry_after_seconds)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_min`.
+
+    `acquire` reserves tokens immediately (the balance may go negative) and then
+    sleeps until the reservation is covered, so concurrent callers queue fairly.
+    """
+
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        self.target_rate = float(rate_per_min) / 60.0
+        self.rate = self.target_rate
+        self.capacity = float(capacity) if capacity is not None else float(rate_per_min) / 60.0 * 5.0
+        self.capacity = max(self.capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def scale(self, factor: float, floor: float = 0.05) -> None:
+        """Multiply the refill rate by `factor`, clamped to [floor * target, target]."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.target_rate, max(self.target_rate * floor, self.rate * factor))
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budgets with AIMD adaptation.
+
+    On a 429/5xx the allowed rate is halved; every success recovers it by a few
+    percent until it is back at the configured budget.
+    """
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, n_tokens: int = 1) -> float:
+        waited = 0.0
+        if self.requests is not None:
+            waited += self.requests.acquire(1)
+        if self.tokens is not None:
+            waited += self.tokens.acquire(n_tokens)
+        return waited
+
+    def _scale(self, factor: float) -> None:
+        for b in (self.requests, self.tokens):
+            if b is not None:
+                b.scale(factor)
+
+    def penalize(self) -> None:
+        self._scale(0.5)
+
+    def reward(self) -> None:
+        self._scale(1.05)
+
+def generate_with_retries(
+    client: LLMClient,
+    prompt: str,
+    limiter: Optional[RateLimiter] = None,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    instrument: Optional[Instrumentation] = None,
+) -> LLMResponse:
+    """Call `client.generate`, backing off exponentially (with jitter) on retryable errors.
+
+    With `instrument`, every attempt is recorded (limiter wait, latency, status, token usage).
+    A caching client (one with `lookup`/`fill`, e.g. CachedClient) is asked first, so cache
+    hits return at once without waiting for or spending rate-limit budget.
+    """
+    call = client.generate
+    if hasattr(client, "lookup"):
+        ts, t0 = time.time(), time.monotonic()
+        resp = client.lookup(prompt)
+        if resp is not None:
+            if instrument is not None:
+                instrument.record(CallRecord(ts, client.provider, client.model, 0, 0.0, 0.0,
+                                             time.monotonic() - t0, "cached"))
+            return resp
+        call = client.fill
+    n_tokens = (estimate_tokens(prompt) + estimate_tokens(getattr(client, "system_prompt", "") or "")
+                + int(getattr(client, "max_tokens", 0) or 0))
+    attempt = 0
+    backoff = 0.0
+    while True:
+        waited = limiter.acquire(n_tokens) if limiter is not None else 0.0
+        ts, t0 = time.time(), time.monotonic()
+        try:
+            resp = call(prompt)
+        except Exception as e:
+            if instrument is not None:
+                instrument.record(CallRecord(ts, client.provider, client.model, attempt, waited, backoff,
+                                             time.monotonic() - t0, call_status(e)))
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            if limiter is not None:
+                limiter.penalize()
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random())
+            time.sleep(delay)
+            backoff = delay
+            attempt += 1
+            continue
+        if instrument is not None:
+            usage = resp.usage or {}
+            instrument.record(CallRecord(ts, client.provider, client.model, attempt, waited, backoff,
+                                         time.monotonic() - t0, "cached" if resp.cached else "ok",
+                                         usage.get("prompt_tokens"), usage.get("completion_tokens")))
+        if limiter is not None:
+            limiter.reward()
+        return resp
+
+def iter_ordered(fn: Callable[[T], R], items: Iterable[T], concurrency: int = 1) -> Iterator[Tuple[T, R]]:
+    """Apply `fn` to `items` on a bounded thread pool, yielding (item, result) in input order.
+
+    At most `concurrency * 4` items are in flight, so memory stays bounded on large
+    inputs. Results are yielded as soon as every earlier item has completed.
+    """
+    concurrency = max(1, int(concurrency))
+    if concurrency == 1:
+        for item in items:
+            yield item, fn(item)
+        return
+
+    window = concurrency * 4
+    pending: Dict[int, Tuple[T, Future]] = {}
+    next_out = 0
+    it = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        for i, item in enumerate(it):
+            pending[i] = (item, ex.submit(fn, item))
+            while len(pending) >= window:
+                item_out, fut = pending.pop(next_out)
+                yield item_out, fut.result()
+                next_out += 1
+        while pending:
+            item_out, fut = pending.pop(next_out)
+            yield item_out, fut.result()
+            next_out += 1
+
+def iter_keyed_batches(items: Iterable[T], batch_size: int, key: Callable[[T], Hashable],
+                       window: int = 16) -> Iterator[List[T]]:
+    """Group items sharing `key` into batches of at most `batch_size`.
+
+    Grouping happens inside consecutive windows of `batch_size * window` items, so a
+    consumer restoring input order never buffers more than one window.
+    """
+    span = max(1, batch_size) * max(1, window)
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, span))
+        if not chunk:
+            return
+        groups: Dict[Hashable, List[T]] = {}
+        for x in chunk:
+            groups.setdefault(key(x), []).append(x)
+        for members in groups.values():
+            for i in range(0, len(members), batch_size):
+                yield members[i:i + batch_size]
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from model_clients import BATCH_TOKENS_PER_RECORD, build_client, load_spec, model_entries
+from prompt_sweep_groq import classify_chunk, load_log_csv, score_preds, split_dev_test
+from prompt_templates import PROMPTS
+from response_cache import CachedClient, ResponseCache
+from scheduler import RateLimiter, generate_with_retries
+from template_registry import CompiledTemplate, TemplateRegistry, compile_template
+
+TABLE_METRICS = ["n", "overall_accuracy", "unknown_rate", "attacker_accuracy", "genuine_accuracy",
+                 "precision", "recall", "f1"]
+TABLE_HEADER = (["attack", "provider", "model", "template", "mode", "split", "selected"] + TABLE_METRICS
+                + ["accuracy_ci_low", "accuracy_ci_high", "requests", "seconds"])
+
+@dataclass(frozen=True)
+class TemplateSpec:
+    name: str
+    mode: str = "zero_shot"
+    few_shot_examples: Optional[str] = None
+    text: Optional[str] = None  # custom template (same placeholders as PROMPTS); else PROMPTS[attack][mode]
+
+def template_entries(spec: Dict[str, Any]) -> List[TemplateSpec]:
+    """"templates": mode names and/or {"name", "mode", "few_shot_examples", "template" | "template_file"}."""
+    out = []
+    for t in spec.get("templates") or [spec.get("mode", "zero_shot")]:
+        if isinstance(t, str):
+            out.append(TemplateSpec(name=t, mode=t))
+            continue
+        text = t.get("template")
+        if t.get("template_file"):
+            text = Path(t["template_file"]).read_text(encoding="utf-8")
+        mode = t.get("mode", "zero_shot")
+        out.append(TemplateSpec(name=t.get("name") or mode, mode=mode,
+                                few_shot_examples=t.get("few_shot_examples"), text=text))
+    names = [t.name for t in out]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Template names must be unique, got {names}")
+    return out
+
+@dataclass
+class Cell:
+    """One (attack, model, template, split) evaluation; its requests run interleaved with every other cell's."""
+    attack: str
+    model: int
+    template: TemplateSpec
+    split: str
+    compiled: CompiledTemplate
+    texts: List[str]
+    labels: List[str]
+    preds: List[Optional[str]] = field(default_factory=list)
+    remaining: int = 0
+    requests: int = 0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    metrics: Optional[Dict[str, Any]] = None
+
+class SweepScheduler:
+    """Runs every cell of a grid on one shared thread pool.
+
+    Requests from all cells are queued round-robin, so cells progress together and the
+    sweep takes about as long as its slowest cell rather than the sum of all cells. Each
+    provider has one RateLimiter shared by all of its models and cells. As soon as every
+    template of an (attack, model) pair is scored on dev, the best one is queued on test.
+    """
+
+    def __init__(self, spec: Dict[str, Any], concurrency: int = 8, max_retries: int = 5, n_boot: int = 0,
+                 cache: Optional[ResponseCache] = None):
+        self.spec = spec
+        self.models = model_entries(spec)
+        self.templates = template_entries(spec)
+        attacks = spec.get("attacks") or "all"
+        self.attacks = list(PROMPTS) if attacks == "all" else list(attacks)
+        self.batch_size = int(spec.get("batch_size", 1))
+        self.concurrency = max(1, int(concurrency))
+        self.max_retries = max_retries
+        self.n_boot = n_boot
+
+        max_tokens = int(spec.get("max_tokens", 16))
+        if self.batch_size > 1:
+            max_tokens = max(max_tokens, BATCH_TOKENS_PER_RECORD * self.batch_size)
+        self.clients = []
+        for m in self.models:
+            client = build_client(m["provider"], m["model"], temperature=m["temperature"], max_tokens=max_tokens,
+                                  options=m["provider_options"])
+            self.clients.append(CachedClient(client, cache) if cache is not None else client)
+        limits = spec.get("rate_limits") or {}
+        self.limiters = {p: RateLimiter(rpm=v.get("rpm"), tpm=v.get("tpm")) for p, v in limits.items()
+                         if v.get("rpm") or v.get("tpm")}
+
+        self.registry = TemplateRegistry()
+        for attack in self.attacks:
+            for t in self.templates:
+                self.compile(attack, t)  # fail on a bad key or template before any request
+
+    def compile(self, attack: str, t: TemplateSpec) -> CompiledTemplate:
+        if t.text is None:
+            return self.registry.get(attack, t.mode, t.few_shot_examples)
+        return compile_template(t.text, self.registry.few_block(t.few_shot_examples), name=f"{attack}/{t.name}")
+
+    def _request(self, cell: Cell, start: int) -> Tuple[Cell, int, List[str], float]:
+        t0 = time.monotonic()
+        m = self.models[cell.model]
+        client, limiter = self.clients[cell.model], self.limiters.get(m["provider"])
+        preds = classify_chunk(lambda p: generate_with_retries(client, p, limiter=limiter, max_retries=self.max_retries),
+                               cell.compiled, cell.texts[start:start + self.batch_size])
+        return cell, start, preds, t0
+
+    def run(self, csv_path: Path) -> List[Cell]:
+        seed = int(self.spec.get("seed", 42))
+        dev_max = int(self.spec.get("dev_max", 200))
+        test_max = int(self.spec.get("test_max", 500))
+
+        # One dev/test split per attack, shared by every model and template; the CSV is read once.
+        logs = load_log_csv(csv_path)
+        splits = {}
+        for attack in self.attacks:
+            dev_df, test_df = split_dev_test(logs, attack_pos=attack, seed=seed)
+            test_n = min(len(test_df), test_max)
+            test_df = test_df.sample(n=test_n, random_state=seed) if test_n < len(test_df) else test_df
+            splits[attack] = (dev_df.iloc[:dev_max], test_df)
+            print(f"{attack}: dev {min(len(dev_df), dev_max)} / test {test_n} rows")
+
+        cells: List[Cell] = []
+        groups: Dict[Tuple[str, int], List[Cell]] = {}
+        for attack in self.attacks:
+            dev = splits[attack][0]
+            for mi in range(len(self.models)):
+                for t in self.templates:
+                    cell = Cell(attack, mi, t, "dev", self.compile(attack, t), dev["text"].tolist(), dev["label"].tolist())
+                    cells.append(cell)
+                    groups.setdefault((attack, mi), []).append(cell)
+
+        pbar = tqdm(total=0, desc="Sweep requests")
+        pending: Dict[Future, Cell] = {}
+        ex = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        def submit(new_cells: List[Cell]) -> None:
+            starts = [list(range(0, len(c.texts), self.batch_size)) for c in new_cells]
+            for c, s in zip(new_cells, starts):
+                c.preds = [None] * len(c.texts)
+                c.remaining = len(s)
+            pbar.total += sum(len(s) for s in starts)
+            pbar.refresh()
+            for j in range(max((len(s) for s in starts), default=0)):
+                for c, s in zip(new_cells, starts):
+                    if j < len(s):
+                        pending[ex.submit(self._request, c, s[j])] = c
+
+        def finish(cell: Cell) -> None:
+            cell.metrics = score_preds(cell.labels, cell.preds, n_boot=self.n_boot)
+            if cell.split != "dev":
+                return
+            group = groups[(cell.attack, cell.model)]
+            if all(c.metrics is not None for c in group):
+                # ties go to the first template listed, as in prompt_sweep_groq.py
+                best = max(group, key=lambda c: c.metrics["overall_accuracy"])
+                test = splits[cell.attack][1]
+                tcell = Cell(cell.attack, cell.model, best.template, "test", best.compiled,
+                             test["text"].tolist(), test["label"].tolist())
+                cells.append(tcell)
+                submit([tcell])
+                if tcell.remaining == 0:
+                    finish(tcell)
+
+        try:
+            submit(cells)
+            for c in list(cells):
+                if c.remaining == 0:
+                    finish(c)
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    pending.pop(fut)
+                    cell, start, preds, t0 = fut.result()
+                    cell.preds[start:start + len(preds)] = preds
+                    cell.requests += 1
+                    cell.started = t0 if cell.started is None else min(cell.started, t0)
+                    cell.remaining -= 1
+                    pbar.update(1)
+                    if cell.remaining == 0:
+                        cell.finished = time.monotonic()
+                        finish(cell)
+        except BaseException:
+            ex.shutdown(wait=False, cancel_futures=True)
+            raise
+        ex.shutdown()
+        pbar.close()
+        return cells
+
+def table_rows(cells: List[Cell], models: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    selected = {(c.attack, c.model, c.template.name) for c in cells if c.split == "test"}
+    rows = []
+    for c in cells:
+        ci = (c.metrics.get("ci") or {}).get("overall_accuracy", [None, None])
+        seconds = (c.finished - c.started) if c.started is not None and c.finished is not None else 0.0
+        rows.append({
+            "attack": c.attack, "provider": models[c.model]["provider"], "model": models[c.model]["model"],
+            "template": c.template.name, "mode": c.template.mode, "split": c.split,
+            "selected": (c.attack, c.model, c.template.name) in selected,
+            **{k: c.metrics[k] for k in TABLE_METRICS},
+            "accuracy_ci_low": ci[0], "accuracy_ci_high": ci[1], "requests": c.requests, "seconds": round(seconds, 3),
+        })
+    return rows
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Concurrent prompt sweep over attacks x models x templates "
+                                             "(dev selects the template, then test) with one results table.")
+    ap.add_argument("--grid", required=True, help="Grid spec JSON (see configs/sweep_grid_example.json).")
+    ap.add_argument("--csv_path", default=None, help="Labelled CSV (overrides the spec's csv_path).")
+    ap.add_argument("--out_csv", default="results/sweep_results.csv")
+    ap.add_argument("--out_json", default=None, help="Optional full metrics per cell (confusion matrix, CIs).")
+    ap.add_argument("--concurrency", type=int, default=8, help="Requests in flight across all cells.")
+    ap.add_argument("--max_retries", type=int, default=5)
+    ap.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap resamples for confidence intervals (0 = off).")
+    ap.add_argument("--cache", default=None, help="Optional SQLite response cache path (re-runs skip the network).")
+    ap.add_argument("--cache_max_entries", type=int, default=1_000_000)
+    return ap.parse_args()
+
+def main() -> None:
+    args = parse_args()
+    spec = load_spec(Path(args.grid))
+    csv_path = args.csv_path or spec.get("csv_path")
+    if not csv_path:
+        raise KeyError("No CSV given. Pass --csv_path or set 'csv_path' in the grid spec.")
+
+    cache = ResponseCache(Path(args.cache), max_entries=args.cache_max_entries) if args.cache else None
+    sweep = SweepScheduler(spec, concurrency=args.concurrency, max_retries=args.max_retries,
+                           n_boot=args.bootstrap, cache=cache)
+    print(f"Grid: {len(sweep.attacks)} attacks x {len(sweep.models)} models x {len(sweep.templates)} templates")
+
+    t0 = time.monotonic()
+    cells = sweep.run(Path(csv_path))
+    wall = time.monotonic() - t0
+
+    cells.sort(key=lambda c: (c.attack, c.model, c.split, c.template.name))
+    rows = table_rows(cells, sweep.models)
+    out = Path(args.out_csv)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open("w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=TABLE_HEADER)
+        w.writeheader()
+        w.writerows(rows)
+    if args.out_json:
+        Path(args.out_json).write_text(json.dumps([
+            {k: r[k] for k in ["attack", "provider", "model", "template", "split"]} | {"metrics": c.metrics}
+            for r, c in zip(rows, cells)
+        ], indent=2), encoding="utf-8")
+
+    for r in rows:
+        if r["split"] == "test":
+            print(f"{r['attack']:<26} {r['model']:<28} {r['template']:<16} test acc={r['overall_accuracy']:.3f}")
+    slowest = max((r["seconds"] for r in rows), default=0.0)
+    print(f"Wrote {len(rows)} rows to {out}  (wall {wall:.1f}s, slowest cell {slowest:.1f}s)")
+    if cache is not None:
+        print(f"Cache: {json.dumps(cache.stats())}")
+        cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import string
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from model_clients import SYSTEM_PROMPT, estimate_tokens
+from prompt_templates import PROMPTS, SINGLE_ANSWER, BATCH_ANSWER
+
+SLOT = "LOG_TEXT"
+FEW_SHOT_SLOT = "FEW_SHOT_EXAMPLES"
+
+def _placeholders(tmpl: str) -> List[str]:
+    return [name for _, name, _, _ in string.Formatter().parse(tmpl) if name is not None]
+
+def validate_template(tmpl: str, name: str = "template") -> None:
+    """Exactly one {LOG_TEXT}, at most one {FEW_SHOT_EXAMPLES} before it, nothing else."""
+    names = _placeholders(tmpl)
+    unknown = sorted(set(names) - {SLOT, FEW_SHOT_SLOT})
+    if unknown:
+        raise ValueError(f"{name}: unknown placeholder(s) {unknown}; allowed: {{{SLOT}}}, {{{FEW_SHOT_SLOT}}}")
+    if names.count(SLOT) != 1:
+        raise ValueError(f"{name}: expected exactly one {{{SLOT}}}, found {names.count(SLOT)}")
+    if names.count(FEW_SHOT_SLOT) > 1 or (FEW_SHOT_SLOT in names and names.index(FEW_SHOT_SLOT) > names.index(SLOT)):
+        raise ValueError(f"{name}: {{{FEW_SHOT_SLOT}}} must appear at most once, before {{{SLOT}}}")
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """A template with the few-shot block already spliced in: prompt = prefix + log_text + suffix.
+
+    Character counts of the static parts are cached, so token estimates for a record
+    need only len(log_text) and match `estimate_tokens` on the rendered prompt exactly.
+    """
+    prefix: str
+    suffix: str
+    batch_prefix: str
+    batch_suffix: str  # still holds {K}
+    name: str = ""
+    few_at: int = -1        # offset of the few-shot block in prefix (-1: no {FEW_SHOT_EXAMPLES} slot)
+    batch_few_at: int = -1  # same, in batch_prefix
+    few_len: int = 0
+    static_chars: int = field(init=False)
+    prefix_tokens: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "static_chars", len(self.prefix) + len(self.suffix))
+        object.__setattr__(self, "prefix_tokens", estimate_tokens(self.prefix))
+
+    def render(self, log_text: str) -> str:
+        return self.prefix + log_text + self.suffix
+
+    def render_batch(self, log_texts: Sequence[str]) -> str:
+        """K records under the shared preamble, answered with BATCH_ANSWER before the final "Answer:"."""
+        records = "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(log_texts, 1))
+        return self.batch_prefix + records + self.batch_suffix.replace("{K}", str(len(log_texts)))
+
+    def with_examples(self, few_block: str) -> "CompiledTemplate":
+        """The same template with a different few-shot block (e.g. retrieved per record); no re-parsing."""
+        if self.few_at < 0:
+            raise ValueError(f"{self.name}: template has no {{{FEW_SHOT_SLOT}}} slot")
+        end, bend = self.few_at + self.few_len, self.batch_few_at + self.few_len
+        return CompiledTemplate(self.prefix[:self.few_at] + few_block + self.prefix[end:], self.suffix,
+                                self.batch_prefix[:self.batch_few_at] + few_block + self.batch_prefix[bend:],
+                                self.batch_suffix, self.name, self.few_at, self.batch_few_at, len(few_block))
+
+    def prompt_tokens(self, log_text_chars: int) -> int:
+        return max(1, (self.static_chars + log_text_chars) // 4)
+
+    def batch_prompt_tokens(self, log_text_chars: Sequence[int]) -> int:
+        k = len(log_text_chars)
+        marks = sum(len(f"[{i}]\n") for i in range(1, k + 1)) + 2 * (k - 1)
+        static = len(self.batch_prefix) + len(self.batch_suffix) + (len(str(k)) - 3) * self.batch_suffix.count("{K}")
+        return max(1, (static + marks + sum(log_text_chars)) // 4)
+
+def compile_template(tmpl: str, few_block: str = "", name: str = "template") -> CompiledTemplate:
+    """Validate `tmpl` and split it around {LOG_TEXT} with the few-shot block filled in."""
+    validate_template(tmpl, name)
+    head, tail = tmpl.split("{" + SLOT + "}")
+
+    def fill(part: str) -> Tuple[str, int]:
+        # str.format also resolves {{ }} escapes; returns the text and the few-shot block offset
+        if FEW_SHOT_SLOT not in _placeholders(part):
+            return part.format(), -1
+        pre, post = part.split("{" + FEW_SHOT_SLOT + "}")
+        pre = pre.format()
+        return pre + few_block + post.format(), len(pre)
+
+    prefix, few_at = fill(head)
+    suffix = tail.format()
+    batch_prefix, batch_few_at = fill(head.replace(SINGLE_ANSWER + "\n\n", ""))
+    batch_suffix = tail.replace(SINGLE_ANSWER + "\n\n", "").format()
+    batch_suffix = batch_suffix.replace("Answer:", BATCH_ANSWER + "\n\nAnswer:")
+    return CompiledTemplate(prefix, suffix, batch_prefix, batch_suffix, name=name,
+                            few_at=few_at, batch_few_at=batch_few_at, few_len=len(few_block) if few_at >= 0 else 0)
+
+class TemplateRegistry:
+    """Compiles each (attack, mode, few-shot file) once; every PROMPTS entry is validated on load."""
+
+    def __init__(self, prompts: Dict[str, Dict[str, str]] = PROMPTS):
+        self.prompts = prompts
+        for attack, modes in prompts.items():
+            for mode, tmpl in modes.items():
+                validate_template(tmpl, f"PROMPTS[{attack!r}][{mode!r}]")
+        self._few_blocks: Dict[str, str] = {}
+        self._compiled: Dict[Tuple[str, str, Optional[str]], CompiledTemplate] = {}
+
+    def few_block(self, path: Optional[str]) -> str:
+        if not path:
+            return ""
+        if path not in self._few_blocks:
+            self._few_blocks[path] = Path(path).read_text(encoding="utf-8")
+        return self._few_blocks[path]
+
+    def get(self, attack: str, mode: str, few_shot_path: Optional[str] = None) -> CompiledTemplate:
+        if attack not in self.prompts:
+            raise KeyError(f"Attack key '{attack}' not found in PROMPTS. Available: {list(self.prompts.keys())}")
+        if mode not in self.prompts[attack]:
+            raise KeyError(f"Mode '{mode}' not found for attack '{attack}'. Available: {list(self.prompts[attack])}")
+        key = (attack, mode, few_shot_path if mode == "few_shot" else None)
+        if key not in self._compiled:
+            self._compiled[key] = compile_template(self.prompts[attack][mode], self.few_block(key[2]),
+                                                   name=f"{attack}/{mode}")
+        return self._compiled[key]
+
+@dataclass
+class TokenBudget:
+    """Predicted usage of a run before dispatch (same estimator the TPM limiter uses)."""
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens: int, max_tokens: int, system_prompt: str = SYSTEM_PROMPT) -> None:
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens + estimate_tokens(system_prompt)
+        self.completion_tokens += max_tokens
+
+    def minutes(self, rpm: Optional[float] = None, tpm: Optional[float] = None) -> Optional[float]:
+        """Lower bound on wall time under the given budgets (None when unthrottled).
+
+        The limiter reserves prompt estimate + max_tokens per request, as counted here.
+        """
+        bounds = []
+        if rpm:
+            bounds.append(self.requests / rpm)
+        if tpm:
+            bounds.append(self.total_tokens / tpm)
+        return max(bounds) if bounds else None
+
+    def describe(self, rpm: Optional[float] = None, tpm: Optional[float] = None) -> str:
+        s = (f"{self.requests} requests, ~{self.prompt_tokens} prompt + {self.completion_tokens} completion tokens "
+             f"(~{self.total_tokens / max(1, self.requests):.0f}/request)")
+        m = self.minutes(rpm, tpm)
+        if m is not None:
+            s += f", >= {m:.1f} min at the configured rpm/tpm"
+        return s
+
+def plan_budget(batches: Sequence[Tuple[CompiledTemplate, Sequence[str]]], max_tokens: int,
+                system_prompt: str = SYSTEM_PROMPT, batch_max_tokens: Optional[int] = None) -> TokenBudget:
+    """Token budget for a list of (template, log texts) requests; one text means a single-record prompt.
+
+    Batched requests reserve `batch_max_tokens` (default `max_tokens`) completion tokens.
+    """
+    budget = TokenBudget()
+    for ct, texts in batches:
+        chars = [len(t) for t in texts]
+        if len(chars) == 1:
+            budget.add(ct.prompt_tokens(chars[0]), max_tokens, system_prompt)
+        else:
+            budget.add(ct.batch_prompt_tokens(chars), batch_max_tokens or max_tokens, system_prompt)
+    return budget
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# One sample of a request: (label, raw_text) per record, in record order.
+Sample = List[Tuple[str, str]]
+
+class Tally:
+    """Self-consistency votes for one record. Unparsable samples count as "unknown" and back no label."""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {"attacker": 0, "genuine": 0, "unknown": 0}
+        self.raw: Dict[str, str] = {}
+
+    @property
+    def n(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, label: str, raw: str) -> None:
+        self.counts[label] += 1
+        self.raw.setdefault(label, raw)
+
+    def lead(self) -> int:
+        return abs(self.counts["attacker"] - self.counts["genuine"])
+
+    def needed(self, max_votes: int) -> int:
+        """Fewest further samples that could settle the vote (0 = settled).
+
+        The vote is settled once the lead exceeds the samples still to come, since no
+        outcome of those can then overturn or tie it.
+        """
+        left = max_votes - self.n
+        if self.lead() > left:
+            return 0
+        return min(left, (left - self.lead()) // 2 + 1)
+
+    def winner(self) -> str:
+        a, g = self.counts["attacker"], self.counts["genuine"]
+        return "attacker" if a > g else "genuine" if g > a else "unknown"
+
+    def confidence(self) -> float:
+        """Share of samples backing the winner (0 on a tie)."""
+        w = self.winner()
+        return self.counts[w] / self.n if self.n and w != "unknown" else 0.0
+
+    def margin(self) -> float:
+        return self.lead() / self.n if self.n else 0.0
+
+    def result(self) -> Tuple[str, Optional[str]]:
+        """(pred, raw_text of the first sample that voted for it)."""
+        w = self.winner()
+        return w, self.raw.get(w, next(iter(self.raw.values()), None))
+
+    def info(self) -> Dict[str, Any]:
+        return {"votes": dict(self.counts), "confidence": round(self.confidence(), 4), "samples": self.n}
+
+def run_votes(sample: Callable[[int], Sample], tallies: List[Tally], max_votes: int,
+              pool: Optional[ThreadPoolExecutor] = None) -> int:
+    """Draw samples into `tallies` until every vote is settled or `max_votes` samples are in.
+
+    `sample(j)` answers the request a j-th time. Each wave sends just enough samples
+    concurrently to possibly settle the closest vote (a majority of `max_votes` at first),
+    so unanimous records stop early. Tallies that already hold samples continue from
+    there (escalation). Returns the number of samples drawn.
+    """
+    drawn = 0
+    j = min(t.n for t in tallies)
+    while True:
+        w = max(t.needed(max_votes) for t in tallies)
+        if w <= 0:
+            return drawn
+        waves = range(j, j + w)
+        outs = list(pool.map(sample, waves)) if pool is not None and w > 1 else [sample(s) for s in waves]
+        for out in outs:
+            for t, (label, raw) in zip(tallies, out):
+                t.add(label, raw)
+        j += w
+        drawn += w
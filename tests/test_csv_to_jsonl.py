@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "data_preprocessing"))
+from csv_to_jsonl import iter_chunks, iter_records
+
+def write_csv(path: Path, n: int = 50, missing_at: int = 45) -> None:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "msg_rcv_time": rng.uniform(0, 100, n),
+        "hv_pos_x": rng.uniform(0, 500, n), "hv_pos_y": rng.uniform(0, 500, n),
+        "hv_speed": rng.uniform(0, 30, n), "hv_heading": rng.uniform(0, 360, n),
+        "rv_pos_x": rng.uniform(0, 500, n), "rv_pos_y": rng.uniform(0, 500, n),
+        "rv_speed": rng.uniform(0, 30, n), "rv_heading": rng.uniform(0, 360, n),
+        "rv_id": 1, "hv_id": pd.array([2] * n, dtype="Int64"), "target_id": -1, "eebl_warn": 0, "ima_warn": 1,
+        "attack_type": ["Genuine", "DoS"] * (n // 2),
+    })
+    df.loc[missing_at, "hv_id"] = pd.NA
+    df.to_csv(path, index=False)
+
+def test_text_does_not_depend_on_chunksize(tmp_path):
+    f = tmp_path / "log.csv"
+    write_csv(f)
+    runs = [[r["text"] for r in iter_records(iter_chunks([f], chunksize, None))] for chunksize in (20, 200_000)]
+    assert runs[0] == runs[1]
+    assert "from vehicle 2 at" in runs[0][40]
+    assert "from vehicle nan at" in runs[0][45]
+
+def test_parquet_text_matches_jsonl(tmp_path):
+    pytest.importorskip("pyarrow")
+    from csv_to_jsonl import chunk_table
+    from dataset_io import load_records, write_parquet_part
+
+    f = tmp_path / "log.csv"
+    write_csv(f)
+    jsonl = [r["text"] for r in iter_records(iter_chunks([f], 20, None))]
+    for k, df in enumerate(iter_chunks([f], 20, None)):
+        write_parquet_part(chunk_table(df), tmp_path / "pq", f"{k:06d}")
+    assert [r["text"] for r in load_records(tmp_path / "pq")] == jsonl
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "data_preprocessing"))
+pytest.importorskip("pyarrow")
+from dataset_io import chunk_to_table, load_records, write_parquet_part
+from utils_data import labels_from_attack_types, render_text_column
+
+def make_chunk(start: int, n: int, missing_hv_id: bool) -> pd.DataFrame:
+    rng = np.random.default_rng(start)
+    df = pd.DataFrame({
+        "rv_id": np.arange(start, start + n) % 7,
+        "hv_id": np.arange(start, start + n) % 11,
+        "msg_rcv_time": rng.uniform(0, 100, n),
+        "hv_pos_x": rng.uniform(0, 500, n), "hv_pos_y": rng.uniform(0, 500, n),
+        "hv_speed": rng.uniform(0, 30, n), "hv_heading": rng.uniform(0, 360, n),
+        "rv_pos_x": rng.uniform(0, 500, n), "rv_pos_y": rng.uniform(0, 500, n),
+        "rv_speed": rng.uniform(0, 30, n), "rv_heading": rng.uniform(0, 360, n),
+        "target_id": np.zeros(n, dtype=np.int64), "eebl_warn": np.zeros(n, dtype=np.int64),
+        "ima_warn": np.ones(n, dtype=np.int64),
+        "attack_type": ["Genuine", "DoS"] * (n // 2),
+        "_source_file": "a.csv",
+    }, index=range(start, start + n))
+    if missing_hv_id:
+        df.loc[start + 1, "hv_id"] = np.nan  # pandas turns the whole column into float64
+    return df
+
+def test_chunks_with_and_without_nan_share_one_schema(tmp_path):
+    chunks = [make_chunk(0, 10, False), make_chunk(10, 10, True), make_chunk(20, 10, False)]
+    for k, df in enumerate(chunks):
+        at = df["attack_type"].tolist()
+        write_parquet_part(chunk_to_table(df, df.index.tolist(), at, labels_from_attack_types(at)), tmp_path, f"{k:06d}")
+
+    recs = load_records(tmp_path)
+    assert [r["id"] for r in recs] == list(range(30))
+    assert recs[11]["hv_id"] is None and recs[12]["hv_id"] == 1
+    # ids render as integers in every chunk; the missing one renders like a NaN in the source
+    assert "from vehicle nan at" in recs[11]["text"]
+    assert "from vehicle 1 at" in recs[12]["text"]
+    clean = pd.concat(chunks).drop(index=11)
+    clean["hv_id"] = clean["hv_id"].astype(np.int64)
+    assert [r["text"] for r in recs if r["id"] != 11] == render_text_column(clean)
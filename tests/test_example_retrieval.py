@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "prompting"))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "data_preprocessing"))
+from example_retrieval import ExampleIndex
+from utils_data import render_text_column
+
+def make_frame(n: int = 200) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({name: rng.uniform(0, 500, n) for name in
+                       ["hv_pos_x", "hv_pos_y", "hv_speed", "hv_heading", "rv_pos_x", "rv_pos_y", "rv_speed", "rv_heading"]})
+    df["msg_rcv_time"] = rng.uniform(0, 100, n)
+    df["rv_id"], df["hv_id"], df["target_id"], df["eebl_warn"], df["ima_warn"] = 1, np.arange(n), -1, 0, 0
+    df["attack_type"] = np.where(np.arange(n) % 2 == 0, "Genuine", "DoS")
+    df["label"] = np.where(df["attack_type"] == "Genuine", "genuine", "attacker")
+    df["text"] = render_text_column(df)
+    df["id"] = np.arange(n)
+    return df[["id", "attack_type", "label", "text"]]
+
+def test_query_never_returns_the_record_itself():
+    pool = make_frame()
+    index = ExampleIndex(pool)
+    for balanced in (True, False):
+        rows = index.query(pool, pool["attack_type"].tolist(), k=4, balanced=balanced)
+        assert (rows >= 0).all()
+        assert not any(index.texts[i] == text for r, text in zip(rows, pool["text"]) for i in r)
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "data_preprocessing"))
+from sample_subset import assign_grouped, group_key
+from utils_data import render_text_column
+
+def make_records() -> list:
+    """Two CSVs whose vehicles reuse the same ids 0..4, eight messages per vehicle (JSONL shape)."""
+    rows = [{"rv_id": 100, "hv_id": hv, "src": src, "label": "attacker" if hv % 3 == 0 else "genuine"}
+            for src in ["a.csv", "b.csv"] for hv in range(5) for _ in range(8)]
+    df = pd.DataFrame(rows)
+    texts = render_text_column(df)
+    return [{"id": i, "label": r["label"], "text": t, "source_file": r["src"]}
+            for i, (r, t) in enumerate(zip(rows, texts))]
+
+def test_group_by_hv_id_reads_jsonl_text_per_source_file():
+    recs = make_records()
+    assert len({group_key(r, "hv_id") for r in recs}) == 10
+
+    folds = {}
+    for f, rec in assign_grouped(lambda: recs, [0.5, 0.5], 42, "hv_id", False):
+        assert folds.setdefault(group_key(rec, "hv_id"), f) == f
+    assert sorted(list(folds.values()).count(f) for f in (0, 1)) == [5, 5]
+
+def test_group_by_missing_field_raises():
+    recs = [{"id": 0, "label": "genuine", "source_file": "a.csv"}]
+    with pytest.raises(ValueError, match="hv_id"):
+        list(assign_grouped(lambda: recs, [0.5, 0.5], 42, "hv_id", False))